@@ -1,10 +1,15 @@
 import warnings
 import datetime
 from config import api_key
-from typing import Dict, Union, List, Callable, Any
-import requests
+from typing import Dict, Union, List, Callable, Any, Optional, Tuple
 import pandas as pd
 import asyncio
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from http_utils import AdaptiveRateLimiter, HttpClient
+from candles import candles_to_df
+from market_calendar import trading_windows
 
 def datetime_to_ms_epoch(dtime: datetime.datetime) -> str:
     return str(int(dtime.timestamp())*1000)
@@ -119,15 +124,46 @@ class EmptyApiRequest(Exception):
 
 
 class PriceHistory:
+    __CANDLE_COLUMNS = {'open': float, 'high': float, 'low': float, 'close': float, 'volume': 'int64'}
     __MAX_INTRADAY_BACKWARD_DAYS = 30 # number of calendar days that the api lets us look back for intraday data
+    __MAX_INTRADAY_WINDOW_DAYS = 10 # number of calendar days that a single intraday request may span
+    __MAX_DAILY_WINDOW_DAYS = 183 # number of calendar days that a single daily request may span
     __REQ_PER_SEC_CAP = 100 # maximum number of requests the API can process per second
+    __shared_client = None # keep-alive pool shared by every PriceHistory that isn't given its own client
+    BASE_URL = 'https://api.tdameritrade.com' # may be pointed elsewhere, e.g. at a local stand-in for benchmarks
+    CACHE_TTL = 5*60 # seconds that cached responses for windows that are still open stay valid
+    CACHE_SETTLE_SECONDS = 24*60*60 # windows that ended longer ago than this are closed, and their responses never expire
+
+    def __init__(self, api_key, client: HttpClient = None, cache=None):
+        """
+        Arguments:
+            api_key {str}
+
+        Keyword Arguments:
+            client {HttpClient} -- Client to make the requests with; if None, then the shared client. (default: {None})
+            cache {ResponseCache} -- Cache of responses to check before making a request; if None, then
+                                        every request goes to the API. (default: {None})
+        """
 
-    def __init__(self, api_key):
         self.api_key = api_key
+        self.client = client or PriceHistory.shared_client()
+        self.cache = cache
         return
-    
-    def make_api_call(self, phr: PriceHistoryRequest) -> Dict:
-        endpoint = r'https://api.tdameritrade.com/v1/marketdata/{}/pricehistory'.format(phr.symbol)
+
+    @staticmethod
+    def shared_client() -> HttpClient:
+        if PriceHistory.__shared_client is None:
+            rate_limiter = AdaptiveRateLimiter(PriceHistory.__REQ_PER_SEC_CAP) # starts at the documented limit, and adapts to the observed one
+            PriceHistory.__shared_client = HttpClient(pool_size=PriceHistory.__REQ_PER_SEC_CAP, max_concurrency=PriceHistory.__REQ_PER_SEC_CAP, rate_limiter=rate_limiter)
+        return PriceHistory.__shared_client
+
+    @staticmethod
+    def req_per_sec_cap() -> int:
+        return PriceHistory.__REQ_PER_SEC_CAP
+
+    @staticmethod
+    def __build_request(phr: PriceHistoryRequest):
+        endpoint = r'{}/v1/marketdata/{}/pricehistory'.format(PriceHistory.BASE_URL, phr.symbol)
 
         payload = {
             'apikey': phr.api_key,
@@ -149,37 +185,64 @@ class PriceHistory:
         if phr.period != '': 
             payload['period'] = phr.period
 
-        content = requests.get(url=endpoint, params=payload).json()
+        return endpoint, payload
+
+    @staticmethod
+    def __check_content(content: Dict) -> Dict:
         if ('empty' in content.keys() and content['empty'] == True):
             raise EmptyApiRequest()
 
         elif ('error' in content.keys()):
-            print(content)
-            raise BadApiRequest()
+            raise BadApiRequest(content['error'])
+        return content
+
+    @staticmethod
+    def __cache_ttl(payload: Dict) -> Optional[float]:
+        """Seconds that a response stays valid, or None if its window is closed and the response will never change.
+        """
+
+        end = int(payload.get('endDate') or 0)/1000
+        if 0 < end < time.time() - PriceHistory.CACHE_SETTLE_SECONDS:
+            return None
+        return PriceHistory.CACHE_TTL
+
+    def make_api_call(self, phr: PriceHistoryRequest) -> Dict:
+        endpoint, payload = PriceHistory.__build_request(phr)
+        content = self.cache.get(endpoint, payload) if self.cache is not None else None
+        if content is None:
+            content = PriceHistory.__check_content(self.client.get_json(endpoint, payload))
+            if self.cache is not None: # only valid responses make it this far
+                self.cache.put(endpoint, payload, content, PriceHistory.__cache_ttl(payload))
+        return content
+
+    async def make_api_call_async(self, phr: PriceHistoryRequest) -> Dict:
+        endpoint, payload = PriceHistory.__build_request(phr)
+        content = self.cache.get(endpoint, payload) if self.cache is not None else None
+        if content is None:
+            content = PriceHistory.__check_content(await self.client.get_json_async(endpoint, payload))
+            if self.cache is not None: # only valid responses make it this far
+                self.cache.put(endpoint, payload, content, PriceHistory.__cache_ttl(payload))
         return content
     
-    def __json_dict_to_df(self, json_dict: Dict) -> pd.DataFrame:
-        data_df = pd.DataFrame(json_dict['candles']).set_index('datetime')
-        data_df.index = pd.Series([ms_epoch_to_datetime(ep) for ep in data_df.index], name='datetime')
-        return data_df
+    @staticmethod
+    def json_dict_to_df(json_dict: Dict) -> pd.DataFrame:
+        return candles_to_df(json_dict['candles'], 'datetime', 'ms', PriceHistory.__CANDLE_COLUMNS)
     
     async def __get_api_call_tasks(self, symbols: List[str], async_func: Callable, params: Dict):
         tasks = []
-        for i, symbol in enumerate(symbols):
-            if (i > 0) and  (i % PriceHistory.__REQ_PER_SEC_CAP == 0): # slow down so as to not break the API limits
-                await asyncio.sleep(1)
-
-            tasks.append(asyncio.create_task(async_func(symbol=symbol, **params)))
-            # tasks.append(async_func(symbol=symbol, **params))
-            
-        all_api_tasks = asyncio.gather(*tasks)
-        return all_api_tasks
+        try:
+            for symbol in symbols: # the client's rate limiter keeps the requests within the API's limits
+                tasks.append(asyncio.create_task(async_func(symbol=symbol, **params)))
+                
+            return await asyncio.gather(*tasks)
+        finally:
+            await self.client.aclose() # the async session can't outlive this event loop
 
     def multi_security_pull_async(self, symbols: List[str], async_func: Callable, params: Dict) -> Dict[str, Any]:
         all_api_tasks = self.__get_api_call_tasks(symbols, async_func, params)
 
         # block until the api requests have finished processing
-        results = asyncio.run(all_api_tasks).result()
+        results = asyncio.run(all_api_tasks)
 
         mapped_results = {symbols[i] : results[i] for i in range(len(symbols))}
 
@@ -199,7 +262,65 @@ class PriceHistory:
 
         return {symbol: func(symbol=symbol, **params) for symbol in symbols}
     
-    def _minute_data_all(self, symbol, start_date: datetime.datetime, end_date: datetime.datetime = None, need_extended_hours: bool=False) -> Dict:
+    @staticmethod
+    def plan_windows(start_date: datetime.datetime, end_date: datetime.datetime = None, frequency_type: str = 'minute') -> List[Tuple[datetime.datetime, datetime.datetime]]:
+        """
+        Split a date range into the requests the API accepts: intraday requests can't look back more than
+        __MAX_INTRADAY_BACKWARD_DAYS, and each request spans a limited number of days. Days on which the
+        market is closed (weekends and holidays) are skipped, so a range without trading days needs no request.
+
+        Arguments:
+            start_date {datetime.datetime}
+            end_date {datetime.datetime} -- If None, then now.
+            frequency_type {str} -- 'minute' or 'daily'.
+
+        Returns:
+            List[Tuple[datetime.datetime, datetime.datetime]] -- (start, end) of each request, oldest first.
+        """
+
+        end_date = end_date or datetime.datetime.now()
+        if frequency_type == 'minute':
+            start_date = max(start_date, PriceHistory.max_minute_start())
+            max_days = PriceHistory.__MAX_INTRADAY_WINDOW_DAYS
+        else:
+            max_days = PriceHistory.__MAX_DAILY_WINDOW_DAYS
+        return trading_windows(start_date, end_date, max_days)
+
+    @staticmethod
+    def __merge_responses(symbol: str, contents: List[Optional[Dict]]) -> Dict:
+        """Merge the responses to a range's requests (None for the empty ones) into a single response.
+        """
+
+        responses = [content for content in contents if content is not None]
+        if len(contents) > 0 and len(responses) == 0: # every request came back empty, as a single request would have
+            raise EmptyApiRequest()
+        candles = [candle for content in responses for candle in content['candles']] # the windows are in order and don't overlap
+        return {'candles': candles, 'symbol': symbol, 'empty': len(candles) == 0}
+
+    def __call_windows(self, symbol: str, phrs: List[PriceHistoryRequest]) -> Dict:
+
+        def call(phr):
+            try:
+                return self.make_api_call(phr)
+            except EmptyApiRequest: # e.g. the symbol didn't trade in this window
+                return None
+
+        with ThreadPoolExecutor(max_workers=max(1, len(phrs))) as executor:
+            # each request runs in a copy of the caller's context, so that it is instrumented (e.g. attributed to the symbol) as the caller's
+            futures = [executor.submit(contextvars.copy_context().run, call, phr) for phr in phrs]
+            return PriceHistory.__merge_responses(symbol, [future.result() for future in futures])
+
+    async def __call_windows_async(self, symbol: str, phrs: List[PriceHistoryRequest]) -> Dict:
+
+        async def call(phr):
+            try:
+                return await self.make_api_call_async(phr)
+            except EmptyApiRequest: # e.g. the symbol didn't trade in this window
+                return None
+
+        return PriceHistory.__merge_responses(symbol, await asyncio.gather(*[call(phr) for phr in phrs]))
+
+    def __minute_request(self, symbol, start_date: datetime.datetime, end_date: datetime.datetime = None, need_extended_hours: bool=False) -> PriceHistoryRequest:
         phr = PriceHistoryRequest()
         phr.symbol = symbol
         phr.api_key = self.api_key
@@ -208,34 +329,56 @@ class PriceHistory:
         phr.start_date = start_date
         phr.end_date = end_date or datetime.datetime.now()
         phr.need_extended_hours = 'true' if need_extended_hours else 'false'
-        
-        data = self.make_api_call(phr)
-        return data
+        return phr
+
+    def __minute_requests(self, symbol, start_date: datetime.datetime, end_date: datetime.datetime = None, need_extended_hours: bool=False) -> List[PriceHistoryRequest]:
+        windows = PriceHistory.plan_windows(start_date, end_date, 'minute')
+        return [self.__minute_request(symbol, start, end, need_extended_hours) for start, end in windows]
+
+    def _minute_data_all(self, symbol, start_date: datetime.datetime, end_date: datetime.datetime = None, need_extended_hours: bool=False) -> Dict:
+        phrs = self.__minute_requests(symbol, start_date, end_date, need_extended_hours)
+        return self.__call_windows(symbol, phrs)
     
-    async def _minute_data_all_async(self, symbol, start_date: datetime.datetime, end_date: datetime.datetime = None, need_extended_hours: bool=False):
-        return self._minute_data_all(symbol, start_date, end_date, need_extended_hours)
+    async def _minute_data_all_async(self, symbol, start_date: datetime.datetime, end_date: datetime.datetime = None, need_extended_hours: bool=False) -> Dict:
+        phrs = self.__minute_requests(symbol, start_date, end_date, need_extended_hours)
+        return await self.__call_windows_async(symbol, phrs)
+
+    @staticmethod
+    def __in_range(price_data: pd.DataFrame, start_date: datetime.datetime, end_date: datetime.datetime = None) -> pd.DataFrame:
+        inrange = price_data.index >= start_date
+        if end_date is not None:
+            inrange &= price_data.index <= end_date
+        return price_data[inrange]
     
     def minute_data(self, symbol, start_date: datetime.datetime, end_date: datetime.datetime = None, need_extended_hours: bool=False) -> pd.DataFrame:
         json_dict_data = self._minute_data_all(symbol, start_date, end_date, need_extended_hours)
-        price_data = self.__json_dict_to_df(json_dict_data)
+        price_data = PriceHistory.json_dict_to_df(json_dict_data)
 
-        
-        return price_data[price_data.index >= start_date]
+        return PriceHistory.__in_range(price_data, start_date, end_date)
+
+    async def minute_data_async(self, symbol, start_date: datetime.datetime, end_date: datetime.datetime = None, need_extended_hours: bool=False) -> pd.DataFrame:
+        json_dict_data = await self._minute_data_all_async(symbol, start_date, end_date, need_extended_hours)
+        price_data = PriceHistory.json_dict_to_df(json_dict_data)
 
-    async def minute_data_async(self, symbol, start_date: datetime.datetime, end_date: datetime.datetime = None, need_extended_hours: bool=False):
-        return self.minute_data(symbol, start_date, end_date, need_extended_hours)
+        return PriceHistory.__in_range(price_data, start_date, end_date)
+
+    @staticmethod
+    def max_minute_start() -> datetime.datetime:
+        # the first whole day within the API's allowed start, so that the windows (and their cached responses) stay the same all day
+        earliest = datetime.datetime.now() - datetime.timedelta(days=PriceHistory.__MAX_INTRADAY_BACKWARD_DAYS)
+        return datetime.datetime.combine(earliest.date() + datetime.timedelta(days=1), datetime.time.min)
 
     def max_minute_data(self, symbol):
-        # go back beyond the API's allowed start
-        pre_max_period = datetime.timedelta(days=60)
-        start = datetime.datetime.now() - pre_max_period
+        start = PriceHistory.max_minute_start()
 
         return self.minute_data(symbol, start, need_extended_hours=True)
 
     async def max_minute_data_async(self, symbol):
-        return self.max_minute_data(symbol)
-    
-    def _day_data_all(self, symbol, start_date: datetime.datetime, end_date: datetime.datetime = None, need_extended_hours: bool=False) -> Dict:
+        start = PriceHistory.max_minute_start()
+
+        return await self.minute_data_async(symbol, start, need_extended_hours=True)
+
+    def __day_request(self, symbol, start_date: datetime.datetime, end_date: datetime.datetime = None, need_extended_hours: bool=False) -> PriceHistoryRequest:
         phr = PriceHistoryRequest()
         phr.symbol = symbol
         phr.api_key = self.api_key
@@ -246,12 +389,27 @@ class PriceHistory:
         phr.start_date = start_date
         phr.end_date = end_date or datetime.datetime.now()
         phr.need_extended_hours = 'true' if need_extended_hours else 'false'
-        data = self.make_api_call(phr)
-        return data
+        return phr
+
+    def __day_requests(self, symbol, start_date: datetime.datetime, end_date: datetime.datetime = None, need_extended_hours: bool=False) -> List[PriceHistoryRequest]:
+        windows = PriceHistory.plan_windows(start_date, end_date, 'daily')
+        return [self.__day_request(symbol, start, end, need_extended_hours) for start, end in windows]
+
+    def _day_data_all(self, symbol, start_date: datetime.datetime, end_date: datetime.datetime = None, need_extended_hours: bool=False) -> Dict:
+        phrs = self.__day_requests(symbol, start_date, end_date, need_extended_hours)
+        return self.__call_windows(symbol, phrs)
+
+    async def _day_data_all_async(self, symbol, start_date: datetime.datetime, end_date: datetime.datetime = None, need_extended_hours: bool=False) -> Dict:
+        phrs = self.__day_requests(symbol, start_date, end_date, need_extended_hours)
+        return await self.__call_windows_async(symbol, phrs)
 
     def day_data(self, symbol, start_date: datetime.datetime, end_date: datetime.datetime = None, need_extended_hours: bool=False) -> pd.DataFrame:
         json_dict_data = self._day_data_all(symbol, start_date, end_date, need_extended_hours)
-        return self.__json_dict_to_df(json_dict_data)
+        return PriceHistory.json_dict_to_df(json_dict_data)
+
+    async def day_data_async(self, symbol, start_date: datetime.datetime, end_date: datetime.datetime = None, need_extended_hours: bool=False) -> pd.DataFrame:
+        json_dict_data = await self._day_data_all_async(symbol, start_date, end_date, need_extended_hours)
+        return PriceHistory.json_dict_to_df(json_dict_data)
 
 if __name__ == '__main__':
     start = datetime.datetime(year=2020, month=2, day=2)
@@ -0,0 +1,78 @@
+"""
+Microbenchmark of candle decoding: the per-row conversions that the data sources
+used to do against the vectorized decoder in candles.py, on 30 days of synthetic
+minute candles in each API's format.
+
+    python benchmarks/bench_decode.py [-n repeats]
+"""
+
+import datetime as dt
+import os
+import sys
+import time
+from pathlib import Path
+import numpy as np
+import pandas as pd
+proj_path = Path(__file__).absolute().parent.parent
+sys.path.insert(1, os.path.join(str(proj_path))) # path to the entire project
+from candles import candles_to_df
+
+N_MINUTES = 30*24*60
+
+
+def synthetic_candles(time_key: str, unit_scale: int, volume_keys) -> list:
+    rng = np.random.default_rng(0)
+    start = int(dt.datetime(2020, 1, 1).timestamp())
+    close = 100 + np.cumsum(rng.normal(0, .1, N_MINUTES))
+    candles = []
+    for i in range(N_MINUTES):
+        candle = {'open': close[i-1] if i else close[0], 'high': close[i] + .05, 'low': close[i] - .05, 'close': close[i], time_key: (start + 60*i)*unit_scale}
+        for key in volume_keys:
+            candle[key] = int(rng.integers(0, 10000))
+        candles.append(candle)
+    return candles
+
+
+def old_ameritrade(candles: list) -> pd.DataFrame:
+    data_df = pd.DataFrame(candles).set_index('datetime')
+    data_df.index = pd.Series([dt.datetime.fromtimestamp(float(ep)/1000) for ep in data_df.index], name='datetime')
+    return data_df
+
+
+def old_crypto(candles: list) -> pd.DataFrame:
+    data = pd.DataFrame(candles)
+    data.index = pd.Series([dt.datetime.fromtimestamp(t) for t in data['time']], name='datetime')
+    data.drop(columns=['time'], inplace=True)
+    return data[['open', 'high', 'low', 'close', 'volumefrom', 'volumeto']]
+
+
+def best_of(n: int, func, *args) -> float:
+    times = []
+    for _ in range(n):
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+if __name__ == '__main__':
+    repeats = int(sys.argv[sys.argv.index('-n') + 1]) if '-n' in sys.argv else 5
+
+    ameritrade_candles = synthetic_candles('datetime', 1000, ['volume'])
+    ameritrade_columns = {'open': float, 'high': float, 'low': float, 'close': float, 'volume': 'int64'}
+    crypto_candles = synthetic_candles('time', 1, ['volumefrom', 'volumeto'])
+    crypto_columns = {'open': float, 'high': float, 'low': float, 'close': float, 'volumefrom': float, 'volumeto': float}
+
+    # both versions must produce the same data
+    assert (old_ameritrade(ameritrade_candles).index == candles_to_df(ameritrade_candles, 'datetime', 'ms', ameritrade_columns).index).all()
+    assert np.allclose(old_crypto(crypto_candles).values, candles_to_df(crypto_candles, 'time', 's', crypto_columns).values)
+
+    cases = [
+        ('pricehistory', old_ameritrade, lambda c: candles_to_df(c, 'datetime', 'ms', ameritrade_columns), ameritrade_candles),
+        ('histominute', old_crypto, lambda c: candles_to_df(c, 'time', 's', crypto_columns), crypto_candles),
+    ]
+    print('{} synthetic minute candles, best of {} runs'.format(N_MINUTES, repeats))
+    for name, old, new, candles in cases:
+        old_seconds = best_of(repeats, old, candles)
+        new_seconds = best_of(repeats, new, candles)
+        print('{:<14} per-row: {:8.2f} ms   vectorized: {:8.2f} ms   speedup: {:5.1f}x'.format(name, old_seconds*1000, new_seconds*1000, old_seconds/new_seconds))
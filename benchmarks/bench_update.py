@@ -0,0 +1,158 @@
+"""
+Offline benchmark of full update runs, with the local stand-in APIs in fake_api.py
+taking the place of TD Ameritrade and CryptoCompare.
+
+Two runs are measured against a fresh data directory:
+    create -- every symbol's file is created from a maximum-history pull
+    append -- the fake API's history is moved forward by --append-minutes, and every symbol is updated
+
+Each run is printed as one JSON object (and appended to --output, if given), so
+that results can be collected and compared across commits.
+
+    python benchmarks/bench_update.py --source stock --symbols 505 --workers 16 --latency 0.05
+"""
+
+import argparse
+import datetime as dt
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+import requests
+proj_path = Path(__file__).absolute().parent.parent
+sys.path.insert(1, os.path.join(str(proj_path))) # path to the entire project
+from fake_api import serve_in_subprocess
+
+SOURCES = {
+    # source: (folder of the update script, module name, class name, bundled symbol file)
+    'stock': ('stock_intraday_db', 'stock_intraday_db_update', 'StockIntradayDB', 'SP500.txt'),
+    'crypto': ('crypto_intraday_db', 'crypto_intraday_db_update', 'CryptoIntradayDB', 'TOP_COINS.txt'),
+}
+
+
+def make_symbols(source: str, n: int):
+    """The bundled universe, padded with made-up symbols if more than that is asked for.
+    """
+
+    folder, _, _, file_name = SOURCES[source]
+    with open(os.path.join(str(proj_path), folder, file_name), 'r') as f:
+        symbols = [line.strip() for line in f if line.strip()]
+    symbols += ['SYN{}'.format(i) for i in range(max(0, n - len(symbols)))]
+    return symbols[:n]
+
+
+def import_db_class(source: str, work_dir: str):
+    """Import the source's DB class, with a generated config module standing in for the user's config.py.
+    """
+
+    with open(os.path.join(work_dir, 'config.py'), 'w') as f:
+        f.write('\n'.join([
+            "api_key = 'BENCHMARK'",
+            "STOCK_NAME_FILE_PATH = SYMBOL_NAME_FILE_PATH = {!r}".format(os.path.join(work_dir, 'symbols.txt')),
+            "DATA_FILE_PATH = DATA_DIR_PATH = {!r}".format(os.path.join(work_dir, 'data')),
+            "LOG_FILE_PATH = {!r}".format(os.path.join(work_dir, 'update.log')),
+        ]) + '\n')
+
+    folder, module_name, class_name, _ = SOURCES[source]
+    sys.path.insert(0, os.path.join(str(proj_path), folder))
+    sys.path.insert(0, work_dir) # ahead of any real config.py
+    module = __import__(module_name)
+    return getattr(module, class_name)
+
+
+def dir_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024 # kilobytes on Linux
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark update runs against local stand-ins for the price APIs.')
+    parser.add_argument('--source', choices=sorted(SOURCES), default='stock')
+    parser.add_argument('--symbols', type=int, default=505, help='number of symbols in the universe')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--req-per-sec', type=float, default=None, help='client-side rate limit; defaults to the source\'s cap')
+    parser.add_argument('--storage', default='csv')
+    parser.add_argument('--decode-workers', type=int, default=0, help='decoding processes; above 0 runs the pipelined update')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds of fake API latency per request')
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--rate-limit', type=float, default=None, help='fake API requests per second before it answers 429')
+    parser.add_argument('--error-rate', type=float, default=0.)
+    parser.add_argument('--history-days', type=int, default=30)
+    parser.add_argument('--append-minutes', type=int, default=60)
+    parser.add_argument('--output', default=None, help='file to append the JSON results to')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='prices-db-bench-')
+    server_config = {
+        'latency': args.latency,
+        'jitter': args.jitter,
+        'rate_limit': args.rate_limit,
+        'error_rate': args.error_rate,
+        'history_days': args.history_days,
+        'lag_minutes': args.append_minutes,
+        'trading_hours_only': 0, # every minute has a bar, so that row counts don't depend on the time of day
+    }
+    server, base_url = serve_in_subprocess(server_config)
+
+    try:
+        db_class = import_db_class(args.source, work_dir)
+        if args.source == 'stock':
+            sys.modules['ameritrade_utils'].PriceHistory.BASE_URL = base_url
+        else:
+            db_class.BASE_URL = base_url
+
+        symbols = make_symbols(args.source, args.symbols)
+        with open(os.path.join(work_dir, 'symbols.txt'), 'w') as f:
+            f.write('\n'.join(symbols) + '\n')
+        data_dir = os.path.join(work_dir, 'data')
+        os.makedirs(data_dir)
+
+        db = db_class(os.path.join(work_dir, 'symbols.txt'), data_dir, os.path.join(work_dir, 'update.log'),
+                        max_workers=args.workers, req_per_sec=args.req_per_sec, storage=args.storage, decode_workers=args.decode_workers)
+
+        for phase in ('create', 'append'):
+            if phase == 'append':
+                requests.get(base_url + '/_control', params={'lag_minutes': 0})
+
+            stats_before = requests.get(base_url + '/_stats').json()
+            bytes_before = dir_size(data_dir)
+            start = time.perf_counter()
+            results = db.update()
+            seconds = time.perf_counter() - start
+            stats_after = requests.get(base_url + '/_stats').json()
+
+            rows = sum(result.rows for result in results.values())
+            record = {
+                'benchmark': 'update',
+                'timestamp': dt.datetime.now().isoformat(),
+                'source': args.source,
+                'phase': phase,
+                'symbols': len(symbols),
+                'workers': args.workers,
+                'req_per_sec': db.req_per_sec,
+                'storage': args.storage,
+                'decode_workers': args.decode_workers,
+                'seconds': round(seconds, 4),
+                'symbols_per_sec': round(len(symbols)/seconds, 2),
+                'rows': rows,
+                'rows_per_sec': round(rows/seconds, 1),
+                'bytes_written': dir_size(data_dir) - bytes_before,
+                'failed': sum(result.status == 'ERROR' for result in results.values()),
+                'peak_rss_mb': round(peak_rss_mb(), 1),
+                'server': {key: stats_after[key] - stats_before[key] for key in stats_after},
+                'server_config': server_config,
+            }
+            print(json.dumps(record))
+            if args.output:
+                with open(args.output, 'a') as f:
+                    f.write(json.dumps(record) + '\n')
+    finally:
+        server.terminate()
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,242 @@
+"""
+Local stand-in for the TD Ameritrade and CryptoCompare APIs, for benchmarking
+update runs without touching the live services.
+
+Emulated endpoints:
+    GET /v1/marketdata/{symbol}/pricehistory    -- minute (or daily) candles in TD Ameritrade's format
+    GET /data/histominute                       -- minute candles in CryptoCompare's format (limit, toTs)
+    GET /_stats                                 -- request counters, as JSON
+    GET /_control?lag_minutes=<n>               -- move the end of the served history
+
+Candle values are a deterministic function of the symbol and the minute, so the
+same minute always gets the same bar. Stock candles are only served on weekdays
+during (extended) market hours, unless trading_hours_only is 0; crypto candles
+are served for every minute.
+
+    python benchmarks/fake_api.py [--port 8765] [--latency 0.05] [--rate-limit 100] [--error-rate 0.01]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Tuple
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+proj_path = Path(__file__).absolute().parent.parent
+sys.path.insert(1, os.path.join(str(proj_path))) # path to the entire project
+from candles import epochs_to_datetime64
+
+DEFAULT_CONFIG = {
+    'latency': 0.05, # seconds added to every response
+    'jitter': 0.02, # up to this many seconds of extra random latency
+    'rate_limit': None, # requests per second before responding with 429; None for no limit
+    'error_rate': 0., # fraction of requests answered with a 500
+    'history_days': 30, # how far back the served history goes
+    'lag_minutes': 0, # how far behind the current time the served history ends
+    'trading_hours_only': 1, # whether stock candles are limited to weekdays during market hours
+    'seed': 0,
+}
+
+
+def synthetic_bars(symbol: str, minutes: np.ndarray, seed: int) -> Dict[str, np.ndarray]:
+    """Deterministic OHLCV bars for the given epoch minutes.
+    """
+
+    phase = (zlib.crc32(symbol.encode()) + seed) % 1000
+    base = 20 + phase/5
+    mid = base*(1 + .02*np.sin(minutes/97. + phase) + .005*np.sin(minutes/13.3 + 2*phase))
+    spread = base*.001*(1 + np.cos(minutes/7. + phase)**2)
+    volume = 100 + (minutes*2654435761 + phase) % 1000
+    return {
+        'open': np.round(mid - spread/2, 4),
+        'high': np.round(mid + spread, 4),
+        'low': np.round(mid - spread, 4),
+        'close': np.round(mid + spread/2, 4),
+        'volume': volume.astype(np.int64),
+    }
+
+
+class _State:
+
+    def __init__(self, config: Dict):
+        self.config = dict(DEFAULT_CONFIG, **config)
+        self.lock = threading.Lock()
+        self.random = random.Random(self.config['seed'])
+        self.tokens = float(self.config['rate_limit'] or 0)
+        self.last_refill = time.monotonic()
+        self.stats = {'requests': 0, 'throttled': 0, 'errors': 0, 'candles': 0, 'bytes': 0}
+        return
+
+    def admit(self) -> Tuple[bool, bool]:
+        """
+        Returns:
+            Tuple[bool, bool] -- Whether the request is throttled, and whether an error is injected.
+        """
+
+        with self.lock:
+            self.stats['requests'] += 1
+            rate = self.config['rate_limit']
+            throttled = False
+            if rate:
+                now = time.monotonic()
+                self.tokens = min(rate, self.tokens + (now - self.last_refill)*rate)
+                self.last_refill = now
+                if self.tokens < 1:
+                    throttled = True
+                    self.stats['throttled'] += 1
+                else:
+                    self.tokens -= 1
+            failed = (not throttled) and self.random.random() < self.config['error_rate']
+            if failed:
+                self.stats['errors'] += 1
+            delay = self.config['latency'] + self.random.random()*self.config['jitter']
+        time.sleep(delay)
+        return throttled, failed
+
+    def now(self) -> int:
+        """Epoch second at which the served history ends.
+        """
+        return int(time.time()) - 60*int(self.config['lag_minutes'])
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep connections alive, like the real APIs
+
+    def log_message(self, format, *args):
+        return
+
+    def __send(self, status: int, body: Dict):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        with self.server.state.lock:
+            self.server.state.stats['bytes'] += len(payload)
+        return
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        state = self.server.state
+        parts = url.path.strip('/').split('/')
+
+        if url.path == '/_stats':
+            with state.lock:
+                stats = dict(state.stats)
+            return self.__send(200, stats)
+        if url.path == '/_control':
+            with state.lock:
+                for key, value in params.items():
+                    if key in state.config:
+                        state.config[key] = type(DEFAULT_CONFIG[key] or 0.)(value)
+                config = dict(state.config)
+            return self.__send(200, config)
+
+        is_stock = len(parts) == 4 and parts[:2] == ['v1', 'marketdata'] and parts[3] == 'pricehistory'
+        is_crypto = parts == ['data', 'histominute']
+        if not (is_stock or is_crypto):
+            return self.__send(404, {'error': 'Not found: {}'.format(url.path)})
+
+        throttled, failed = state.admit()
+        if throttled or failed:
+            status, message = (429, 'Too many requests') if throttled else (500, 'Injected error')
+            body = {'error': message} if is_stock else {'Response': 'Error', 'Message': message, 'Data': {}}
+            return self.__send(status, body)
+
+        if is_stock:
+            return self.__send(200, self.__pricehistory(parts[2], params))
+        return self.__send(200, self.__histominute(params))
+
+    def __pricehistory(self, symbol: str, params: Dict) -> Dict:
+        state = self.server.state
+        now = state.now()
+        first = now - state.config['history_days']*24*60*60
+        start = max(first, int(params.get('startDate', first*1000))//1000)
+        end = min(now, int(params.get('endDate', now*1000))//1000)
+
+        daily = params.get('frequencyType') == 'daily'
+        step = 24*60*60 if daily else 60
+        seconds = np.arange(start + (-start) % step, end + 1, step, dtype=np.int64)
+
+        # only weekdays during (extended) market hours
+        local = epochs_to_datetime64(seconds, 's')
+        minute_of_day = (local.astype('datetime64[m]') - local.astype('datetime64[D]')).astype(np.int64)
+        weekday = (local.astype('datetime64[D]').astype(np.int64) + 3) % 7 # 0 is Monday
+        keep = (weekday < 5) | (not state.config['trading_hours_only'])
+        if not daily and state.config['trading_hours_only']:
+            session = (4*60, 20*60) if params.get('needExtendedHoursData') == 'true' else (9*60 + 30, 16*60)
+            keep &= (minute_of_day >= session[0]) & (minute_of_day < session[1])
+        seconds = seconds[keep]
+
+        bars = synthetic_bars(symbol, seconds//60, state.config['seed'])
+        columns = [bars['open'].tolist(), bars['high'].tolist(), bars['low'].tolist(), bars['close'].tolist(), bars['volume'].tolist(), (seconds*1000).tolist()]
+        candles = [dict(zip(('open', 'high', 'low', 'close', 'volume', 'datetime'), row)) for row in zip(*columns)]
+        with state.lock:
+            state.stats['candles'] += len(candles)
+        return {'candles': candles, 'symbol': symbol, 'empty': len(candles) == 0}
+
+    def __histominute(self, params: Dict) -> Dict:
+        state = self.server.state
+        symbol = params.get('fsym', '')
+        limit = min(2000, int(params.get('limit', 1440)))
+        to_ts = min(state.now(), int(params.get('toTs', state.now())))
+        to_ts -= to_ts % 60
+        seconds = np.arange(to_ts - 60*limit, to_ts + 1, 60, dtype=np.int64) # the API returns limit + 1 candles
+
+        bars = synthetic_bars(symbol, seconds//60, state.config['seed'])
+        close = bars['close']
+        columns = [seconds.tolist(), bars['high'].tolist(), bars['low'].tolist(), bars['open'].tolist(), bars['volume'].astype(float).tolist(), np.round(bars['volume']*close, 4).tolist(), close.tolist()]
+        candles = [dict(zip(('time', 'high', 'low', 'open', 'volumefrom', 'volumeto', 'close'), row)) for row in zip(*columns)]
+        with state.lock:
+            state.stats['candles'] += len(candles)
+        return {'Response': 'Success', 'Type': 100, 'Aggregated': False, 'Data': candles, 'TimeTo': int(to_ts), 'TimeFrom': int(seconds[0])}
+
+
+def make_server(config: Dict = None, port: int = 0) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+    server.daemon_threads = True
+    server.state = _State(config or {})
+    return server
+
+
+def _serve(config: Dict, port: int, ready):
+    server = make_server(config, port)
+    ready.put(server.server_address[1])
+    server.serve_forever()
+    return
+
+
+def serve_in_subprocess(config: Dict = None, port: int = 0) -> Tuple[multiprocessing.Process, str]:
+    """Run the fake API in its own process, so that it doesn't compete with the benchmarked code for the GIL.
+
+    Returns:
+        Tuple[multiprocessing.Process, str] -- The server's process (terminate it when done), and its base url.
+    """
+
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve, args=(config or {}, port, ready), daemon=True)
+    process.start()
+    return process, 'http://127.0.0.1:{}'.format(ready.get(timeout=30))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for the TD Ameritrade and CryptoCompare APIs.')
+    parser.add_argument('--port', type=int, default=8765)
+    for key, value in DEFAULT_CONFIG.items():
+        parser.add_argument('--' + key.replace('_', '-'), type=float if key not in ('history_days', 'lag_minutes', 'trading_hours_only', 'seed') else int, default=value)
+    args = vars(parser.parse_args())
+    port = args.pop('port')
+
+    server = make_server(args, port)
+    print('Serving fake APIs at http://127.0.0.1:{}'.format(server.server_address[1]))
+    server.serve_forever()
@@ -0,0 +1,68 @@
+"""
+Vectorized decoding of the candle lists returned by the price APIs.
+
+The APIs return a list of dicts (one per candle). These are copied straight into
+one typed NumPy array per column, and the epochs are converted to naive local
+datetimes (matching datetime.datetime.fromtimestamp) in a single vectorized step.
+"""
+
+import datetime
+from typing import Dict, List, Tuple
+import numpy as np
+import pandas as pd
+
+__OFFSET_SLOT_SECONDS = 15*60 # UTC offset changes (e.g. daylight savings) only ever happen on quarter hours
+
+
+def epochs_to_datetime64(epochs: np.ndarray, unit: str) -> np.ndarray:
+    """Vectorized version of datetime.datetime.fromtimestamp.
+
+    Arguments:
+        epochs {np.ndarray} -- Integer epochs.
+        unit {str} -- Unit of the epochs; 's' or 'ms'.
+
+    Returns:
+        np.ndarray -- Naive local wall-clock times, as datetime64[ns].
+    """
+
+    utc_ns = epochs.astype('datetime64[{}]'.format(unit)).astype('datetime64[ns]').view(np.int64)
+
+    # The UTC offset is constant within each quarter hour, so it only has to be looked up
+    # once per distinct quarter hour rather than once per epoch.
+    slots, inverse = np.unique(utc_ns // (10**9 * __OFFSET_SLOT_SECONDS), return_inverse=True)
+    offsets = np.empty(len(slots), dtype=np.int64)
+    for i, slot in enumerate(slots.tolist()):
+        slot_start = slot*__OFFSET_SLOT_SECONDS
+        local = datetime.datetime.fromtimestamp(slot_start)
+        utc = datetime.datetime.fromtimestamp(slot_start, datetime.timezone.utc).replace(tzinfo=None)
+        offsets[i] = int((local - utc).total_seconds()) * 10**9
+
+    return (utc_ns + offsets[inverse.reshape(-1)]).view('datetime64[ns]')
+
+
+def decode_candles(records: List[Dict], time_key: str, unit: str, columns: Dict[str, type]) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """Copy a list of candle dicts into one typed array per column.
+
+    Arguments:
+        records {List[Dict]} -- Candles, as returned by the API.
+        time_key {str} -- Key of the epoch in each candle.
+        unit {str} -- Unit of the epochs; 's' or 'ms'.
+        columns {Dict[str, type]} -- Keys to keep, in order, mapped to their dtypes.
+
+    Returns:
+        Tuple[np.ndarray, Dict[str, np.ndarray]] -- Datetimes (datetime64[ns]) and the column arrays.
+    """
+
+    n = len(records)
+    epochs = np.fromiter((record[time_key] for record in records), dtype=np.int64, count=n)
+    arrays = {column: np.fromiter((record[column] for record in records), dtype=dtype, count=n) for column, dtype in columns.items()}
+    return epochs_to_datetime64(epochs, unit), arrays
+
+
+def candles_to_df(records: List[Dict], time_key: str, unit: str, columns: Dict[str, type]) -> pd.DataFrame:
+    """See 'decode_candles' for details; the arrays are wrapped in a DataFrame with a datetime index.
+    """
+
+    dtimes, arrays = decode_candles(records, time_key, unit, columns)
+    index = pd.DatetimeIndex(dtimes, name='datetime')
+    return pd.DataFrame(arrays, index=index, copy=False)
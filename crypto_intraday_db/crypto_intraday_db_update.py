@@ -2,63 +2,172 @@ import os
 import sys
 from pathlib import Path
 import warnings
+import asyncio
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 import datetime as dt
+import numpy as np
 import pandas as pd
-import requests
 
 # import DB_Base from other directory
 proj_path = Path(__file__).absolute().parent.parent
 sys.path.insert(1, os.path.join(str(proj_path))) # path to the entire project
 from db.base import DB_Base, parse_args
+from http_utils import AdaptiveRateLimiter, HttpClient
+from candles import candles_to_df
 
 from config import SYMBOL_NAME_FILE_PATH, DATA_DIR_PATH, LOG_FILE_PATH
 
+
+class BadApiRequest(Exception):
+    pass
+
+
 class CryptoIntradayDB(DB_Base):
-    __MAX_LOOKBACK_MINUTES = 2000 # determined by the API's constraints
+    __MAX_LOOKBACK_MINUTES = 2000 # determined by the API's constraints; this is the most minutes a single call returns
+    __MAX_HISTORY_DAYS = 7 # how far back the API serves minute data, by paging backwards with toTs
+    __CANDLE_COLUMNS = {'open': float, 'high': float, 'low': float, 'close': float, 'volumefrom': float, 'volumeto': float}
+    REQ_PER_SEC_CAP = 20 # kept well below the API's per-second limit
+    REFRESH_SECONDS = 60 # a new minute bar comes out every minute, around the clock
+    BASE_URL = 'https://min-api.cryptocompare.com' # may be pointed elsewhere, e.g. at a local stand-in for benchmarks
+    __client = HttpClient(pool_size=REQ_PER_SEC_CAP, max_concurrency=REQ_PER_SEC_CAP, # keep-alive pool shared by all workers
+                            rate_limiter=AdaptiveRateLimiter(REQ_PER_SEC_CAP)) # starts below the API's limit, and adapts to the observed one
+    CACHE_TTL = 60 # seconds that cached responses for windows that are still open stay valid
+    CACHE_SETTLE_SECONDS = 60*60 # windows that ended longer ago than this are closed, and their responses never expire
     
-    def __get_request_data(symbol, comparison_symbol, limit, aggregate):
+    def __request_url(symbol, comparison_symbol, limit, aggregate, to_ts):
         assert limit <= CryptoIntradayDB.__MAX_LOOKBACK_MINUTES, 'Limit was too large for the API constraints.'
-        url = 'https://min-api.cryptocompare.com/data/histominute?fsym={}&tsym={}&limit={}&aggregate={}'\
-                    .format(symbol.upper(), comparison_symbol.upper(), limit, aggregate)
-        page = requests.get(url)
-        data = pd.DataFrame(page.json()['Data'])
-        return data
+        return '{}/data/histominute?fsym={}&tsym={}&limit={}&aggregate={}&toTs={}'\
+                    .format(CryptoIntradayDB.BASE_URL, symbol.upper(), comparison_symbol.upper(), limit, aggregate, to_ts)
+
+    def __cache_ttl(to_ts: int):
+        return None if to_ts < time.time() - CryptoIntradayDB.CACHE_SETTLE_SECONDS else CryptoIntradayDB.CACHE_TTL
+
+    def __is_throttled(page: dict) -> bool:
+        # the API reports going over the rate limit in the body, not always with a 429
+        return page.get('Response') == 'Error' and 'limit' in str(page.get('Message', '')).lower()
+
+    def __check_page(page: dict) -> list:
+        if page.get('Response') == 'Error':
+            raise BadApiRequest(page.get('Message'))
+        return page['Data']
+
+    def __get_request_data(symbol, comparison_symbol, limit, aggregate, to_ts, cache=None):
+        url = CryptoIntradayDB.__request_url(symbol, comparison_symbol, limit, aggregate, to_ts)
+        candles = cache.get(url) if cache is not None else None
+        if candles is None:
+            page = CryptoIntradayDB.__client.get_json(url, retry_on=CryptoIntradayDB.__is_throttled)
+            candles = CryptoIntradayDB.__check_page(page)
+            if cache is not None:
+                cache.put(url, None, candles, CryptoIntradayDB.__cache_ttl(to_ts))
+        return candles
+
+    async def __get_request_data_async(symbol, comparison_symbol, limit, aggregate, to_ts, cache=None):
+        url = CryptoIntradayDB.__request_url(symbol, comparison_symbol, limit, aggregate, to_ts)
+        candles = cache.get(url) if cache is not None else None
+        if candles is None:
+            page = await CryptoIntradayDB.__client.get_json_async(url, retry_on=CryptoIntradayDB.__is_throttled)
+            candles = CryptoIntradayDB.__check_page(page)
+            if cache is not None:
+                cache.put(url, None, candles, CryptoIntradayDB.__cache_ttl(to_ts))
+        return candles
+
+    def http_clients(self) -> list:
+        return [CryptoIntradayDB.__client]
+
+    def __window(start: dt.datetime, end: dt.datetime, new_data: bool):
+        """Clip the requested window to the history that the API serves.
+        """
+
+        buffer = dt.timedelta(seconds=10)
+        min_time = (dt.datetime.now() - dt.timedelta(days=CryptoIntradayDB.__MAX_HISTORY_DAYS)) + buffer
 
-    def get_data(self, symbol: str, start: dt.datetime, end: dt.datetime, new_data: bool) -> pd.DataFrame:
-        
         if new_data: # go back as far in time as possible
-            limit = CryptoIntradayDB.__MAX_LOOKBACK_MINUTES
-        else: # go back in time only to the extent necessary
-            assert start < end, 'Invalid start and end arguments; try setting new_data to True if the intention is to get as much data as possible.'
-
-            buffer = dt.timedelta(seconds=10)
-            min_time = (dt.datetime.now() - dt.timedelta(CryptoIntradayDB.__MAX_LOOKBACK_MINUTES)) + buffer
-            
-            if start <= min_time:
-                warnings.warn('Start time is out of bounds with the minimum start time. Fetching data up to maximum lookback days.')
-            
-            
-            minutes = lambda td: (td.seconds)//60 # convert from timedelta to minutes
-            limit = min(CryptoIntradayDB.__MAX_LOOKBACK_MINUTES, minutes((dt.datetime.now()-start)) )
-            
-        # Get basic data from the request
-        data = CryptoIntradayDB.__get_request_data(symbol, 'USD', limit, 1)
-        
-        if len(data) == 0:
-            return data # don't worry about formatting, since there's no data to format
-
-        # Format data
-        data.index = pd.Series([dt.datetime.fromtimestamp(t) for t in data['time']], name='datetime')
-        
-        data.drop(columns=['time'], inplace=True)
-        data = data[['open', 'high', 'low', 'close', 'volumefrom', 'volumeto']]
-        
-        # If specific time range is in mind, filter to only include desired datetime
-        if not new_data: # filter to only include upto the end date
-            inrange = lambda dt_series: (dt_series >= start) & (dt_series <= end)
-            data = data[inrange(data.index)]
-            
-        return data
+            return min_time, dt.datetime.now()
+
+        # go back in time only to the extent necessary
+        assert start < end, 'Invalid start and end arguments; try setting new_data to True if the intention is to get as much data as possible.'
+
+        if start <= min_time:
+            warnings.warn('Start time is out of bounds with the minimum start time. Fetching data up to maximum lookback days.')
+            start = min_time
+        return start, end
+
+    def __pages(start: dt.datetime, end: dt.datetime):
+        """
+        Split a window into API calls, each of which returns the limit + 1 minutes up to and
+        including its toTs. The calls sit on a fixed grid of epoch minutes, so that a page that
+        is entirely in the past is requested with the same parameters on every run (and can be
+        served from the response cache); only the page with the end of the window is cut short.
+
+        Returns:
+            List[Tuple[int, int]] -- (toTs, limit) of each call, oldest first.
+        """
+
+        first = -(-int(start.timestamp())//60) # epoch minute of the first whole minute in the window
+        last = int(end.timestamp())//60
+        page_minutes = CryptoIntradayDB.__MAX_LOOKBACK_MINUTES + 1
+        pages = []
+        for page in range(first//page_minutes, last//page_minutes + 1):
+            page_last = (page + 1)*page_minutes - 1
+            if page_last >= last:
+                pages.append((last*60, last - max(first, page*page_minutes)))
+            else:
+                pages.append((page_last*60, CryptoIntradayDB.__MAX_LOOKBACK_MINUTES))
+        return pages
+
+    @staticmethod
+    def decode_raw(pages: list, start: dt.datetime, end: dt.datetime) -> pd.DataFrame:
+        # Decode the candles of every page straight into typed columns
+        candles = [candle for page in pages for candle in page]
+        data = candles_to_df(candles, 'time', 's', CryptoIntradayDB.__CANDLE_COLUMNS)
+        data = data[~data.index.duplicated(keep='last')]
+
+        # Filter to only include the desired datetimes
+        inrange = lambda dt_series: (dt_series >= start) & (dt_series <= end)
+        return data[inrange(data.index)]
+
+    async def fetch_raw(self, symbol: str, start: dt.datetime, end: dt.datetime, new_data: bool):
+        start, end = CryptoIntradayDB.__window(start, end, new_data)
+        pages = CryptoIntradayDB.__pages(start, end)
+        candles = await asyncio.gather(*[CryptoIntradayDB.__get_request_data_async(symbol, 'USD', limit, 1, to_ts, self.response_cache) for to_ts, limit in pages])
+        return list(candles), (start, end)
+
+    def get_data(self, symbol: str, start: dt.datetime, end: dt.datetime, new_data: bool) -> pd.DataFrame:
+        start, end = CryptoIntradayDB.__window(start, end, new_data)
+        pages = CryptoIntradayDB.__pages(start, end)
+
+        # the pages don't overlap, so they can be requested in parallel; each in a copy of the caller's context, so that
+        # its request is instrumented (e.g. attributed to the symbol) as the caller's
+        with ThreadPoolExecutor(max_workers=max(1, min(len(pages), CryptoIntradayDB.REQ_PER_SEC_CAP))) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, CryptoIntradayDB.__get_request_data, symbol, 'USD', limit, 1, to_ts, self.response_cache)
+                        for to_ts, limit in pages]
+            candles = [future.result() for future in futures]
+        return CryptoIntradayDB.decode_raw(candles, start, end)
+
+    def find_gaps(self, symbol: str):
+        # crypto trades around the clock, so every minute within the API's history should have a row
+        horizon = (dt.datetime.now() - dt.timedelta(days=CryptoIntradayDB.__MAX_HISTORY_DAYS)).replace(second=0, microsecond=0) + dt.timedelta(minutes=1)
+        dtimes = self.read(symbol, start=horizon, columns=[]).index
+        if len(dtimes) == 0:
+            return []
+
+        # rows right before and after each run of missing minutes
+        missing = np.diff(dtimes.values) > np.timedelta64(1, 'm')
+        before, after = dtimes[:-1][missing], dtimes[1:][missing]
+        if dtimes[0] > horizon and self.storage.first_dtime(symbol) < horizon: # the gap runs past the horizon
+            before = before.insert(0, horizon - dt.timedelta(minutes=1))
+            after = after.insert(0, dtimes[0])
+
+        # gaps that are close together are fetched as one window; the rows in between are already stored, and are kept
+        gaps = []
+        for last_before, first_after in zip(before.to_pydatetime(), after.to_pydatetime()):
+            if len(gaps) > 0 and first_after - gaps[-1][0] <= dt.timedelta(minutes=CryptoIntradayDB.__MAX_LOOKBACK_MINUTES):
+                gaps[-1] = (gaps[-1][0], first_after - dt.timedelta(microseconds=1))
+            else:
+                gaps.append((last_before + dt.timedelta(microseconds=1), first_after - dt.timedelta(microseconds=1)))
+        return gaps
 
 
 if __name__ == "__main__":
@@ -67,6 +176,24 @@ if __name__ == "__main__":
         -s [symbol_file_path]
         -d [data_file_path]
         -l [log_file_path]
+        -w [max_workers] (keyword only)
+        -f [storage] (keyword only; 'csv', 'columnar', 'partitioned' or 'partitioned_daily')
+        -r [rollups] (keyword only; comma-separated, e.g. 5m,15m,1h,1d)
+        -p [panel_fields] (keyword only; comma-separated, e.g. close,volume)
+        -m [metrics_file_path] (keyword only)
+        -j [decode_workers] (keyword only; number of decoding processes, for pipelined updates)
+        -g [fill_gaps] (keyword only; 1 to fill in gaps inside the stored data)
+        -c [cache_dir] (keyword only; folder to cache API responses in)
+        -e [refresh_seconds] (keyword only; run as a daemon that refreshes each symbol this often)
+        -x [features] (keyword only; comma-separated, e.g. log_return,vwap_30,volatility_30)
+        -k [shard] (keyword only; e.g. 0/4 to run as the first of 4 workers that share the data folder)
+        -t [steal_work] (keyword only; 0 to keep a sharded worker to its own shard)
+        -n [retention_days] (keyword only; drop rows older than this many days after each update, panels included)
+        -o [overlap_minutes] (keyword only; fetch this many minutes before the last stored row again, and replace revised bars)
     '''
     args_dict = parse_args(SYMBOL_NAME_FILE_PATH, DATA_DIR_PATH, LOG_FILE_PATH)
-    CryptoIntradayDB(**args_dict).update()
\ No newline at end of file
+    db = CryptoIntradayDB(**args_dict)
+    if 'refresh_seconds' in args_dict: # stay resident, and keep refreshing the symbols
+        db.run_daemon()
+    else:
+        db.update()
\ No newline at end of file
@@ -4,21 +4,66 @@ the database.
 """
 
 from abc import ABC, abstractmethod
+import numpy as np
 import pandas as pd
 import datetime as dt
-from typing import Dict, List
+import json
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional, Tuple, Union
 import asyncio
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import os
 import sys
+import threading
+import time
 from pathlib import Path
 db_path = Path(__file__).absolute().parent
 sys.path.insert(1, str(db_path)) # path to the entire project
 
 from db_config import __DTIME_FORMAT as DTIME_FORMAT
+from rate_limit import RateLimiter
+from storage import ColumnarStorage, Storage, STORAGE_FORMATS
+from manifest import Manifest
+from journal import RunJournal
+from scheduler import RefreshSchedule
+from shards import Leases, ShardProgress, parse_shard, shard_of
+from subscriptions import BarBatch, Publisher, Subscription
+from rollups import Rollups
+from features import Features
+from panel import Panel
+from metrics import RunMetrics
+from response_cache import ResponseCache
+from pipeline import run_pipeline
+from migrate import CHUNK_ROWS, migrate
+
+
+class SymbolResult(NamedTuple):
+    symbol: str
+    status: str # one of 'CREATED', 'APPENDED', 'REVISED' (stored rows were replaced), 'FILLED', 'SKIPPED' (completed by the interrupted run that this one resumes), or 'ERROR'
+    rows: int
+    error: Optional[str]
+
+
+class _NotClaimed(Exception):
+    """Raised while planning a symbol that another worker of a sharded update is taking care of.
+    """
+    pass
+
 
 class DB_Base(ABC):
+    REQ_PER_SEC_CAP = 2 # maximum number of get_data calls per second; subclasses should set this to their API's limit
+    RESUME_WINDOW_SECONDS = 6*60*60 # symbols completed by an interrupted run are skipped only if that run started this recently
+    REFRESH_SECONDS = 15*60 # how often the daemon refreshes a symbol that keeps getting new rows; subclasses should set this to suit their data
+    DAEMON_POLL_SECONDS = 5 # longest that the daemon sleeps before checking the symbol file for changes
+    DAEMON_SUMMARY_SECONDS = 60*60 # how often the daemon logs a run summary
+    PROGRESS_EVERY = 50 # how many symbols a worker of a sharded update updates between progress reports
+    REVISION_RTOL = 1e-12 # relative difference below which a refetched value counts as unchanged (text formats round-trip floats only to about this)
 
-    def __init__(self, symbol_file_path: str, data_file_path: str, log_file_path: str):
+    def __init__(self, symbol_file_path: str, data_file_path: str, log_file_path: str, max_workers: int = 1, req_per_sec: float = None,
+                    storage: Union[str, Storage] = 'csv', rollups: List[str] = None, panel_fields: List[str] = None,
+                    metrics_file_path: str = None, profile: List[str] = None, decode_workers: int = 0, fill_gaps: bool = False,
+                    cache_dir: str = None, cache_bytes: int = 1 << 30, refresh_seconds: float = None, features: List[str] = None,
+                    shard: str = None, steal_work: bool = True, retention_days: float = None, overlap_minutes: float = 0):
         """
         Initialize database with the absolute paths to different files
 
@@ -26,6 +71,44 @@ class DB_Base(ABC):
             symbol_file_path {str} -- Absolute path to file containing symbols.
             data_file_path {str} -- Absolute path to folder in which data files are to be stored.
             log_file_path {str} -- Absolute path to file containing runtime logs.
+
+        Keyword Arguments:
+            max_workers {int} -- Number of symbols that are updated concurrently. (default: {1})
+            req_per_sec {float} -- Maximum number of get_data calls per second, shared by all
+                                    workers; if None, then use the class's REQ_PER_SEC_CAP (split evenly
+                                    between the shards, if sharded). (default: {None})
+            storage {Union[str, Storage]} -- Backend that symbol data is stored with; either a Storage
+                                    instance or the name of a format in STORAGE_FORMATS. (default: {'csv'})
+            rollups {List[str]} -- Lower resolutions (e.g. '5m', '1h', '1d') to maintain alongside the
+                                    minute data; see Rollups.RESOLUTIONS. (default: {None})
+            panel_fields {List[str]} -- Data columns (e.g. 'close', 'volume') to keep time x symbol panels
+                                    of; the panels are extended at the end of every update. (default: {None})
+            metrics_file_path {str} -- JSON-lines file that per-symbol stage timings and counters are
+                                    written to; if None, then only the end-of-run summary is logged. (default: {None})
+            profile {List[str]} -- Sections to run under cProfile; see RunMetrics.PROFILE_TARGETS. (default: {None})
+            decode_workers {int} -- If above 0, then run updates as a pipeline (see update_pipelined) with this
+                                    many processes decoding API responses; the subclass must implement
+                                    fetch_raw and decode_raw. (default: {0})
+            fill_gaps {bool} -- Whether to look for gaps inside the stored data after every update (see find_gaps),
+                                    and fill them in from the API. (default: {False})
+            cache_dir {str} -- Folder to cache API responses in (see ResponseCache), so that re-running an update
+                                    doesn't download them again; if None, then responses aren't cached. (default: {None})
+            cache_bytes {int} -- Budget for the size of the response cache, in bytes. (default: {1 GiB})
+            refresh_seconds {float} -- How often run_daemon refreshes each symbol; if None, then use the
+                                    class's REFRESH_SECONDS. (default: {None})
+            features {List[str]} -- Derived series (e.g. 'log_return', 'vwap_30') to maintain alongside the
+                                    minute data; see Features.REGISTRY. (default: {None})
+            shard {str} -- If given as '<index>/<count>' (e.g. '0/4'), then this process is one of `count`
+                                    workers that share the data folder, and updates the symbols of shard
+                                    `index`; see db/shards.py. (default: {None})
+            steal_work {bool} -- Whether a sharded worker goes on to update the symbols of other shards that
+                                    no worker has taken yet, once its own are done. (default: {True})
+            retention_days {float} -- If given, then rows older than this many days are dropped after each
+                                    update (see 'drop_before'), and cut off the panels once that frees up
+                                    a tenth of them (see Panel.drop_before). (default: {None})
+            overlap_minutes {float} -- Minutes before each symbol's last row to fetch again, so that bars which the
+                                    API revised since (e.g. late volume) are corrected; fetched rows replace the
+                                    stored rows with the same datetime. (default: {0})
         """
 
         # Make all file paths relative to the current working directory
@@ -33,6 +116,43 @@ class DB_Base(ABC):
         self.__data_file_path = DB_Base.__clean_path(data_file_path)
         self.__log_file_path = DB_Base.__clean_path(log_file_path)
 
+        assert int(max_workers) >= 1, 'There must be at least one worker.'
+        self.max_workers = int(max_workers)
+        self.shard = parse_shard(shard) if shard else None # (index, count)
+        self.steal_work = bool(int(steal_work))
+        self.req_per_sec = float(req_per_sec or self.REQ_PER_SEC_CAP/(self.shard[1] if self.shard else 1)) # the API's limit is shared by every shard
+        self.__log_lock = threading.Lock() # workers log from several threads
+        self.__log_file = None # opened on the first message, and flushed at the end of each run
+
+        assert int(decode_workers) == 0 or type(self).fetch_raw is not DB_Base.fetch_raw, \
+            '{} does not support pipelined updates.'.format(type(self).__name__)
+        self.decode_workers = int(decode_workers)
+        self.fill_gaps = bool(int(fill_gaps))
+        self.response_cache = ResponseCache(cache_dir, cache_bytes) if cache_dir else None # used by get_data and fetch_raw
+        self.refresh_seconds = float(refresh_seconds or self.REFRESH_SECONDS)
+
+        if isinstance(storage, str):
+            assert storage in STORAGE_FORMATS, 'Storage format "{}" is not valid.'.format(storage)
+            storage = STORAGE_FORMATS[storage](self.__data_file_path)
+        self.storage = storage
+        worker = None if self.shard is None else '{}of{}'.format(*self.shard)
+        self.manifest = Manifest(self.storage.data_dir, shared=self.shard is not None)
+        self.journal = RunJournal(self.storage.data_dir, worker)
+        self.leases = None if self.shard is None else Leases(self.storage.data_dir, worker)
+        self.progress = None if self.shard is None else ShardProgress(self.storage.data_dir, worker)
+        self.__run_start = time.time() # symbols that another worker updated since then are skipped
+        self.__run_counts = {} # status: number of symbols, for progress reports
+        self.publisher = Publisher() # hands newly stored bars to subscribers (see 'subscribe')
+        self.rollups = Rollups(self.storage, rollups) if rollups else None
+        self.features = Features(self.storage, features) if features else None
+        self.panel_fields = panel_fields
+        self.retention_days = None if retention_days is None else float(retention_days)
+        self.overlap = dt.timedelta(minutes=float(overlap_minutes))
+
+        self.metrics = RunMetrics(metrics_file_path, profile=profile)
+        for client in self.http_clients():
+            client.add_instrument(self.metrics.http)
+
         return
 
     @staticmethod
@@ -67,97 +187,931 @@ class DB_Base(ABC):
 
         return stock_names
 
-    @staticmethod
-    def __read_last_line(file_path: str) -> str:
-        with open(file_path, 'rb') as f:
-            f.seek(-2, os.SEEK_END)
-            
-            val = f.read(1)
-            while val == b'\n':
-                f.seek(-2, os.SEEK_CUR)
-                val = f.read(1)
+    def log(self, msg: str, flush: bool = False):
+        
+        with self.__log_lock:
+            if self.__log_file is None:
+                self.__log_file = open(self.__log_file_path, 'a')
+            self.__log_file.write('{} {}\n'.format(dt.datetime.now().strftime(DTIME_FORMAT), msg))
+            if flush:
+                self.__log_file.flush()
+        return
+
+    def http_clients(self) -> list:
+        """HTTP clients used by get_data, so that their requests can be timed; subclasses should override this.
+        """
+        return []
+
+    async def update_async(self) -> Dict[str, SymbolResult]:
+        """
+        Summary:
+            + Parse the current universe of symbols
+            + Read the manifest of per-symbol watermarks
+            + Recover from an interrupted run, if its journal was left behind (see 'recover')
+            + If sharded, put the symbols of this worker's shard first, followed by the other shards'
+                symbols (if steal_work is set); a symbol is only updated by the worker that holds its lease,
+                and only if no other worker has updated it since this run started
+            + Hand the symbols out to `max_workers` workers; each worker repeatedly
+                + Waits on the rate limiter that is shared by all workers
+                + Looks up the last date we have symbol data for in the manifest (parsing the
+                    end of the file only if the manifest disagrees with the file)
+                + Makes an API call using the get_data function (on a worker thread)
+                + Appends new data to the end of the file and records the new watermark
+            If decode_workers is above 0, then the symbols go through update_pipelined instead.
+            If fill_gaps is set, then gaps inside the stored data are filled in afterwards (see fill_gaps_async).
 
-            while val != b'\n':
-                f.seek(-2, os.SEEK_CUR)
-                val = f.read(1)
+        Returns:
+            Dict[str, SymbolResult] -- Outcome of the update for each symbol in the universe.
+        """
 
-            return f.readline().decode().strip('\n')
+        # Update each of the relevant symbols
+        self.log('STARTED UPDATE.', flush=True)
+        self.metrics.reset()
+        self.__run_start = time.time()
+        self.__run_counts = {}
+        symbols = self.__shard_order(self.__get_symbols())
+        self.__report_progress('running')
+        with self.metrics.stage('load_manifest'):
+            self.manifest.load()
 
-    @staticmethod
-    def __parse_date_from_line(line: str) -> dt.datetime:
-        date_str = line.split(',')[0]
-        return dt.datetime.strptime(date_str, DTIME_FORMAT)
+        with self.metrics.stage('recover'):
+            started, completed = self.recover()
+        completed &= set(symbols)
+        self.journal.start(started, completed)
+        if len(completed) > 0:
+            self.log('RESUMING INTERRUPTED RUN; SKIPPING {} COMPLETED SYMBOLS.'.format(len(completed)), flush=True)
+        results = {symbol: SymbolResult(symbol, 'SKIPPED', 0, None) for symbol in symbols if symbol in completed}
+        all_symbols, symbols = symbols, [symbol for symbol in symbols if symbol not in completed]
 
-    @staticmethod
-    def __parse_last_dtime(file_path: str) -> dt.datetime:
-        last_line = DB_Base.__read_last_line(file_path)
-        return DB_Base.__parse_date_from_line(last_line)
+        limiter = RateLimiter(self.req_per_sec)
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                results.update(await self.__update_symbols(symbols, limiter, executor))
+                await self.__finish_batch(all_symbols, results, limiter, executor)
+        finally:
+            for client in self.http_clients():
+                await client.aclose() # asynchronous sessions can't outlive the event loop
 
-    def log(self, msg: str):
-        
-        with open(self.__log_file_path, 'a') as lf:
-            lf.write('{} {}\n'.format(dt.datetime.now().strftime(DTIME_FORMAT), msg))
+        self.journal.finish()
+        if self.shard is not None: # leave out the other shards' symbols that other workers took care of
+            results = {symbol: result for symbol, result in results.items()
+                        if result.status != 'SKIPPED' or shard_of(symbol, self.shard[1]) == self.shard[0]}
+            self.__run_counts = {}
+            for result in results.values():
+                self.__run_counts[result.status] = self.__run_counts.get(result.status, 0) + 1
+
+        n_failed = sum(result.status == 'ERROR' for result in results.values())
+        self.__log_clients()
+        summary = self.metrics.finish()
+        self.log('RUN SUMMARY: {}'.format(json.dumps(summary)))
+        merged = self.__report_progress('finished', rows=sum(result.rows for result in results.values()), metrics=summary)
+        if merged is not None:
+            self.log('MERGED SUMMARY: {} OF {} WORKERS FINISHED, {} SYMBOLS.'.format(merged['finished'], self.shard[1], json.dumps(merged['counts'])), flush=True)
+            if self.panel_fields and merged['finished'] >= self.shard[1]: # the last worker to finish extends the panels
+                self.update_panel()
+        self.log('FINISHED UPDATE. {} SUCCEEDED, {} FAILED.'.format(len(results)-n_failed, n_failed), flush=True)
+        return results
+
+    def __shard_order(self, symbols: List[str], steal: bool = True) -> List[str]:
+        """The symbols that this worker should go through, in order: all of them if it isn't sharded; otherwise
+        those of its own shard, followed by (if steal and steal_work are set) the others in reverse, away from their owners.
+        """
+
+        if self.shard is None:
+            return symbols
+        index, count = self.shard
+        own = [symbol for symbol in symbols if shard_of(symbol, count) == index]
+        others = [symbol for symbol in reversed(symbols) if shard_of(symbol, count) != index]
+        return own + others if steal and self.steal_work else own
+
+    def __claim(self, symbol: str) -> bool:
+        """Take the symbol's lease, if it is sharded; False if another worker holds it or already updated the symbol in this run.
+        """
+
+        if self.leases is None:
+            return True
+        if not self.leases.acquire(symbol):
+            return False
+        entry = self.manifest.get(symbol)
+        if entry is not None and entry.status != 'ERROR' and entry.updated.timestamp() >= self.__run_start:
+            self.leases.release(symbol)
+            return False
+        return True
+
+    def __release(self, symbol: str, result: SymbolResult):
+        if self.leases is None:
+            return
+        self.leases.release(symbol)
+        self.__run_counts[result.status] = self.__run_counts.get(result.status, 0) + 1
+        if sum(self.__run_counts.values()) % self.PROGRESS_EVERY == 0:
+            self.__report_progress('running')
+        return
+
+    def __report_progress(self, state: str, **extra) -> Optional[Dict]:
+        """Report this worker's progress, if it is sharded.
+
+        Returns:
+            Optional[Dict] -- The merged progress of every worker (see ShardProgress.merge).
+        """
+
+        if self.progress is None:
+            return None
+        progress = dict(state=state, shard=list(self.shard), started=self.__run_start, updated=time.time(), counts=dict(self.__run_counts), **extra)
+        return self.progress.report(progress)
+
+    async def __update_symbols(self, symbols: List[str], limiter: RateLimiter, executor: ThreadPoolExecutor, decoders: ProcessPoolExecutor = None) -> Dict[str, SymbolResult]:
+        """Fetch and store new data for the symbols, with `max_workers` workers or (if decode_workers is above 0) with update_pipelined.
+        """
+
+        if self.decode_workers > 0:
+            return await self.update_pipelined(symbols, limiter, decoders)
+
+        loop = asyncio.get_running_loop()
+        results = {}
+        symbol_locks = {symbol: asyncio.Lock() for symbol in symbols} # appends to a single file must never interleave
+        queue = asyncio.Queue()
+        for symbol in symbols:
+            queue.put_nowait(symbol)
+
+        async def worker():
+            while not queue.empty():
+                symbol = queue.get_nowait()
+                async with symbol_locks[symbol]:
+                    if not self.__claim(symbol):
+                        results[symbol] = SymbolResult(symbol, 'SKIPPED', 0, None)
+                        continue
+                    waited = await limiter.acquire()
+                    self.metrics.record('rate_limit_wait', waited, symbol=symbol)
+                    try:
+                        results[symbol] = await loop.run_in_executor(executor, self.__update_symbol, symbol)
+                    except Exception as ex:
+                        results[symbol] = self.__failed(symbol, ex)
+                    self.__release(symbol, results[symbol])
+
+        await asyncio.gather(*[worker() for _ in range(min(self.max_workers, len(symbols)) or 1)])
+        return results
+
+    async def __finish_batch(self, symbols: List[str], results: Dict[str, SymbolResult], limiter: RateLimiter, executor: ThreadPoolExecutor):
+        """
+        Once the symbols were updated: fill in gaps (if fill_gaps is set), drop rows older than retention_days (if set),
+        compact the symbols that were written to, and extend the panels (if there are panel_fields).
+        """
+
+        if self.fill_gaps:
+            filled = await self.fill_gaps_async([symbol for symbol in symbols if results[symbol].status != 'ERROR'], limiter, executor)
+            for symbol, n_filled in filled.items():
+                results[symbol] = results[symbol]._replace(rows=results[symbol].rows + n_filled)
+
+        loop = asyncio.get_running_loop()
+        written = [symbol for symbol in symbols if results[symbol].status not in ('ERROR', 'SKIPPED')]
+        if self.retention_days is not None:
+            start = dt.datetime.now() - dt.timedelta(days=self.retention_days)
+            await loop.run_in_executor(executor, self.drop_before, start, written)
+        await loop.run_in_executor(executor, self.compact, written)
+
+        if self.panel_fields and self.shard is None: # sharded workers leave the panels to the last one to finish
+            await loop.run_in_executor(executor, self.update_panel)
         return
 
-    async def update_async(self):
+    def __all_storages(self) -> List[Storage]:
+        """Storage of the minute data, followed by the storages of the rollups and features.
+        """
+
+        storages = [self.storage]
+        if self.rollups is not None:
+            storages += [self.rollups.series(resolution) for resolution in self.rollups.resolutions]
+        if self.features is not None:
+            storages += [self.features.series(name) for name in self.features.names]
+        return storages
+
+    def __for_each_stored(self, symbols: Optional[List[str]], stage: str, apply) -> int:
+        """
+        Apply a change of layout to every storage of each symbol (holding its lease, if sharded), and record it in the manifest.
+
+        Arguments:
+            symbols {Optional[List[str]]} -- Symbols to apply it to; if None, then the whole universe.
+            stage {str} -- Name of the stage, for the metrics.
+            apply {Callable} -- apply(storage, symbol) -> int; the minute data's counts are summed up.
+
+        Returns:
+            int -- Sum of what apply returned for the minute data.
+        """
+
+        total = 0
+        for symbol in (self.__get_symbols() if symbols is None else symbols):
+            if not self.storage.exists(symbol):
+                continue
+            if self.leases is not None and not self.leases.acquire(symbol):
+                continue
+            try:
+                with self.metrics.symbol(symbol), self.metrics.stage(stage):
+                    for storage in self.__all_storages():
+                        if storage.exists(symbol):
+                            n = apply(storage, symbol)
+                            total += n if storage is self.storage else 0
+                    entry = self.manifest.get(symbol)
+                    if entry is not None and entry.bytes != self.storage.size(symbol):
+                        self.manifest.record_layout(symbol, self.storage.n_rows(symbol), self.storage.size(symbol))
+            finally:
+                if self.leases is not None:
+                    self.leases.release(symbol)
+        return total
+
+    def compact(self, symbols: List[str] = None) -> int:
+        """
+        Merge the small chunks that frequent updates appended into larger ones, in the minute data, rollups and
+        features of each symbol (see Storage.compact); only partitioned storage formats have anything to merge.
+        Runs after every update on the symbols that it wrote to.
+
+        Keyword Arguments:
+            symbols {List[str]} -- Symbols to compact; if None, then the whole universe. (default: {None})
+
+        Returns:
+            int -- Number of chunks of minute data merged away.
+        """
+
+        n_merged = self.__for_each_stored(symbols, 'compact', lambda storage, symbol: storage.compact(symbol))
+        if n_merged > 0:
+            self.log('COMPACTED {} CHUNKS.'.format(n_merged))
+        return n_merged
+
+    def drop_before(self, start: dt.datetime, symbols: List[str] = None) -> int:
+        """
+        Drop the rows before start from the minute data, rollups and features of each symbol (see Storage.drop_before),
+        e.g. to enforce a retention period. Partitioned storage formats drop whole partitions without reading them.
+
+        Arguments:
+            start {dt.datetime} -- Earliest datetime to keep.
+
+        Keyword Arguments:
+            symbols {List[str]} -- Symbols to drop rows of; if None, then the whole universe. (default: {None})
+
+        Returns:
+            int -- Number of rows of minute data dropped.
+        """
+
+        n_dropped = self.__for_each_stored(symbols, 'retention', lambda storage, symbol: storage.drop_before(symbol, start))
+        if n_dropped > 0:
+            self.log('DROPPED {} ROWS BEFORE {}.'.format(n_dropped, start))
+        return n_dropped
+
+    def __log_clients(self):
+        for client in self.http_clients():
+            if client.rate_limiter is not None:
+                self.log('ADAPTIVE RATE: {:.1f} REQUESTS/SEC, {} THROTTLED.'.format(client.rate_limiter.rate, client.rate_limiter.n_throttled))
+        if self.response_cache is not None:
+            self.log('RESPONSE CACHE: {} HITS, {} MISSES, {} BYTES.'.format(self.response_cache.hits, self.response_cache.misses, self.response_cache.size))
+        return
+
+    async def update_pipelined(self, symbols: List[str], limiter: RateLimiter, decoders: ProcessPoolExecutor = None) -> Dict[str, SymbolResult]:
+        """
+        Update the symbols in three overlapping stages (see db/pipeline.py):
+            + Up to `max_workers` fetch coroutines call fetch_raw, sharing the rate limiter
+            + `decode_workers` processes turn the raw payloads into DataFrames with decode_raw, and
+                format them for the storage backend (e.g. as CSV text)
+            + A single writer thread appends the formatted data and records the new watermarks
+        The queues between the stages are bounded, so fetching slows down whenever decoding or
+        writing falls behind, and only a few payloads are held in memory at once. The decoding
+        processes are started for this call, unless a pool of them is passed in as `decoders`.
+
+        Returns:
+            Dict[str, SymbolResult] -- Outcome of the update for each symbol.
+        """
+
+        def plan(symbol: str):
+            if not self.__claim(symbol):
+                raise _NotClaimed(symbol)
+            with self.metrics.symbol(symbol), self.metrics.stage('watermark'):
+                return self.__watermark(symbol)
+
+        async def fetch(symbol: str, state: tuple):
+            last_dtime, _ = state
+            waited = await limiter.acquire()
+            self.metrics.record('rate_limit_wait', waited, symbol=symbol)
+            if last_dtime is not None:
+                payload, decode_args = await self.fetch_raw(symbol, start=self.__fetch_start(last_dtime), end=dt.datetime.now(), new_data=False)
+            else:
+                payload, decode_args = await self.fetch_raw(symbol, start=None, end=None, new_data=True)
+            return payload, decode_args, (last_dtime is None,) # new files are written with a header
+
+        def store(symbol: str, state: tuple, data: pd.DataFrame, encoded) -> SymbolResult:
+            last_dtime, n_rows = state
+            with self.metrics.symbol(symbol):
+                return self.__store(symbol, last_dtime, n_rows, data, encoded)
+
+        outcomes = await run_pipeline(symbols, plan, fetch, type(self).decode_raw, self.storage.encode, store,
+                                        n_fetchers=self.max_workers, n_decoders=self.decode_workers,
+                                        queue_size=2*self.decode_workers, metrics=self.metrics, decoders=decoders)
+
+        results = {}
+        for symbol in symbols:
+            outcome = outcomes[symbol]
+            if isinstance(outcome, _NotClaimed):
+                results[symbol] = SymbolResult(symbol, 'SKIPPED', 0, None)
+                continue
+            results[symbol] = self.__failed(symbol, outcome) if isinstance(outcome, Exception) else outcome
+            self.__release(symbol, results[symbol])
+        return results
+
+    async def fill_gaps_async(self, symbols: List[str], limiter: RateLimiter, executor: ThreadPoolExecutor) -> Dict[str, int]:
         """
         Summary:
-            + Parse the current universe of symbols
-            + Iterate over all symbols in universe
-                + Parse the last line of the file to get the last date we have symbol data for
-                + Make an API call using the get_data function
-                + Append new data to the end of the file
+            + Ask find_gaps for the ranges missing inside each symbol's stored data
+            + Fetch each range with get_data, waiting on the rate limiter like any other call
+            + Stitch the fetched rows into place (see 'stitch')
+        Symbols are handled by up to `max_workers` workers; a failure only affects its own symbol.
+
+        Returns:
+            Dict[str, int] -- Number of rows filled in for each symbol that had gaps.
         """
 
-        # Update each of the relevant symbols
-        self.log('STARTED UPDATE.')
-        symbols = self.__get_symbols()
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
         for symbol in symbols:
-            # Set up a minimum iteration time, so as to not overwhelm the api
-            hourglass = asyncio.sleep(.5)
-
-            # If the file already exists, update it; otherwise make a new file
-            file_path = os.path.join(self.__data_file_path, '{}.csv'.format(symbol))
-            if os.path.exists(file_path):
-                 last_dtime = DB_Base.__parse_last_dtime(file_path)
-                 start_dtime = last_dtime + dt.timedelta(microseconds=1) # barely nudge forward in time to avoid pulling data that's already in the csv
-                 data = self.get_data(symbol, start=start_dtime, end=dt.datetime.now(), new_data=False)
-                 data.to_csv(file_path, mode='a', header=False)
-                 self.log('APPENDED {} LINES TO {}.'.format(len(data), symbol))
+            queue.put_nowait(symbol)
+
+        filled = {}
+
+        async def worker():
+            while not queue.empty():
+                symbol = queue.get_nowait()
+                if self.leases is not None and not self.leases.acquire(symbol):
+                    continue
+                try:
+                    gaps = await loop.run_in_executor(executor, self.find_gaps, symbol)
+                    frames = []
+                    for start, end in gaps:
+                        waited = await limiter.acquire()
+                        self.metrics.record('rate_limit_wait', waited, symbol=symbol)
+                        frames.append(await loop.run_in_executor(executor, self.get_data, symbol, start, end, False))
+
+                    frames = [frame for frame in frames if len(frame) > 0]
+                    if len(frames) > 0:
+                        filled[symbol] = await loop.run_in_executor(executor, self.stitch, symbol, pd.concat(frames))
+                        self.log('FILLED {} LINES IN {} GAPS OF {}.'.format(filled[symbol], len(gaps), symbol))
+                except Exception as ex:
+                    self.metrics.count('errors', symbol=symbol, error=repr(ex))
+                    self.log('ERROR FILLING GAPS OF {}: {!r}'.format(symbol, ex), flush=True)
+                if self.leases is not None:
+                    self.leases.release(symbol)
+
+        with self.metrics.stage('fill_gaps'):
+            await asyncio.gather(*[worker() for _ in range(min(self.max_workers, len(symbols)) or 1)])
+        return filled
+
+    def stitch(self, symbol: str, data: pd.DataFrame) -> int:
+        """
+        Merge rows into the symbol's stored data in datetime order, e.g. to fill in a gap.
+        Stored rows win over new rows with the same datetime. Only the data from the first
+        new row onwards is rewritten; the manifest, rollups, and features are brought up to date,
+        and the panels read the rows from there on again at their next update. Outside of an
+        update (e.g. to backfill by hand), the write is journaled on its own.
+
+        Arguments:
+            symbol {str}
+            data {pd.DataFrame} -- Rows with datetime index in ascending order.
+
+        Returns:
+            int -- Number of rows added.
+        """
+
+        if len(data) == 0:
+            return 0
+        if self.journal.active:
+            return self.__stitch(symbol, data)
+
+        started, completed = self.recover() # writes that an interrupted run left unfinished are rolled back first
+        self.journal.start(started, completed)
+        try:
+            return self.__stitch(symbol, data)
+        finally:
+            self.journal.finish(keep=started is not None) # the interrupted run can still be resumed
+
+    def __stitch(self, symbol: str, data: pd.DataFrame) -> int:
+        with self.metrics.symbol(symbol):
+            _, n_rows = self.__watermark(symbol)
+            start = data.index[0].to_pydatetime()
+            self.journal.pending(symbol, start)
+            try:
+                with self.metrics.stage('stitch'):
+                    tail = self.storage.read_range(symbol, start)
+                    merged = pd.concat([tail, data[tail.columns]])
+                    merged = merged[~merged.index.duplicated(keep='first')].sort_index()
+
+                    self.storage.truncate_from(symbol, start)
+                    self.storage.append(symbol, merged)
+                    self.storage.sync(symbol)
+
+                n_added = len(merged) - len(tail)
+                self.metrics.count('rows', n_added)
+                with self.metrics.stage('manifest'):
+                    self.manifest.record(symbol, merged.index[-1].to_pydatetime(), n_rows + n_added, self.storage.size(symbol), 'FILLED')
+
+                if self.rollups is not None:
+                    with self.metrics.stage('rollups'):
+                        self.rollups.rebuild_from(symbol, start)
+
+                if self.features is not None:
+                    with self.metrics.stage('features'):
+                        self.features.rebuild_from(symbol, start)
+
+                with self.metrics.stage('panel'):
+                    self.__invalidate_panels(symbol, start)
+            except Exception:
+                self.__roll_back(symbol, start) # the rows from start on are fetched again by the next update
+                raise
+            self.journal.done(symbol)
+            if n_added > 0:
+                self.publisher.publish(BarBatch(symbol, 'FILLED', merged[~merged.index.isin(tail.index)]))
+
+        return n_added
+
+    def __failed(self, symbol: str, ex: Exception) -> SymbolResult:
+        self.manifest.record_status(symbol, 'ERROR')
+        self.metrics.count('errors', symbol=symbol, error=repr(ex))
+        self.log('ERROR ON {}: {!r}'.format(symbol, ex), flush=True)
+        return SymbolResult(symbol, 'ERROR', 0, repr(ex))
+
+    def __watermark(self, symbol: str):
+        """
+        Find the symbol's last datetime and row count, trusting the manifest as long as
+        the size of the stored data matches the size recorded in it.
+
+        Returns:
+            Tuple[Optional[dt.datetime], int] -- Last datetime (None if there is no data) and number of rows.
+        """
+
+        if not self.storage.exists(symbol):
+            return None, 0
+
+        entry = self.manifest.get(symbol)
+        if entry is not None and entry.bytes == self.storage.size(symbol):
+            return entry.last_dtime, entry.rows
+
+        # the manifest is missing or stale, so scan the data itself, once any partial row is cut off
+        self.log('MANIFEST MISMATCH ON {}; SCANNING FILE.'.format(symbol))
+        if self.storage.repair(symbol):
+            self.log('REPAIRED TORN TAIL OF {}.'.format(symbol))
+            if not self.storage.exists(symbol):
+                return None, 0
+        return self.storage.last_dtime(symbol), self.storage.n_rows(symbol)
+
+    def __fetch_start(self, last_dtime: dt.datetime) -> dt.datetime:
+        """Datetime to fetch from, for a symbol whose last stored row is at last_dtime.
+        """
+
+        if self.overlap > dt.timedelta(0):
+            return last_dtime - self.overlap # fetched again, and merged in by __upsert
+        return last_dtime + dt.timedelta(microseconds=1) # barely nudge forward in time to avoid pulling data that's already stored
+
+    def __fetch(self, symbol: str, last_dtime: Optional[dt.datetime]) -> pd.DataFrame:
+        """Call get_data for the rows after last_dtime (or for as much history as possible, if it is None).
+        """
+
+        start = time.perf_counter()
+        http_seconds = self.metrics.http_seconds
+        with self.metrics.stage('get_data'):
+            if last_dtime is not None:
+                data = self.get_data(symbol, start=self.__fetch_start(last_dtime), end=dt.datetime.now(), new_data=False)
             else:
                 data = self.get_data(symbol, start=None, end=None, new_data=True)
-                data.to_csv(file_path, mode='w', header=True)
-                self.log('CREATED: {}'.format(symbol))
-            
-
-            # ph = tda.PriceHistory(api_key)
-
-            # try: # try appending to an already existing csv
-            #     last_dtime = __parse_last_dtime(file_path) # will raise FileNotFoundError if the stock is not already in the database
-            #     start_dtime = last_dtime + dt.timedelta(microseconds=1) # barely nudge forward in time to avoid pulling data that's already in the csv
-            #     recent_pricing: pd.DataFrame = ph.minute_data(symbol, start_dtime, need_extended_hours=True)
-            #     recent_pricing.to_csv(file_path, mode='a', header=False, sep=DATA_DELIMITER)
-            #     log('APPEND {} LINES TO {}'.format(len(recent_pricing), symbol), self.__log_file_path)
-            # except FileNotFoundError: # no csv exists for this symbol yet, so write a new one
-            #     recent_pricing: pd.DataFrame = ph.max_minute_data(symbol)
-            #     recent_pricing.to_csv(file_path, mode='w', header=True, sep=DATA_DELIMITER)
-            #     log('CREATE: {}'.format(symbol), self.__log_file_path)
-            # except tda.EmptyApiRequest:
-            #     log('NO CHANGE: {}'.format(symbol), self.__log_file_path)
-            # except Exception as ex:
-            #     log('ERROR ON {}:\n{}'.format(symbol, ex), self.__log_file_path)
-
-            await hourglass
-
-        self.log('FINISHED UPDATE.')
+
+        # whatever get_data spent outside of its HTTP requests was (mostly) spent decoding the responses
+        self.metrics.record('decode', max(0., time.perf_counter() - start - (self.metrics.http_seconds - http_seconds)))
+        return data
+
+    def __update_symbol(self, symbol: str) -> SymbolResult:
+        """Fetch and store new data for a single symbol. Runs on a worker thread.
+        """
+
+        with self.metrics.symbol(symbol):
+            with self.metrics.stage('watermark'):
+                last_dtime, n_rows = self.__watermark(symbol)
+
+            data = self.__fetch(symbol, last_dtime)
+            return self.__store(symbol, last_dtime, n_rows, data)
+
+    def __store(self, symbol: str, last_dtime: Optional[dt.datetime], n_rows: int, data: pd.DataFrame, encoded=None) -> SymbolResult:
+        """Write new data after the symbol's watermark and record the new watermark. If given, `encoded`
+        (the output of storage.encode) is written instead of formatting the data again. Data that reaches
+        back to (or before) the watermark is merged into the stored rows instead; see '__upsert'.
+        """
+
+        if len(data) > 0 and not data.index.is_unique: # overlapping pages of the API's responses
+            data, encoded = data[~data.index.duplicated(keep='last')], None
+        if last_dtime is not None and len(data) > 0 and data.index[0] <= last_dtime:
+            return self.__upsert(symbol, last_dtime, n_rows, data)
+
+        start = None if last_dtime is None else last_dtime + dt.timedelta(microseconds=1) # rows that the write may touch
+        self.journal.pending(symbol, start)
+        try:
+            # If the symbol already has data, update it; otherwise make a new file
+            with self.metrics.stage('write'):
+                if last_dtime is not None:
+                    if encoded is not None:
+                        self.storage.append_encoded(symbol, encoded)
+                    else:
+                        self.storage.append(symbol, data)
+                    status = 'APPENDED'
+                else:
+                    if encoded is not None:
+                        self.storage.write_encoded(symbol, encoded)
+                    else:
+                        self.storage.write(symbol, data)
+                    n_rows = 0
+                    status = 'CREATED'
+                self.storage.sync(symbol)
+
+            with self.metrics.stage('manifest'):
+                if len(data) > 0:
+                    last_dtime = data.index[-1].to_pydatetime()
+                self.manifest.record(symbol, last_dtime, n_rows + len(data), self.storage.size(symbol), status)
+
+            if self.rollups is not None:
+                with self.metrics.stage('rollups'):
+                    self.rollups.update(symbol, data)
+
+            if self.features is not None:
+                with self.metrics.stage('features'):
+                    self.features.update(symbol, data)
+        except Exception:
+            self.__roll_back(symbol, start)
+            raise
+        self.journal.done(symbol)
+        if len(data) > 0:
+            self.publisher.publish(BarBatch(symbol, status, data))
+
+        if status == 'APPENDED':
+            self.log('APPENDED {} LINES TO {}.'.format(len(data), symbol))
+        else:
+            self.log('CREATED: {}'.format(symbol))
+        self.metrics.count('rows', len(data))
+
+        return SymbolResult(symbol, status, len(data), None)
+
+    @staticmethod
+    def merge_rows(stored: pd.DataFrame, data: pd.DataFrame) -> Tuple[pd.DataFrame, int]:
+        """
+        Sorted merge of new rows into stored rows, where a new row replaces the stored row with the same datetime.
+
+        Arguments:
+            stored {pd.DataFrame} -- Stored rows, with unique datetime index in ascending order.
+            data {pd.DataFrame} -- New rows, with datetime index in ascending order, and the same columns; of
+                                    several rows with the same datetime, the last one is kept.
+
+        Returns:
+            Tuple[pd.DataFrame, int] -- The merged rows from the first one that the new rows change (added, or
+                                        with values that differ by more than REVISION_RTOL) onwards, which is empty if they change nothing;
+                                        and the number of rows added.
+        """
+
+        if not data.index.is_unique:
+            data = data[~data.index.duplicated(keep='last')]
+        old_ns, new_ns = ColumnarStorage.to_epoch_ns(stored.index), ColumnarStorage.to_epoch_ns(data.index)
+        data = data[stored.columns]
+
+        # where each new row's datetime is among the stored ones, and vice versa
+        at = np.minimum(np.searchsorted(old_ns, new_ns), max(len(old_ns) - 1, 0))
+        existed = (old_ns[at] == new_ns) if len(old_ns) > 0 else np.zeros(len(new_ns), dtype=bool)
+        at_new = np.minimum(np.searchsorted(new_ns, old_ns), max(len(new_ns) - 1, 0))
+        replaced = (new_ns[at_new] == old_ns) if len(new_ns) > 0 else np.zeros(len(old_ns), dtype=bool)
+
+        old_values = stored.to_numpy(dtype=np.float64)[at[existed]]
+        new_values = data.to_numpy(dtype=np.float64)[existed]
+        changed = ~existed
+        changed[existed] = ~np.isclose(old_values, new_values, rtol=DB_Base.REVISION_RTOL, atol=0., equal_nan=True).all(axis=1)
+        if not changed.any():
+            return data.iloc[:0], 0
+
+        first_changed = new_ns[np.argmax(changed)]
+        kept = stored[~replaced & (old_ns >= first_changed)]
+        data = data[new_ns >= first_changed]
+        merged_ns = np.concatenate([ColumnarStorage.to_epoch_ns(kept.index), ColumnarStorage.to_epoch_ns(data.index)])
+        merged = pd.concat([kept, data]).iloc[np.argsort(merged_ns, kind='stable')] # both halves are sorted already
+        return merged, int((~existed).sum())
+
+    def __upsert(self, symbol: str, last_dtime: dt.datetime, n_rows: int, data: pd.DataFrame) -> SymbolResult:
+        """
+        Merge fetched rows that overlap the symbol's stored data into it (see 'merge_rows'), rewriting only the stored
+        rows from the first one that changes onwards. If only rows after the watermark change, they are simply appended.
+        """
+
+        with self.metrics.stage('merge'):
+            merged, n_added = DB_Base.merge_rows(self.storage.read_range(symbol, data.index[0]), data)
+        if len(merged) == 0 or merged.index[0] > last_dtime:
+            return self.__store(symbol, last_dtime, n_rows, merged)
+
+        start = merged.index[0].to_pydatetime()
+        self.journal.pending(symbol, start)
+        try:
+            with self.metrics.stage('write'):
+                self.storage.truncate_from(symbol, start)
+                self.storage.append(symbol, merged)
+                self.storage.sync(symbol)
+
+            with self.metrics.stage('manifest'):
+                self.manifest.record(symbol, merged.index[-1].to_pydatetime(), n_rows + n_added, self.storage.size(symbol), 'REVISED')
+
+            if self.rollups is not None:
+                with self.metrics.stage('rollups'):
+                    self.rollups.rebuild_from(symbol, start)
+
+            if self.features is not None:
+                with self.metrics.stage('features'):
+                    self.features.rebuild_from(symbol, start)
+
+            with self.metrics.stage('panel'):
+                self.__invalidate_panels(symbol, start)
+        except Exception:
+            self.__roll_back(symbol, start) # the overlap window is fetched again by the next update
+            raise
+        self.journal.done(symbol)
+        self.publisher.publish(BarBatch(symbol, 'REVISED', merged))
+
+        self.log('REVISED {} LINES OF {} ({} NEW).'.format(len(merged), symbol, n_added))
+        self.metrics.count('rows', n_added)
+        self.metrics.count('revised_rows', len(merged) - n_added)
+        return SymbolResult(symbol, 'REVISED', n_added, None)
+
+    def __invalidate_panels(self, symbol: str, start: Optional[dt.datetime]):
+        """Have the next panel update read the symbol's rows from start on again (see Panel.invalidate).
+        """
+
+        for resolution in Panel.resolutions(self.storage.data_dir):
+            Panel(self.storage.data_dir, resolution).invalidate(symbol, start)
+        return
+
+    def __roll_back(self, symbol: str, start: Optional[dt.datetime]):
+        """Undo a write that didn't complete: drop the symbol's rows from start on (or all of its data, if start
+        is None), and bring the rollups and features back in line. The manifest is left alone; it no longer matches the data,
+        so the next update scans the data for its watermark.
+        """
+
+        if self.storage.exists(symbol):
+            self.storage.repair(symbol) # a partial row would throw off the search for start
+        if start is None:
+            self.storage.remove(symbol)
+        elif self.storage.exists(symbol):
+            self.storage.truncate_from(symbol, start)
+        if self.rollups is not None:
+            self.rollups.roll_back(symbol, start)
+        if self.features is not None:
+            self.features.rebuild(symbol)
+        self.__invalidate_panels(symbol, start)
+        self.log('ROLLED BACK UNFINISHED WRITE TO {}.'.format(symbol), flush=True)
         return
 
-    def update(self):
+    def recover(self):
+        """
+        Read the journal of an interrupted run (see db/journal.py), and roll back the writes that it left unfinished.
+        The symbols that the run completed can be skipped, as long as it started within RESUME_WINDOW_SECONDS.
+
+        Returns:
+            Tuple[Optional[float], Set[str]] -- Start time (epoch seconds) of the run to resume, or None to start
+                                                a new one; and the symbols that it completed.
+        """
+
+        state = self.journal.load()
+        for symbol, start in state.pending.items():
+            if self.leases is not None:
+                self.leases.wait(symbol) # the lease of a crashed worker is broken once it expires
+            self.__roll_back(symbol, start)
+            state.completed.discard(symbol)
+            if self.leases is not None:
+                self.leases.release(symbol)
+
+        if state.started is None or time.time() - state.started > self.RESUME_WINDOW_SECONDS:
+            return None, set()
+        return state.started, state.completed
+
+    def __series_storage(self, resolution: Optional[str]) -> Storage:
+        if resolution is None:
+            return self.storage
+        assert self.rollups is not None, 'No rollups are maintained by this database.'
+        return self.rollups.series(resolution)
+
+    def migrate(self, data_dir: str, storage: str = 'partitioned', processes: int = None, chunk_rows: int = CHUNK_ROWS,
+                    verify_only: bool = False) -> Dict[str, Dict]:
+        """
+        Convert the universe's minute data to another storage format in another folder, streaming each symbol
+        through a pool of processes, and verify the result; see db/migrate.py. Running it again resumes it.
+
+        Arguments:
+            data_dir {str} -- Folder to migrate the data to.
+
+        Keyword Arguments:
+            storage {str} -- Name of the storage format to migrate to; see STORAGE_FORMATS. (default: {'partitioned'})
+            processes {int} -- Number of worker processes; if None, then one per CPU. (default: {None})
+            chunk_rows {int} -- Most rows that a worker holds in memory at a time. (default: {CHUNK_ROWS})
+            verify_only {bool} -- Only compare the data that was migrated before with the source. (default: {False})
+
+        Returns:
+            Dict[str, Dict] -- Result of each symbol; see migrate_symbol.
+        """
+
+        assert storage in STORAGE_FORMATS, 'Storage format "{}" is not valid.'.format(storage)
+        os.makedirs(data_dir, exist_ok=True)
+        return migrate(self.storage, STORAGE_FORMATS[storage](data_dir), self.__get_symbols(), processes, chunk_rows,
+                        verify_only, log=lambda message: self.log(message, flush=True))
+
+    def read(self, symbol: str, start: dt.datetime = None, end: dt.datetime = None, columns: List[str] = None, resolution: str = None) -> pd.DataFrame:
+        """Read a symbol's data with start <= datetime <= end. Only the requested range is read from disk.
+
+        Arguments:
+            symbol {str}
+            start {dt.datetime} -- Earliest datetime to read; if None, then read from the first row.
+            end {dt.datetime} -- Latest datetime to read (inclusive); if None, then read to the last row.
+            columns {List[str]} -- Data columns to read; if None, then read all of them.
+            resolution {str} -- Rollup resolution (e.g. '1d') to read; if None, then read the minute data.
+
+        Returns:
+            pd.DataFrame -- Data for the given symbol, with datetime index
+        """
+        return self.__series_storage(resolution).read_range(symbol, start, end, columns)
+
+    def read_features(self, symbol: str, names: List[str] = None, start: dt.datetime = None, end: dt.datetime = None) -> pd.DataFrame:
+        """Read a symbol's derived series with start <= datetime <= end, one column per feature.
+
+        Arguments:
+            symbol {str}
+            names {List[str]} -- Features to read; if None, then all of the maintained ones.
+            start {dt.datetime} -- Earliest datetime to read; if None, then read from the first row.
+            end {dt.datetime} -- Latest datetime to read (inclusive); if None, then read to the last row.
+
+        Returns:
+            pd.DataFrame -- Values of the features, with datetime index
+        """
+
+        assert self.features is not None, 'No features are maintained by this database.'
+        names = names or self.features.names
+        return pd.concat([self.features.series(name).read_range(symbol, start, end) for name in names], axis=1)
+
+    def read_many(self, symbols: List[str], start: dt.datetime = None, end: dt.datetime = None, columns: List[str] = None, resolution: str = None) -> Dict[str, pd.DataFrame]:
+        """See 'read' for details; symbols without any stored data are left out.
+        """
+
+        storage = self.__series_storage(resolution)
+        symbols = [symbol for symbol in symbols if storage.exists(symbol)]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            frames = executor.map(lambda symbol: storage.read_range(symbol, start, end, columns), symbols)
+            return dict(zip(symbols, frames))
+
+    def update_panel(self, fields: List[str] = None, resolution: str = None) -> Panel:
+        """
+        Build or extend the time x symbol panels of the universe in the symbol file, first cutting off
+        the times older than retention_days (if set). See 'Panel' for the layout; other processes can open the same panels with
+        Panel(data_file_path, resolution) and map them without loading them.
+
+        Arguments:
+            fields {List[str]} -- Data columns to build panels of; if None, then use panel_fields.
+            resolution {str} -- Rollup resolution to build the panels from; if None, then the minute data.
+
+        Returns:
+            Panel -- The updated panel.
+        """
+
+        fields = fields or self.panel_fields
+        assert fields, 'No panel fields were given.'
+        freq = '1min' if resolution is None else Rollups.RESOLUTIONS[resolution]
+        panel = Panel(self.storage.data_dir, resolution, freq)
+        if self.retention_days is not None:
+            start = dt.datetime.now() - dt.timedelta(days=self.retention_days)
+            n_dropped = panel.drop_before(start)
+            if n_dropped > 0:
+                self.log('DROPPED {} TIMES BEFORE {} FROM {} PANEL.'.format(n_dropped, start, resolution or '1m'))
+        n_new = panel.update(self.__series_storage(resolution), self.__get_symbols(), list(fields))
+        self.log('EXTENDED {} PANEL BY {} TIMES.'.format(resolution or '1m', n_new), flush=True)
+        return panel
+
+    def update(self) -> Dict[str, SymbolResult]:
         """See 'update_async' for details.
         """
-        asyncio.run(self.update_async())
+        return asyncio.run(self.update_async())
+
+    async def run_daemon_async(self, run_seconds: float = None):
+        """
+        Summary:
+            + Stay resident, so that the interpreter, HTTP pools, decoding processes, and manifest are
+                loaded once instead of on every run
+            + Keep a RefreshSchedule of the universe: each symbol is due refresh_seconds after its last
+                refresh (as recorded in the manifest), most overdue first; symbols whose refreshes bring no
+                new rows or fail back off
+            + Re-read the symbol file whenever it changes, adding and dropping symbols from the schedule
+            + Whenever symbols are due, update them as one batch, like update_async does for the whole universe
+                (journal, gap filling, and panels included), and reschedule them
+            + Log a run summary every DAEMON_SUMMARY_SECONDS
+
+        Keyword Arguments:
+            run_seconds {float} -- Stop after this many seconds (once the batch in progress is done); if None,
+                                    then run until cancelled. (default: {None})
+        """
+
+        self.log('STARTED DAEMON.', flush=True)
+        self.metrics.reset()
+        with self.metrics.stage('load_manifest'):
+            self.manifest.load()
+        with self.metrics.stage('recover'):
+            self.recover() # symbols that an interrupted run completed are simply not due yet
+
+        schedule = RefreshSchedule(self.refresh_seconds)
+        limiter = RateLimiter(self.req_per_sec)
+        stop_at = None if run_seconds is None else time.time() + run_seconds
+        symbols_mtime = None
+        n_batches = 0
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor, contextlib.ExitStack() as stack:
+                decoders = stack.enter_context(ProcessPoolExecutor(max_workers=self.decode_workers)) if self.decode_workers > 0 else None
+
+                while stop_at is None or time.time() < stop_at:
+                    mtime = os.path.getmtime(self.__symb_file_path)
+                    if mtime != symbols_mtime:
+                        symbols_mtime = mtime
+                        refreshed = {symbol: entry.updated.timestamp() for symbol, entry in self.manifest.entries().items() if entry.status != 'ERROR'}
+                        schedule.sync(self.__shard_order(self.__get_symbols(), steal=False), refreshed) # a sharded daemon keeps to its own shard
+                        self.log('SCHEDULED {} SYMBOLS EVERY {:g} SECONDS.'.format(len(schedule), self.refresh_seconds), flush=True)
+
+                    symbols = schedule.pop_due()
+                    if len(symbols) == 0:
+                        next_due = schedule.next_due()
+                        wait = self.DAEMON_POLL_SECONDS if next_due is None else min(self.DAEMON_POLL_SECONDS, next_due - time.time())
+                        if stop_at is not None:
+                            wait = min(wait, stop_at - time.time())
+                        await asyncio.sleep(max(0., wait))
+                        continue
+
+                    self.journal.start()
+                    self.__run_start = time.time()
+                    results = await self.__update_symbols(symbols, limiter, executor, decoders)
+                    await self.__finish_batch(symbols, results, limiter, executor)
+                    self.journal.finish()
+
+                    for symbol, result in results.items():
+                        schedule.reschedule(symbol, result.rows, failed=result.status == 'ERROR')
+                    n_failed = sum(result.status == 'ERROR' for result in results.values())
+                    self.log('REFRESHED {} SYMBOLS: {} ROWS, {} FAILED.'.format(len(results), sum(result.rows for result in results.values()), n_failed), flush=True)
+
+                    n_batches += 1
+                    if time.time() - self.metrics.run_start >= self.DAEMON_SUMMARY_SECONDS:
+                        self.__log_clients()
+                        self.log('RUN SUMMARY: {}'.format(json.dumps(self.metrics.finish())), flush=True)
+                        self.metrics.reset()
+        finally:
+            for client in self.http_clients():
+                await client.aclose()
+
+        self.__log_clients()
+        self.log('RUN SUMMARY: {}'.format(json.dumps(self.metrics.finish())))
+        self.log('STOPPED DAEMON AFTER {} BATCHES.'.format(n_batches), flush=True)
         return
 
+    def run_daemon(self, run_seconds: float = None):
+        """See 'run_daemon_async' for details.
+        """
+        return asyncio.run(self.run_daemon_async(run_seconds))
+
+    async def subscribe(self, symbols: List[str] = None, buffer_size: int = 100, policy: str = 'drop',
+                            replay_from: dt.datetime = None) -> AsyncIterator[BarBatch]:
+        """
+        Receive each batch of bars as soon as an update (or the daemon) in this process has stored it,
+        e.g. `async for batch in db.subscribe(['BTC']): ...` alongside `await db.update_async()`.
+        The batches of a symbol arrive in the order in which they were stored.
+
+        Keyword Arguments:
+            symbols {List[str]} -- Symbols to receive bars of; if None, then every symbol. (default: {None})
+            buffer_size {int} -- Most batches buffered while the subscriber is busy. (default: {100})
+            policy {str} -- When the buffer is full, either 'drop' the oldest batch or 'block' the update
+                            until the subscriber catches up; see db/subscriptions.py. (default: {'drop'})
+            replay_from {dt.datetime} -- If given, then first yield the stored bars from this datetime on, as one
+                                        'REPLAY' batch per symbol (of the universe, if symbols is None). (default: {None})
+
+        Yields:
+            BarBatch -- Symbol, how the bars were stored, and the bars.
+        """
+
+        loop = asyncio.get_running_loop()
+        subscription = Subscription(symbols, buffer_size, policy, loop)
+        self.publisher.add(subscription) # before replaying, so that nothing stored in the meantime is missed
+        try:
+            replayed = {} # symbol: last replayed datetime; later batches of bars up to it are already covered
+            if replay_from is not None:
+                for symbol in symbols or self.__get_symbols():
+                    if not self.storage.exists(symbol):
+                        continue
+                    data = await loop.run_in_executor(None, self.storage.read_range, symbol, replay_from)
+                    if len(data) > 0:
+                        replayed[symbol] = data.index[-1]
+                        yield BarBatch(symbol, 'REPLAY', data)
+
+            while True:
+                batch = await subscription.queue.get()
+                if batch.symbol in replayed and batch.status != 'FILLED':
+                    batch = batch._replace(data=batch.data[batch.data.index > replayed[batch.symbol]])
+                    if len(batch.data) == 0:
+                        continue
+                yield batch
+        finally:
+            self.publisher.remove(subscription)
+
     @abstractmethod
     def get_data(self, symbol: str, start: dt.datetime, end: dt.datetime, new_data: bool) -> pd.DataFrame:
         """This function will perform some action to get data. This function must return
@@ -177,11 +1131,51 @@ class DB_Base(ABC):
         
         pass
 
+    def find_gaps(self, symbol: str) -> List[Tuple[dt.datetime, dt.datetime]]:
+        """Find ranges of rows that are missing inside the symbol's stored data and that the API can
+        still serve. By default there are none; subclasses should override this when they know which
+        datetimes to expect.
+
+        Returns:
+            List[Tuple[dt.datetime, dt.datetime]] -- (start, end) of each gap, as passed to get_data.
+        """
+        return []
+
+    async def fetch_raw(self, symbol: str, start: dt.datetime, end: dt.datetime, new_data: bool) -> Tuple[Any, tuple]:
+        """Network half of get_data, for pipelined updates: make the API call(s) without decoding the response.
+        See 'get_data' for the arguments.
+
+        Returns:
+            Tuple[Any, tuple] -- Raw (picklable) payload, and the extra arguments that decode_raw needs to decode it.
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def decode_raw(payload: Any, *args) -> pd.DataFrame:
+        """CPU half of get_data, for pipelined updates: decode a payload from fetch_raw into the DataFrame
+        that get_data would return. Runs in a worker process, so it must not rely on any instance state.
+        """
+        raise NotImplementedError
+
 
 def parse_args(symbol_file_path, data_file_path_default, log_file_path_default):
     S = 'symbol_file_path'
     D = 'data_file_path'
     L = 'log_file_path'
+    W = 'max_workers'
+    F = 'storage'
+    R = 'rollups'
+    P = 'panel_fields'
+    M = 'metrics_file_path'
+    J = 'decode_workers'
+    G = 'fill_gaps'
+    C = 'cache_dir'
+    E = 'refresh_seconds'
+    X = 'features'
+    K = 'shard'
+    T = 'steal_work'
+    N = 'retention_days'
+    O = 'overlap_minutes'
 
     default_args = {S:symbol_file_path, D:data_file_path_default, L:log_file_path_default}
 
@@ -199,7 +1193,7 @@ def parse_args(symbol_file_path, data_file_path_default, log_file_path_default):
         pairs = [[args[i], args[i+1]] for i in range(0, len(args), 2)]
         assert (False not in ['-' == pair[0][0] for pair in pairs]), 'There must either be 0 keyword args, or all args must be keyword args.'
 
-        kw_dict = {'-s': S, '-d': D, '-l': L}
+        kw_dict = {'-s': S, '-d': D, '-l': L, '-w': W, '-f': F, '-r': R, '-p': P, '-m': M, '-j': J, '-g': G, '-c': C, '-e': E, '-x': X, '-k': K, '-t': T, '-n': N, '-o': O}
 
         for pair in pairs:
             assert (pair[0] in kw_dict.keys()), 'Keyword "{}" is not valid.'.format(pair[0])
@@ -207,6 +1201,23 @@ def parse_args(symbol_file_path, data_file_path_default, log_file_path_default):
         for pair in pairs:
             default_args[kw_dict[pair[0]]] = pair[1]
 
+        if W in default_args:
+            default_args[W] = int(default_args[W])
+        if J in default_args:
+            default_args[J] = int(default_args[J])
+        if E in default_args:
+            default_args[E] = float(default_args[E])
+        if N in default_args:
+            default_args[N] = float(default_args[N])
+        if O in default_args:
+            default_args[O] = float(default_args[O])
+        if R in default_args:
+            default_args[R] = default_args[R].split(',')
+        if P in default_args:
+            default_args[P] = default_args[P].split(',')
+        if X in default_args:
+            default_args[X] = default_args[X].split(',')
+
         return default_args
 
     
\ No newline at end of file
@@ -0,0 +1,251 @@
+"""
+Derived series (log returns, rolling VWAP, rolling volatility, ...) that are kept up
+to date alongside the minute data, so that consumers don't have to recompute them over
+the full history.
+
+Each feature is stored with the same storage format as the minute data, in its own
+folder under <data dir>/_features/, as a single column named after the feature. Next
+to each symbol's series is a small state file with the last rows of input that the
+feature's window reaches back over:
+
+    _features/<feature>/<symbol>.csv (or .col)        -- one value per minute bar
+    _features/<feature>/<symbol>.state.json           -- datetime of the last bar, and the inputs of the last `lookback` bars
+
+An update computes the values of only the new bars, from the state and the new rows.
+A feature that has no series yet for a symbol (e.g. because it was just added) is
+backfilled over the symbol's whole history in one vectorized pass.
+"""
+
+import datetime as dt
+import json
+import os
+from typing import Callable, Dict, List, Optional
+import numpy as np
+import pandas as pd
+from rollups import Rollups
+
+
+class Feature:
+
+    def __init__(self, lookback: int, compute: Callable):
+        """
+        Arguments:
+            lookback {int} -- Number of bars before the first new bar that its value depends on.
+            compute {Callable} -- compute(inputs) -> np.ndarray; vectorized over the rows of a DataFrame of
+                                    inputs (see Features.inputs), returning one value per row. The first
+                                    `lookback` rows only serve as history.
+        """
+
+        assert lookback >= 0, 'Lookback must not be negative.'
+        self.lookback = lookback
+        self.compute = compute
+        return
+
+
+def log_return() -> Feature:
+    return Feature(1, lambda inputs: np.log(inputs['close']).diff().values)
+
+
+def rolling_vwap(n_bars: int) -> Feature:
+    """Volume-weighted average price over the last n_bars bars (fewer at the start of the history).
+    """
+
+    def compute(inputs):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (inputs['price_volume'].rolling(n_bars, min_periods=1).sum() / inputs['volume'].rolling(n_bars, min_periods=1).sum()).values
+    return Feature(n_bars - 1, compute)
+
+
+def rolling_volatility(n_bars: int) -> Feature:
+    """Standard deviation of the log returns of the last n_bars bars (of at least 2 of them, at the start of the history).
+    """
+    return Feature(n_bars, lambda inputs: np.log(inputs['close']).diff().rolling(n_bars, min_periods=2).std().values)
+
+
+class Features:
+    FOLDER_NAME = '_features'
+    REGISTRY = { # feature name: Feature; see 'register' for adding more
+        'log_return': log_return(),
+        'vwap_30': rolling_vwap(30),
+        'vwap_390': rolling_vwap(390), # a regular trading day of minute bars
+        'volatility_30': rolling_volatility(30),
+        'volatility_390': rolling_volatility(390),
+    }
+    INPUT_COLUMNS = ['close', 'volume', 'price_volume']
+
+    def __init__(self, storage, names: List[str]):
+        """
+        Arguments:
+            storage {Storage} -- Storage that holds the minute data.
+            names {List[str]} -- Names of the features to maintain; see REGISTRY.
+        """
+
+        for name in names:
+            assert name in Features.REGISTRY, 'Feature "{}" is not valid.'.format(name)
+
+        self.storage = storage
+        self.names = list(names)
+        self.__series = {} # name: storage of that feature's values
+        for name in self.names:
+            folder = os.path.join(storage.data_dir, Features.FOLDER_NAME, name)
+            os.makedirs(folder, exist_ok=True)
+            self.__series[name] = type(storage)(folder)
+        return
+
+    @staticmethod
+    def register(name: str, feature: Feature):
+        """Make a feature available under the given name, e.g. register('vwap_60', rolling_vwap(60)).
+        """
+        Features.REGISTRY[name] = feature
+        return
+
+    def series(self, name: str):
+        """Storage of the given feature's values.
+        """
+        assert name in self.__series, 'Feature "{}" is not maintained.'.format(name)
+        return self.__series[name]
+
+    @staticmethod
+    def inputs(data: pd.DataFrame) -> pd.DataFrame:
+        """Columns that features are computed from: close, volume, and price*volume (as in the rollups' VWAP).
+        """
+
+        weight_column, price_volume = Rollups.weights(data)
+        if weight_column is None: # no volume to weigh by
+            volume, price_volume = pd.Series(np.nan, index=data.index), pd.Series(np.nan, index=data.index)
+        else:
+            volume = data[weight_column]
+        return pd.DataFrame({'close': data['close'], 'volume': volume, 'price_volume': price_volume}, index=data.index).astype(np.float64)
+
+    def __state_path(self, name: str, symbol: str) -> str:
+        return os.path.join(self.__series[name].data_dir, '{}.state.json'.format(symbol))
+
+    def __load_state(self, name: str, symbol: str) -> Optional[Dict]:
+        try:
+            with open(self.__state_path(name, symbol), 'r') as f:
+                state = json.load(f)
+            return {'last': dt.datetime.fromisoformat(state['last']), 'tail': pd.DataFrame(state['tail'], columns=Features.INPUT_COLUMNS, dtype=np.float64)}
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def __save_state(self, name: str, symbol: str, inputs: pd.DataFrame):
+        lookback = Features.REGISTRY[name].lookback
+        tail = inputs.iloc[len(inputs) - lookback:] if lookback > 0 else inputs.iloc[:0]
+        state = {'last': inputs.index[-1].isoformat(), 'tail': {column: tail[column].tolist() for column in Features.INPUT_COLUMNS}}
+
+        file_path = self.__state_path(name, symbol)
+        with open(file_path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(file_path + '.tmp', file_path) # the state always matches a complete series
+        return
+
+    def __backfill(self, name: str, symbol: str) -> int:
+        """Compute the feature over the symbol's whole history, replacing whatever was stored.
+        """
+
+        inputs = Features.inputs(self.storage.read(symbol))
+        values = pd.DataFrame({name: Features.REGISTRY[name].compute(inputs)}, index=inputs.index)
+        self.__series[name].write(symbol, values)
+        if len(inputs) > 0:
+            self.__save_state(name, symbol, inputs)
+        return len(values)
+
+    def update(self, symbol: str, new_data: pd.DataFrame) -> Dict[str, int]:
+        """
+        Compute every feature for rows that were just appended to the symbol's minute data, from
+        the state and the new rows only. Features without a series (or state) for the symbol yet
+        are backfilled over its whole history instead.
+
+        Arguments:
+            symbol {str}
+            new_data {pd.DataFrame} -- Rows that were just appended (already stored).
+
+        Returns:
+            Dict[str, int] -- Number of values written for each feature.
+        """
+
+        written = {}
+        new_inputs = Features.inputs(new_data)
+        for name in self.names:
+            series = self.__series[name]
+            state = self.__load_state(name, symbol) if series.exists(symbol) else None
+
+            if state is None or (len(new_data) > 0 and new_data.index[0] <= state['last']):
+                written[name] = self.__backfill(name, symbol)
+                continue
+
+            if len(new_data) == 0:
+                written[name] = 0
+                continue
+
+            tail = state['tail']
+            inputs = pd.concat([tail.set_axis(pd.DatetimeIndex([state['last']]*len(tail)), axis=0), new_inputs])
+            values = Features.REGISTRY[name].compute(inputs)[len(tail):]
+            series.append(symbol, pd.DataFrame({name: values}, index=new_inputs.index))
+            self.__save_state(name, symbol, inputs)
+            written[name] = len(values)
+
+        return written
+
+    def __history(self, symbol: str, start: dt.datetime, lookback: int):
+        """
+        Inputs of the rows from start on, preceded by (up to) `lookback` rows of history; the window read
+        before start is widened until it holds that many rows, or reaches the start of the data.
+
+        Returns:
+            Tuple[pd.DataFrame, int] -- Inputs, and the number of history rows at their start.
+        """
+
+        first = self.storage.first_dtime(symbol)
+        window = dt.timedelta(minutes=max(lookback, 1))
+        while True:
+            inputs = Features.inputs(self.storage.read_range(symbol, start - window))
+            n_before = int((inputs.index < start).sum())
+            if n_before >= lookback or first is None or first >= start - window:
+                n_history = min(n_before, lookback)
+                return inputs.iloc[n_before - n_history:], n_history
+            window *= 4
+
+    def rebuild_from(self, symbol: str, start: dt.datetime) -> Dict[str, int]:
+        """
+        Recompute every feature from start onwards, after the symbol's minute data was changed from start on
+        (e.g. when revised bars were merged in); only the rows that the features' windows reach back over are read.
+
+        Returns:
+            Dict[str, int] -- Number of values written for each feature.
+        """
+
+        written = {}
+        for name in self.names:
+            series = self.__series[name]
+            if not series.exists(symbol) or self.__load_state(name, symbol) is None:
+                written[name] = self.__backfill(name, symbol)
+                continue
+
+            inputs, n_history = self.__history(symbol, start, Features.REGISTRY[name].lookback)
+            values = Features.REGISTRY[name].compute(inputs)[n_history:]
+            series.truncate_from(symbol, start)
+            series.append(symbol, pd.DataFrame({name: values}, index=inputs.index[n_history:]))
+            if len(inputs) > 0:
+                self.__save_state(name, symbol, inputs)
+            written[name] = len(values)
+
+        return written
+
+    def rebuild(self, symbol: str) -> Dict[str, int]:
+        """
+        Recompute every feature over the symbol's whole history, after rows were changed inside it
+        (e.g. a gap was filled in, which shifts every rolling window after it), or drop the features
+        if the symbol no longer has any data.
+
+        Returns:
+            Dict[str, int] -- Number of values written for each feature.
+        """
+
+        if not self.storage.exists(symbol):
+            for name in self.names:
+                self.__series[name].remove(symbol)
+                if os.path.exists(self.__state_path(name, symbol)):
+                    os.remove(self.__state_path(name, symbol))
+            return {}
+        return {name: self.__backfill(name, symbol) for name in self.names}
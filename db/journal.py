@@ -0,0 +1,142 @@
+"""
+Journal of the update run in progress, so that a run that dies halfway (OOM,
+network outage, cron timeout) can be picked up where it stopped.
+
+The journal is a JSON-lines file in the data folder that is only ever appended to,
+and is synced to disk after every line:
+
+    {"event": "start", "time": <epoch seconds>}                    -- when the run (or the run it resumes) started
+    {"event": "pending", "symbol": "AAPL", "from": <iso or null>}   -- rows from this datetime on are about to be (re)written
+    {"event": "done", "symbol": "AAPL"}                             -- the symbol's write, manifest and rollups are complete
+
+Every write to a symbol's data is bracketed by a pending and a done line. A pending
+line without a done line after it marks a write that may have been cut short; the
+rows it covers are dropped again before the next run starts. The journal is removed
+once a run finishes, so a journal left on disk always belongs to an unfinished run.
+"""
+
+import datetime as dt
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, NamedTuple, Optional, Set
+
+
+class JournalState(NamedTuple):
+    started: Optional[float] # epoch seconds at which the unfinished run started, or None if there is no journal
+    completed: Set[str] # symbols whose update was completed
+    pending: Dict[str, Optional[dt.datetime]] # symbol: datetime from which its unfinished write may have changed rows (None if the write created the symbol)
+
+
+class RunJournal:
+    FILE_NAME = '_journal.jsonl'
+
+    def __init__(self, data_dir: str, name: str = None):
+        """
+        Arguments:
+            data_dir {str} -- Path to the folder in which data files are stored; the journal is kept there.
+
+        Keyword Arguments:
+            name {str} -- Name of the worker that the journal belongs to, if several workers share the
+                            data folder (e.g. '0of4'); each one keeps its own journal. (default: {None})
+        """
+
+        file_name = RunJournal.FILE_NAME if name is None else '_journal.{}.jsonl'.format(name)
+        self.file_path = os.path.join(data_dir, file_name)
+        self.__file = None # open while a run is in progress
+        self.__pending = set() # symbols with a write in progress
+        self.__lock = threading.Lock() # writers journal from several threads
+        return
+
+    def load(self) -> JournalState:
+        """Read the journal that an unfinished run left behind. A line that was cut short by the crash is ignored.
+        """
+
+        state = JournalState(None, set(), {})
+        try:
+            with open(self.file_path, 'r') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return state
+
+        for line in lines:
+            try:
+                event = json.loads(line)
+                if event['event'] == 'start':
+                    state = state._replace(started=event['time'])
+                elif event['event'] == 'pending':
+                    state.pending[event['symbol']] = None if event['from'] is None else dt.datetime.fromisoformat(event['from'])
+                elif event['event'] == 'done':
+                    state.pending.pop(event['symbol'], None)
+                    state.completed.add(event['symbol'])
+            except (ValueError, KeyError, TypeError):
+                continue
+        return state
+
+    def __write(self, event: Dict):
+        self.__file.write(json.dumps(event) + '\n')
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+        return
+
+    def start(self, started: float = None, completed: Iterable[str] = ()):
+        """Start a new journal, replacing the old one in a single rename.
+
+        Keyword Arguments:
+            started {float} -- Start time (epoch seconds) to record; if None, then now. A resumed run keeps
+                                the start time of the run that it resumes. (default: {None})
+            completed {Iterable[str]} -- Symbols that are already complete, carried over from the run that is resumed. (default: {()})
+        """
+
+        tmp_path = self.file_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps({'event': 'start', 'time': time.time() if started is None else started}) + '\n')
+            for symbol in completed:
+                f.write(json.dumps({'event': 'done', 'symbol': symbol}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.file_path)
+
+        with self.__lock:
+            self.__file = open(self.file_path, 'a')
+            self.__pending = set()
+        return
+
+    @property
+    def active(self) -> bool:
+        """Whether a run is in progress, i.e. the journal was started and not finished yet.
+        """
+        return self.__file is not None
+
+    def pending(self, symbol: str, start: Optional[dt.datetime]):
+        """Record that the symbol's rows from start on are about to be written (start is None if the write creates the symbol).
+        """
+
+        with self.__lock:
+            self.__write({'event': 'pending', 'symbol': symbol, 'from': None if start is None else start.isoformat()})
+            self.__pending.add(symbol)
+        return
+
+    def done(self, symbol: str):
+        with self.__lock:
+            self.__write({'event': 'done', 'symbol': symbol})
+            self.__pending.discard(symbol)
+        return
+
+    def finish(self, keep: bool = False):
+        """Close the journal, and remove it unless a write was left unfinished (e.g. one whose rollback failed),
+        so that the next run still recovers it.
+
+        Keyword Arguments:
+            keep {bool} -- Keep the journal anyway, e.g. because it carries an interrupted run that is still to be resumed. (default: {False})
+        """
+
+        with self.__lock:
+            if self.__file is None:
+                return
+            self.__file.close()
+            self.__file = None
+            if len(self.__pending) == 0 and not keep:
+                os.remove(self.file_path)
+        return
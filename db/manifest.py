@@ -0,0 +1,260 @@
+"""
+Manifest of per-symbol watermarks, so that an update run can plan its work
+from a single file instead of opening every symbol's data.
+
+The manifest is a snapshot, plus a log of the entries recorded since it was taken:
+
+    _manifest.json      -- {"generation": <n>, "symbols": {<symbol>: <entry>, ...}}
+    _manifest.log       -- JSON lines: {"generation": <n>}, then one {"symbol": ..., "entry": ...} per record
+
+Recording an entry appends one line to the log, instead of rewriting every entry. Once
+the log holds more records than there are symbols, it is folded into a new snapshot (of
+the next generation) and started over, so that each record costs O(1) on average.
+A log whose generation doesn't match the snapshot's was already folded into it.
+Records aren't synced to disk one by one: an entry that a crash lost no longer
+matches the symbol's data, and the next update scans the data for its watermark.
+
+A manifest can be shared by several processes (e.g. the workers of a sharded
+update): each change is then appended under an exclusive lock on a lock file next
+to it, after catching up with the lines that other processes appended meanwhile.
+"""
+
+import contextlib
+import datetime as dt
+import fcntl
+import json
+import os
+import threading
+from typing import Dict, NamedTuple, Optional
+
+
+class ManifestEntry(NamedTuple):
+    last_dtime: Optional[dt.datetime] # datetime of the symbol's last row, or None if it has no rows
+    rows: int # number of rows stored
+    bytes: int # size of the symbol's data, as reported by Storage.size
+    status: str # status of the last update; one of 'CREATED', 'APPENDED', 'REVISED', 'FILLED', or 'ERROR'
+    updated: dt.datetime # when the entry was last written
+
+
+class Manifest:
+    FILE_NAME = '_manifest.json'
+    LOG_FILE_NAME = '_manifest.log'
+    COMPACT_MIN_RECORDS = 64 # records in the log before it is folded into the snapshot, however few symbols there are
+
+    def __init__(self, data_dir: str, shared: bool = False):
+        """
+        Arguments:
+            data_dir {str} -- Path to the folder in which data files are stored; the manifest is kept there.
+
+        Keyword Arguments:
+            shared {bool} -- Whether other processes update the manifest at the same time. (default: {False})
+        """
+
+        self.file_path = os.path.join(data_dir, Manifest.FILE_NAME)
+        self.log_path = os.path.join(data_dir, Manifest.LOG_FILE_NAME)
+        self.shared = shared
+        self.__entries = {}
+        self.__generation = 0 # generation of the snapshot that the entries were read from
+        self.__offset = None # bytes of the log read (or written) so far; None until the manifest is read
+        self.__n_logged = 0 # records in the log
+        self.__log_current = False # whether the log on disk belongs to the snapshot that was read
+        self.__lock = threading.Lock() # workers record entries from several threads
+        return
+
+    @staticmethod
+    def __encode(entry: ManifestEntry) -> Dict:
+        return {
+            'last_dtime': None if entry.last_dtime is None else entry.last_dtime.isoformat(),
+            'rows': entry.rows,
+            'bytes': entry.bytes,
+            'status': entry.status,
+            'updated': entry.updated.isoformat(),
+        }
+
+    @staticmethod
+    def __decode(entry: Dict) -> ManifestEntry:
+        return ManifestEntry(
+            last_dtime=None if entry['last_dtime'] is None else dt.datetime.fromisoformat(entry['last_dtime']),
+            rows=entry['rows'],
+            bytes=entry['bytes'],
+            status=entry['status'],
+            updated=dt.datetime.fromisoformat(entry['updated']),
+        )
+
+    def __read(self):
+        """Read the snapshot, and replay the log on top of it.
+        """
+
+        try:
+            with open(self.file_path, 'r') as f:
+                snapshot = json.load(f)
+            entries = {symbol: Manifest.__decode(entry) for symbol, entry in snapshot['symbols'].items()}
+            generation = snapshot.get('generation', 0)
+        except (OSError, ValueError, KeyError, TypeError):
+            entries, generation = {}, 0
+        self.__entries, self.__generation, self.__offset, self.__n_logged = entries, generation, 0, 0
+        self.__replay()
+        return
+
+    def __replay(self) -> bool:
+        """Apply the lines that were appended to the log since it was last read; a line that is still being
+        appended (or that a crash cut short) is left for later.
+
+        Returns:
+            bool -- False if the log belongs to another generation than the snapshot that was read.
+        """
+
+        try:
+            with open(self.log_path, 'rb') as f:
+                header = f.readline()
+                try:
+                    self.__log_current = json.loads(header)['generation'] == self.__generation
+                except (ValueError, KeyError, TypeError):
+                    self.__log_current = False
+                if not self.__log_current:
+                    return False
+                f.seek(max(self.__offset, len(header)))
+                tail = f.read()
+        except FileNotFoundError:
+            self.__log_current = False
+            return True
+
+        self.__offset = max(self.__offset, len(header))
+        end = tail.rfind(b'\n') + 1
+        for line in tail[:end].splitlines():
+            try:
+                record = json.loads(line)
+                self.__entries[record['symbol']] = Manifest.__decode(record['entry'])
+                self.__n_logged += 1
+            except (ValueError, KeyError, TypeError): # cut short by a crash
+                continue
+        self.__offset += end
+        return True
+
+    def __catch_up(self):
+        if self.__offset is None or not self.__replay(): # not read yet, or another process folded the log into a new snapshot
+            self.__read()
+        return
+
+    def load(self):
+        """Read the whole manifest in one go; a missing or unreadable manifest is treated as empty.
+        """
+
+        with self.__lock:
+            self.__read()
+        return
+
+    def refresh(self) -> bool:
+        """Pick up the entries that other processes recorded since the manifest was last read; only the new lines of the log are read.
+
+        Returns:
+            bool -- Whether there were any.
+        """
+
+        with self.__lock:
+            before = (self.__generation, self.__offset)
+            self.__catch_up()
+            return (self.__generation, self.__offset) != before
+
+    def get(self, symbol: str) -> Optional[ManifestEntry]:
+        if self.shared:
+            with self.__lock:
+                self.__catch_up() # another process may have recorded an entry
+        return self.__entries.get(symbol)
+
+    def entries(self) -> Dict[str, ManifestEntry]:
+        return dict(self.__entries)
+
+    @contextlib.contextmanager
+    def __exclusive(self):
+        """Hold the thread lock, and (if the manifest is shared) the lock file, with the latest entries loaded.
+        """
+
+        with self.__lock:
+            if not self.shared:
+                if self.__offset is None:
+                    self.__read()
+                yield
+                return
+            with open(self.file_path + '.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self.__catch_up()
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return
+
+    def __write_atomic(self, file_path: str, content: bytes, sync: bool):
+        """Write to a temporary file and rename it over the old one, so readers never see a partial file.
+        """
+
+        tmp_path = '{}.tmp.{}.{}'.format(file_path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+        return
+
+    def __start_log(self):
+        header = (json.dumps({'generation': self.__generation}) + '\n').encode()
+        self.__write_atomic(self.log_path, header, sync=False)
+        self.__offset, self.__n_logged, self.__log_current = len(header), 0, True
+        return
+
+    def __compact(self):
+        """Fold the log into a snapshot of the next generation, and start a new log.
+        """
+
+        snapshot = {'generation': self.__generation + 1, 'symbols': {symbol: Manifest.__encode(entry) for symbol, entry in self.__entries.items()}}
+        self.__write_atomic(self.file_path, json.dumps(snapshot).encode(), sync=True) # the old log is ignored from here on
+        self.__generation += 1
+        self.__start_log()
+        return
+
+    def __append(self, symbol: str, entry: ManifestEntry):
+        self.__entries[symbol] = entry
+        if not self.__log_current: # no log yet, or one that a crash left behind after it was folded into the snapshot
+            self.__start_log()
+
+        line = (json.dumps({'symbol': symbol, 'entry': Manifest.__encode(entry)}) + '\n').encode()
+        with open(self.log_path, 'ab') as f:
+            if f.tell() != self.__offset: # terminate a line that a crash cut short, rather than append to it
+                line = b'\n' + line
+            f.write(line)
+            self.__offset = f.tell()
+        self.__n_logged += 1
+
+        if self.__n_logged > max(Manifest.COMPACT_MIN_RECORDS, len(self.__entries)):
+            self.__compact()
+        return
+
+    def record(self, symbol: str, last_dtime: Optional[dt.datetime], rows: int, n_bytes: int, status: str):
+        with self.__exclusive():
+            self.__append(symbol, ManifestEntry(last_dtime, rows, n_bytes, status, dt.datetime.now()))
+        return
+
+    def record_layout(self, symbol: str, rows: int, n_bytes: int):
+        """Record a change to how the symbol's data is stored (compaction, or old rows being dropped) that leaves its last row,
+        and the status of its last update, as they were.
+        """
+
+        with self.__exclusive():
+            entry = self.__entries.get(symbol)
+            if entry is None:
+                return
+            self.__append(symbol, entry._replace(rows=rows, bytes=n_bytes))
+        return
+
+    def record_status(self, symbol: str, status: str):
+        """Record the status of an update that didn't change the symbol's data.
+        """
+
+        with self.__exclusive():
+            entry = self.__entries.get(symbol)
+            if entry is None:
+                return
+            self.__append(symbol, entry._replace(status=status, updated=dt.datetime.now()))
+        return
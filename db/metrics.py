@@ -0,0 +1,268 @@
+"""
+Structured metrics for update runs: per-symbol timings of each stage, counters,
+a buffered JSON-lines event log, an end-of-run summary with percentiles, and
+optional cProfile hooks around the hot paths.
+
+The symbol that is being worked on is kept in a context variable, so it follows the
+work into coroutines (each asyncio task has its own context) and into worker threads
+that are handed the context (e.g. with contextvars.copy_context().run), and everything
+they record is attributed to it.
+"""
+
+import contextlib
+import contextvars
+import cProfile
+import datetime as dt
+import json
+import os
+import pstats
+import threading
+import time
+from typing import Dict, List
+import numpy as np
+
+
+class _SymbolScope:
+    """The symbol that a piece of work is for, and the time spent on its HTTP requests so far; shared by
+    every thread and task that works on the symbol.
+    """
+
+    def __init__(self, symbol: str):
+        self.symbol = symbol
+        self.__lock = threading.Lock()
+        self.__http_seconds = 0.
+        self.__in_flight = 0
+        self.__busy_since = None
+        return
+
+    def request_started(self):
+        with self.__lock:
+            if self.__in_flight == 0:
+                self.__busy_since = time.perf_counter()
+            self.__in_flight += 1
+        return
+
+    def request_finished(self):
+        with self.__lock:
+            self.__in_flight -= 1
+            if self.__in_flight == 0:
+                self.__http_seconds += time.perf_counter() - self.__busy_since
+        return
+
+    @property
+    def http_seconds(self) -> float:
+        """Wall-clock seconds during which at least one request was in flight; requests made in parallel
+        (e.g. for the pages of a range) overlap, so their durations aren't simply added up.
+        """
+
+        with self.__lock:
+            busy = time.perf_counter() - self.__busy_since if self.__in_flight > 0 else 0.
+            return self.__http_seconds + busy
+
+
+class RunMetrics:
+    PROFILE_TARGETS = ('get_data', 'http', 'write') # sections that can be profiled
+
+    def __init__(self, file_path: str = None, buffer_size: int = 1000, profile: List[str] = None):
+        """
+        Arguments:
+            file_path {str} -- JSON-lines file that events are appended to; if None, then events are discarded
+                                and only the summary is kept.
+            buffer_size {int} -- Number of events buffered before they are written out.
+            profile {List[str]} -- Sections (see PROFILE_TARGETS) to run under cProfile; the stats are
+                                    written next to file_path (or to the working directory) at the end of the run.
+        """
+
+        for target in profile or []:
+            assert target in RunMetrics.PROFILE_TARGETS, 'Profile target "{}" is not valid.'.format(target)
+
+        self.file_path = file_path
+        self.buffer_size = buffer_size
+        self.profile_targets = set(profile or [])
+
+        self.__lock = threading.Lock()
+        self.__scope = contextvars.ContextVar('metrics_scope_{}'.format(id(self)), default=None) # _SymbolScope of the current context
+        self.reset()
+        return
+
+    def reset(self):
+        """Start a new run.
+        """
+
+        with self.__lock:
+            self.__buffer = []
+            self.__durations = {} # stage: list of seconds
+            self.__counters = {} # counter: total
+            self.__profiles = {} # profile target: pstats.Stats
+            self.run_start = time.time()
+        return
+
+    @contextlib.contextmanager
+    def symbol(self, symbol: str):
+        """Attribute everything recorded in the current context (and in the tasks and threads that it is copied to) to the given symbol.
+        """
+
+        token = self.__scope.set(_SymbolScope(symbol))
+        try:
+            yield
+        finally:
+            self.__scope.reset(token)
+        return
+
+    @property
+    def current_symbol(self):
+        scope = self.__scope.get()
+        return None if scope is None else scope.symbol
+
+    def __event(self, event: Dict):
+        event['ts'] = round(time.time(), 6)
+        flush = False
+        with self.__lock:
+            self.__buffer.append(event)
+            flush = len(self.__buffer) >= self.buffer_size
+        if flush:
+            self.flush()
+        return
+
+    def record(self, stage: str, seconds: float, symbol: str = None, **fields):
+        """Record how long a stage took for the given symbol (by default, the current context's symbol).
+        """
+
+        with self.__lock:
+            self.__durations.setdefault(stage, []).append(seconds)
+        self.__event(dict(symbol=symbol or self.current_symbol, stage=stage, seconds=round(seconds, 6), **fields))
+        return
+
+    def count(self, counter: str, n: float = 1, symbol: str = None, **fields):
+        """Add to a counter (rows, bytes, retries, ...) for the given symbol (by default, the current context's symbol).
+        """
+
+        with self.__lock:
+            self.__counters[counter] = self.__counters.get(counter, 0) + n
+        self.__event(dict(symbol=symbol or self.current_symbol, counter=counter, n=n, **fields))
+        return
+
+    @contextlib.contextmanager
+    def stage(self, stage: str, **fields):
+        """Time a block of code as a stage of the current symbol's update; profile it if it is a profile target.
+        A stage that raises is recorded all the same.
+        """
+
+        start = time.perf_counter()
+        try:
+            with self.__profiled(stage):
+                yield
+        finally:
+            self.record(stage, time.perf_counter() - start, **fields)
+        return
+
+    @contextlib.contextmanager
+    def http(self, url: str):
+        """
+        Instrument for HttpClient: times each request made in the current context and records its
+        status and response size, and counts retries and throttled (429) responses. Yields a
+        dict that the client fills in with 'status', 'bytes', and 'attempt'. A request that
+        raises (e.g. a connection error) is recorded all the same.
+        """
+
+        response = {}
+        scope = self.__scope.get()
+        if scope is not None:
+            scope.request_started()
+        start = time.perf_counter()
+        try:
+            with self.__profiled('http'):
+                yield response
+        finally:
+            seconds = time.perf_counter() - start
+            if scope is not None:
+                scope.request_finished()
+            self.record('http', seconds, url=url.split('?')[0], **response)
+            self.count('response_bytes', response.get('bytes', 0))
+            if response.get('attempt', 0) > 0:
+                self.count('retries')
+            if response.get('status') == 429:
+                self.count('throttled')
+        return
+
+    @property
+    def http_seconds(self) -> float:
+        """Wall-clock seconds spent in the current symbol's HTTP requests since it was set (see 'symbol').
+        """
+
+        scope = self.__scope.get()
+        return 0. if scope is None else scope.http_seconds
+
+    @contextlib.contextmanager
+    def __profiled(self, target: str):
+        if target not in self.profile_targets:
+            yield
+            return
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError: # another profiler is already running on this interpreter
+            profiler = None
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                with self.__lock:
+                    if target in self.__profiles:
+                        self.__profiles[target].add(profiler)
+                    else:
+                        self.__profiles[target] = pstats.Stats(profiler)
+        return
+
+    def flush(self):
+        with self.__lock:
+            events, self.__buffer = self.__buffer, []
+        if self.file_path is not None and len(events) > 0:
+            with open(self.file_path, 'a') as f:
+                f.write(''.join(json.dumps(event) + '\n' for event in events))
+        return
+
+    def summary(self) -> Dict:
+        """
+        Returns:
+            Dict -- Run duration, counters, and for each stage the count, total seconds, and
+                    p50/p90/p99/max milliseconds.
+        """
+
+        with self.__lock:
+            durations = {stage: np.array(seconds) for stage, seconds in self.__durations.items()}
+            counters = dict(self.__counters)
+
+        stages = {}
+        for stage, seconds in durations.items():
+            p50, p90, p99 = np.percentile(seconds, [50, 90, 99])*1000
+            stages[stage] = {
+                'n': len(seconds),
+                'total_s': round(float(seconds.sum()), 3),
+                'p50_ms': round(float(p50), 2),
+                'p90_ms': round(float(p90), 2),
+                'p99_ms': round(float(p99), 2),
+                'max_ms': round(float(seconds.max())*1000, 2),
+            }
+        return {'run_seconds': round(time.time() - self.run_start, 3), 'counters': counters, 'stages': stages}
+
+    def finish(self) -> Dict:
+        """End the run: write out buffered events, the summary, and any profiles.
+
+        Returns:
+            Dict -- See 'summary'.
+        """
+
+        summary = self.summary()
+        self.__event({'summary': summary})
+        self.flush()
+
+        prefix = os.path.splitext(self.file_path)[0] if self.file_path else 'update'
+        stamp = dt.datetime.now().strftime('%Y%m%d-%H%M%S')
+        with self.__lock:
+            profiles, self.__profiles = self.__profiles, {}
+        for target, stats in profiles.items():
+            stats.dump_stats('{}.{}.{}.prof'.format(prefix, target, stamp))
+        return summary
@@ -0,0 +1,294 @@
+"""
+Streaming, parallel migration of a data folder to another storage format (e.g. the
+<symbol>.csv files of years of updates to partitioned storage), with verification.
+
+Each symbol is converted by a worker process, which streams the source in chunks of
+at most `chunk_rows` rows (see Storage.iter_chunks) into the destination, so that a
+worker's memory stays flat however large a file is. The destination is then streamed
+back and compared with the source:
+
+    + Row count, and first and last datetime
+    + Datetimes in strictly ascending order
+    + SHA-256 of the index (int64 nanoseconds) and of the values (float64, row by row, in
+        the source's column order), which doesn't depend on how the data was chunked
+
+Symbols that verify are recorded in <destination>/_migrate.json, along with the size and
+modification time of their source; a migration that is run again (e.g. after it was
+interrupted) skips them, unless their source changed since. Any other symbol is
+converted from scratch. The destination's manifest is written as symbols verify, so an
+update can pick up from the migrated data right away; rollups and features are not
+migrated, and are rebuilt by the next update that maintains them.
+
+    python db/migrate.py -d <source dir> -o <destination dir> [-f csv] [-t partitioned] [-w 4] [--chunk-rows 100000] [--verify-only]
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import datetime as dt
+import hashlib
+import json
+import os
+import resource
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional
+import numpy as np
+import pandas as pd
+db_path = Path(__file__).absolute().parent
+sys.path.insert(1, str(db_path)) # path to the entire project
+
+from storage import ColumnarStorage, Storage, STORAGE_FORMATS
+from manifest import Manifest
+
+CHUNK_ROWS = 100000 # rows read (and written) at a time by each worker
+
+
+class Digest(NamedTuple):
+    rows: int
+    first: Optional[int] # epoch ns of the first row, or None if there are no rows
+    last: Optional[int] # epoch ns of the last row
+    index_sha: str
+    values_sha: str
+    out_of_order: Optional[int] # position of the first row whose datetime isn't after the previous row's, if any
+
+
+class _Digester:
+    """Digest of a symbol's rows, fed one chunk at a time.
+    """
+
+    def __init__(self, columns: List[str]):
+        self.columns = columns
+        self.rows = 0
+        self.first = None
+        self.last = None
+        self.out_of_order = None
+        self.__index_sha = hashlib.sha256()
+        self.__values_sha = hashlib.sha256()
+        return
+
+    def add(self, data: pd.DataFrame):
+        if len(data) == 0:
+            return
+        index = ColumnarStorage.to_epoch_ns(data.index)
+        previous = index[:-1] if self.last is None else np.concatenate([[self.last], index[:-1]])
+        behind = index[len(index) - len(previous):] <= previous # each row against the one before it
+        if self.out_of_order is None and behind.any():
+            self.out_of_order = self.rows + len(index) - len(previous) + int(np.argmax(behind))
+
+        values = data[self.columns].to_numpy(dtype=np.float64, copy=True)
+        values[np.isnan(values)] = np.nan # one bit pattern for every NaN
+        self.__index_sha.update(np.ascontiguousarray(index, dtype='<i8').tobytes())
+        self.__values_sha.update(np.ascontiguousarray(values, dtype='<f8').tobytes())
+
+        self.first = int(index[0]) if self.first is None else self.first
+        self.last = int(index[-1])
+        self.rows += len(index)
+        return
+
+    def digest(self) -> Digest:
+        return Digest(self.rows, self.first, self.last, self.__index_sha.hexdigest(), self.__values_sha.hexdigest(), self.out_of_order)
+
+
+def digest(storage: Storage, symbol: str, columns: List[str], chunk_rows: int = CHUNK_ROWS) -> Digest:
+    """Stream the symbol's data and digest it (see Digest); columns gives the order in which values are hashed.
+    """
+
+    digester = _Digester(columns)
+    for data in storage.iter_chunks(symbol, chunk_rows):
+        digester.add(data)
+    return digester.digest()
+
+
+def _compare(source: Digest, destination: Digest) -> Optional[str]:
+    """What is wrong with the destination's digest, given the source's; None if they match.
+    """
+
+    if source.out_of_order is not None:
+        return 'source is out of order at row {}'.format(source.out_of_order)
+    if destination.out_of_order is not None:
+        return 'destination is out of order at row {}'.format(destination.out_of_order)
+    for field in Digest._fields:
+        if getattr(source, field) != getattr(destination, field):
+            return '{} differs: {} in the source, {} in the destination'.format(field, getattr(source, field), getattr(destination, field))
+    return None
+
+
+def _peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024 # kilobytes on Linux
+
+
+def migrate_symbol(source_format: type, source_dir: str, destination_format: type, destination_dir: str, symbol: str,
+                    chunk_rows: int = CHUNK_ROWS, verify_only: bool = False) -> Dict:
+    """
+    Convert a symbol's data from one storage to another in chunks, and verify the result. Runs in a worker process.
+
+    Arguments:
+        source_format {type} -- Storage class of the source (see STORAGE_FORMATS).
+        source_dir {str} -- Folder of the source.
+        destination_format {type} -- Storage class of the destination.
+        destination_dir {str} -- Folder of the destination.
+        symbol {str}
+
+    Keyword Arguments:
+        chunk_rows {int} -- Most rows held in memory at a time. (default: {CHUNK_ROWS})
+        verify_only {bool} -- Only compare the existing destination with the source. (default: {False})
+
+    Returns:
+        Dict -- 'symbol'; 'status' ('MIGRATED', 'VERIFIED', or 'FAILED'); 'error'; the source's 'digest';
+                'last_dtime' (iso); and 'seconds' and 'peak_rss_mb' of the worker.
+    """
+
+    start = time.perf_counter()
+    source, destination = source_format(source_dir), destination_format(destination_dir)
+    result = {'symbol': symbol, 'status': 'FAILED', 'error': None, 'digest': None, 'last_dtime': None}
+    try:
+        columns = None
+        if verify_only:
+            first = next(source.iter_chunks(symbol, 1), None)
+            columns = [str(column) for column in (source.read(symbol) if first is None else first).columns]
+            source_digest = digest(source, symbol, columns, chunk_rows)
+        else:
+            destination.remove(symbol) # whatever an earlier, interrupted migration left behind
+            digester = None
+            for data in source.iter_chunks(symbol, chunk_rows):
+                if digester is None:
+                    columns = [str(column) for column in data.columns]
+                    digester = _Digester(columns)
+                    destination.write(symbol, data)
+                else:
+                    destination.append(symbol, data)
+                digester.add(data.set_axis(columns, axis=1))
+            if digester is None: # no rows, so only the columns are carried over
+                data = source.read(symbol)
+                columns = [str(column) for column in data.columns]
+                destination.write(symbol, data)
+                digester = _Digester(columns)
+            destination.sync(symbol)
+            destination.compact(symbol)
+            source_digest = digester.digest()
+
+        result['digest'] = source_digest._asdict()
+        if source_digest.last is not None:
+            result['last_dtime'] = pd.Timestamp(source_digest.last).to_pydatetime().isoformat()
+        error = _compare(source_digest, digest(destination, symbol, columns, chunk_rows)) if destination.exists(symbol) else 'destination is missing'
+        result['status'] = ('VERIFIED' if verify_only else 'MIGRATED') if error is None else 'FAILED'
+        result['error'] = error
+    except Exception as ex:
+        result['error'] = repr(ex)
+
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    result['peak_rss_mb'] = round(_peak_rss_mb(), 1)
+    return result
+
+
+class MigrationState:
+    FILE_NAME = '_migrate.json'
+
+    def __init__(self, data_dir: str):
+        """
+        Arguments:
+            data_dir {str} -- Destination folder of the migration; the state is kept there.
+        """
+
+        self.file_path = os.path.join(data_dir, MigrationState.FILE_NAME)
+        self.__symbols = {}
+        try:
+            with open(self.file_path, 'r') as f:
+                self.__symbols = json.load(f)['symbols']
+        except (OSError, ValueError, KeyError):
+            pass
+        return
+
+    @staticmethod
+    def signature(storage: Storage, symbol: str) -> Dict:
+        """Size and modification time of the symbol's source data; a change to either means that it has to be migrated again.
+        """
+        return {'bytes': storage.size(symbol), 'mtime': os.path.getmtime(storage.path(symbol))}
+
+    def done(self, symbol: str, signature: Dict) -> bool:
+        entry = self.__symbols.get(symbol)
+        return entry is not None and entry['source'] == signature
+
+    def record(self, symbol: str, signature: Dict, result: Dict):
+        self.__symbols[symbol] = {'source': signature, 'digest': result['digest'], 'migrated': dt.datetime.now().isoformat()}
+        with open(self.file_path + '.tmp', 'w') as f:
+            json.dump({'symbols': self.__symbols}, f)
+        os.replace(self.file_path + '.tmp', self.file_path)
+        return
+
+
+def migrate(source: Storage, destination: Storage, symbols: List[str] = None, processes: int = None,
+                chunk_rows: int = CHUNK_ROWS, verify_only: bool = False, log: Callable = print) -> Dict[str, Dict]:
+    """
+    Migrate (or verify) every symbol from the source storage to the destination storage, in parallel; see
+    the module's docstring for details.
+
+    Arguments:
+        source {Storage}
+        destination {Storage}
+
+    Keyword Arguments:
+        symbols {List[str]} -- Symbols to migrate; if None, then every symbol in the source folder. (default: {None})
+        processes {int} -- Number of worker processes; if None, then one per CPU. (default: {None})
+        chunk_rows {int} -- Most rows that a worker holds in memory at a time. (default: {CHUNK_ROWS})
+        verify_only {bool} -- Only compare the destination with the source. (default: {False})
+        log {Callable} -- log(message) for progress messages. (default: {print})
+
+    Returns:
+        Dict[str, Dict] -- Result of each symbol (see migrate_symbol); symbols that an earlier migration
+                            completed have status 'SKIPPED'.
+    """
+
+    os.makedirs(destination.data_dir, exist_ok=True)
+    state = MigrationState(destination.data_dir)
+    manifest = Manifest(destination.data_dir)
+    manifest.load()
+
+    symbols = source.symbols() if symbols is None else [symbol for symbol in symbols if source.exists(symbol)]
+    signatures = {symbol: MigrationState.signature(source, symbol) for symbol in symbols}
+    results = {}
+    if not verify_only:
+        for symbol in symbols:
+            if state.done(symbol, signatures[symbol]):
+                results[symbol] = {'symbol': symbol, 'status': 'SKIPPED', 'error': None}
+        if len(results) > 0:
+            log('RESUMING MIGRATION; SKIPPING {} MIGRATED SYMBOLS.'.format(len(results)))
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(migrate_symbol, type(source), source.data_dir, type(destination), destination.data_dir,
+                                    symbol, chunk_rows, verify_only) for symbol in symbols if symbol not in results]
+        for future in as_completed(futures):
+            result = future.result()
+            symbol = result['symbol']
+            results[symbol] = result
+            if result['status'] == 'FAILED':
+                log('FAILED TO {} {}: {}'.format('VERIFY' if verify_only else 'MIGRATE', symbol, result['error']))
+                continue
+            if not verify_only: # only once the symbol verified, so that a failed one is migrated again next time
+                last_dtime = None if result['last_dtime'] is None else dt.datetime.fromisoformat(result['last_dtime'])
+                manifest.record(symbol, last_dtime, result['digest']['rows'], destination.size(symbol), 'CREATED')
+                state.record(symbol, signatures[symbol], result)
+            log('{} {}: {} ROWS IN {:.1f}s, PEAK RSS {:.0f}MB.'.format(result['status'], symbol, result['digest']['rows'], result['seconds'], result['peak_rss_mb']))
+
+    n_failed = sum(result['status'] == 'FAILED' for result in results.values())
+    log('FINISHED {} {} SYMBOLS IN {:.1f}s: {} FAILED.'.format('VERIFYING' if verify_only else 'MIGRATING', len(results), time.perf_counter() - start, n_failed))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Migrate a data folder to another storage format, streaming each symbol, and verify the result.')
+    parser.add_argument('-d', '--data-dir', required=True, help='folder that the update stores symbol data in')
+    parser.add_argument('-o', '--output-dir', required=True, help='folder to migrate the data to')
+    parser.add_argument('-f', '--storage', default='csv', choices=sorted(STORAGE_FORMATS), help='storage format of the data')
+    parser.add_argument('-t', '--to', default='partitioned', choices=sorted(STORAGE_FORMATS), help='storage format to migrate to')
+    parser.add_argument('-w', '--processes', type=int, default=None, help='number of worker processes (default: one per CPU)')
+    parser.add_argument('-s', '--symbols', default=None, help='comma-separated symbols to migrate (default: every symbol in the data folder)')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS, help='most rows that a worker holds in memory at a time')
+    parser.add_argument('--verify-only', action='store_true', help='only compare the output folder with the data folder')
+    args = parser.parse_args()
+
+    results = migrate(STORAGE_FORMATS[args.storage](args.data_dir), STORAGE_FORMATS[args.to](args.output_dir),
+                        None if args.symbols is None else args.symbols.split(','), args.processes, args.chunk_rows, args.verify_only)
+    sys.exit(1 if any(result['status'] == 'FAILED' for result in results.values()) else 0)
@@ -0,0 +1,253 @@
+"""
+Dense time x symbol panels of the whole universe, stored as memory-mappable files.
+
+Each field (close, volume, ...) is one flat float64 file in row-major (time, symbol)
+order, on a regular time grid that starts at `start` and steps by `step`. Times
+without data for a symbol are NaN. Because the files are time-major, extending the
+panel to newer times is a plain byte append, and several processes can map the same
+files at once and share the operating system's page cache instead of each loading
+its own copy.
+
+    <data dir>/_panel/<resolution>/
+        _meta.json      -- symbols, fields, grid, and how far each symbol has been filled in
+        <field>.f8      -- one file per field
+
+When stored rows change after they were filled in (revised, stitched into a gap, or
+rolled back), 'invalidate' moves the symbol's fill mark back, so that the next update
+reads them again; 'drop_before' cuts off the start of the grid to follow a retention period.
+"""
+
+import contextlib
+import datetime as dt
+import fcntl
+import json
+import os
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+
+
+class Panel:
+    FOLDER_NAME = '_panel'
+    META_FILE = '_meta.json'
+    __CHUNK_ROWS = 1 << 16 # number of grid rows of NaN written at a time when extending a field
+    DROP_MIN_FRACTION = 0.1 # dropping rewrites every field, so fewer rows than this fraction of the grid are left for a later drop
+
+    def __init__(self, data_dir: str, resolution: str = None, freq: str = '1min'):
+        """
+        Arguments:
+            data_dir {str} -- Path to the folder in which data files are stored.
+            resolution {str} -- Rollup resolution the panel is built from; if None, then the minute data.
+            freq {str} -- Pandas frequency of the time grid; should match the resolution.
+        """
+
+        self.folder = os.path.join(data_dir, Panel.FOLDER_NAME, resolution or '1m')
+        self.step = pd.Timedelta(freq).value
+        return
+
+    @staticmethod
+    def resolutions(data_dir: str) -> List[str]:
+        """Resolutions ('1m' for the minute data) that panels were built of in the data folder.
+        """
+
+        folder = os.path.join(data_dir, Panel.FOLDER_NAME)
+        if not os.path.isdir(folder):
+            return []
+        return sorted(entry.name for entry in os.scandir(folder) if entry.is_dir())
+
+    def __field_path(self, field: str) -> str:
+        return os.path.join(self.folder, '{}.f8'.format(field))
+
+    @contextlib.contextmanager
+    def __locked(self):
+        """Hold the panel's lock file, so that processes which update the meta (e.g. sharded workers) don't undo each other's changes.
+        """
+
+        with open(os.path.join(self.folder, Panel.META_FILE + '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return
+
+    def meta(self) -> Optional[Dict]:
+        try:
+            with open(os.path.join(self.folder, Panel.META_FILE), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def __save_meta(self, meta: Dict):
+        meta_path = os.path.join(self.folder, Panel.META_FILE)
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(meta_path + '.tmp', meta_path) # readers never see a partial file
+        return
+
+    @property
+    def symbols(self) -> List[str]:
+        return self.meta()['symbols']
+
+    def times(self) -> pd.DatetimeIndex:
+        meta = self.meta()
+        return pd.DatetimeIndex((meta['start'] + np.arange(meta['n_times'], dtype=np.int64)*meta['step']).view('datetime64[ns]'), name='datetime')
+
+    def field(self, field: str, meta: Dict = None) -> np.ndarray:
+        """Map a field's file read-only, as a (time, symbol) array.
+        """
+
+        meta = meta or self.meta()
+        shape = (meta['n_times'], len(meta['symbols']))
+        if shape[0]*shape[1] == 0: # numpy can't map an empty file
+            return np.empty(shape, dtype=np.float64)
+        return np.memmap(self.__field_path(field), dtype=np.float64, mode='r', shape=shape)
+
+    def frame(self, field: str) -> pd.DataFrame:
+        """See 'field' for details; the mapped array is wrapped in a DataFrame without being copied.
+        """
+
+        meta = self.meta()
+        return pd.DataFrame(self.field(field, meta), index=self.times(), columns=meta['symbols'], copy=False)
+
+    def __extend(self, field: str, n_old: int, n_new: int, n_symbols: int):
+        with open(self.__field_path(field), 'ab') as f:
+            for rows in range(n_old, n_new, Panel.__CHUNK_ROWS):
+                n_rows = min(Panel.__CHUNK_ROWS, n_new - rows)
+                f.write(np.full(n_rows*n_symbols, np.nan).tobytes())
+        return
+
+    def update(self, storage, symbols: List[str], fields: List[str]) -> int:
+        """
+        Bring the panel up to date with the stored data. Only rows newer than what each
+        symbol has already filled in are read. If the universe or the fields changed,
+        then the panel is rebuilt from scratch.
+
+        Arguments:
+            storage {Storage} -- Storage to read the symbols' data from.
+            symbols {List[str]} -- Universe of symbols; one panel column each, in this order.
+            fields {List[str]} -- Data columns to build panels of.
+
+        Returns:
+            int -- Number of time steps added to the grid.
+        """
+
+        os.makedirs(self.folder, exist_ok=True)
+        with self.__locked():
+            return self.__update(storage, symbols, fields)
+
+    def __update(self, storage, symbols: List[str], fields: List[str]) -> int:
+        present = [symbol for symbol in symbols if storage.exists(symbol) and storage.last_dtime(symbol) is not None]
+        if len(present) == 0:
+            return 0
+
+        meta = self.meta()
+        if meta is None or meta['symbols'] != symbols or meta['fields'] != fields or meta['step'] != self.step:
+            start = min(pd.Timestamp(storage.first_dtime(symbol)).value for symbol in present)
+            meta = {
+                'symbols': symbols,
+                'fields': fields,
+                'start': start - start % self.step,
+                'step': self.step,
+                'n_times': 0,
+                'filled': {}, # symbol: datetime (ns) of the last row written into the panel
+            }
+            for field in fields:
+                open(self.__field_path(field), 'wb').close()
+
+        end = max(pd.Timestamp(storage.last_dtime(symbol)).value for symbol in present)
+        n_old = meta['n_times']
+        n_new = max(n_old, (end - meta['start'])//self.step + 1)
+        for field in fields:
+            self.__extend(field, n_old, n_new, len(symbols))
+
+        shape = (n_new, len(symbols))
+        panels = {field: np.memmap(self.__field_path(field), dtype=np.float64, mode='r+', shape=shape) for field in fields}
+        for j, symbol in enumerate(symbols):
+            if symbol not in present:
+                continue
+            filled = meta['filled'].get(symbol)
+            start = None if filled is None else pd.Timestamp(filled).to_pydatetime()
+            data = storage.read_range(symbol, start, columns=fields)
+            if len(data) == 0:
+                continue
+
+            dtimes = np.asarray(data.index, dtype='datetime64[ns]').view(np.int64)
+            in_grid = dtimes >= meta['start']
+            rows = (dtimes[in_grid] - meta['start'])//self.step
+            for field in fields:
+                panels[field][rows, j] = data[field].values[in_grid]
+            meta['filled'][symbol] = int(dtimes[-1])
+
+        for panel in panels.values():
+            panel.flush()
+        del panels
+
+        meta['n_times'] = int(n_new) # readers only map up to n_times, so they never see the rows before they're filled
+        self.__save_meta(meta)
+        return int(n_new - n_old)
+
+    def invalidate(self, symbol: str, start: Optional[dt.datetime]):
+        """
+        Have the next update read the symbol's rows from start on again, after they changed in storage.
+        Rows that were removed (rather than changed) are left in the panel.
+
+        Arguments:
+            symbol {str}
+            start {Optional[dt.datetime]} -- Earliest datetime that changed; if None, then all of the symbol's rows did.
+        """
+
+        if not os.path.isdir(self.folder):
+            return
+        with self.__locked():
+            meta = self.meta()
+            filled = None if meta is None else meta['filled'].get(symbol)
+            if filled is None:
+                return
+            if start is None:
+                del meta['filled'][symbol]
+            else:
+                start_ns = pd.Timestamp(start).value
+                start_ns -= (start_ns - meta['start']) % meta['step'] # the whole grid step (e.g. rollup bar) that start falls into changed
+                if filled < start_ns:
+                    return
+                meta['filled'][symbol] = int(start_ns - 1000) # a microsecond before, as updates read from the fill mark on in datetimes
+            self.__save_meta(meta)
+        return
+
+    def drop_before(self, start: dt.datetime) -> int:
+        """
+        Cut the grid's times before start off every field, e.g. to follow a retention period; the rest
+        of each field is copied to a new file. Unless that drops at least DROP_MIN_FRACTION of the grid,
+        nothing is dropped yet.
+
+        Arguments:
+            start {dt.datetime} -- Earliest datetime to keep.
+
+        Returns:
+            int -- Number of time steps dropped.
+        """
+
+        if not os.path.isdir(self.folder):
+            return 0
+        with self.__locked():
+            meta = self.meta()
+            if meta is None:
+                return 0
+            n_drop = min(meta['n_times'], max(0, -(-(pd.Timestamp(start).value - meta['start'])//meta['step'])))
+            if n_drop == 0 or n_drop < Panel.DROP_MIN_FRACTION*meta['n_times']:
+                return 0
+
+            for field in meta['fields']:
+                panel = self.field(field, meta)
+                field_path = self.__field_path(field)
+                with open(field_path + '.tmp', 'wb') as f:
+                    for rows in range(n_drop, meta['n_times'], Panel.__CHUNK_ROWS):
+                        f.write(np.ascontiguousarray(panel[rows:rows + Panel.__CHUNK_ROWS]).tobytes())
+                del panel
+                os.replace(field_path + '.tmp', field_path) # processes that mapped the old file keep it until they let go
+
+            meta['start'] += n_drop*meta['step']
+            meta['n_times'] -= n_drop
+            self.__save_meta(meta)
+        return int(n_drop)
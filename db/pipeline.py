@@ -0,0 +1,123 @@
+"""
+Three-stage ingest pipeline: asynchronous fetching, decoding on a process pool,
+and a single writer.
+
+    symbols --> [fetch coroutines] --raw queue--> [decode processes] --write queue--> [writer thread]
+
+The queues are bounded, so a slow stage holds back the stages before it and the
+number of payloads held in memory stays capped. Each symbol passes through the
+pipeline once, so its writes stay in order.
+"""
+
+import asyncio
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import time
+from typing import Any, Callable, Dict, List
+
+_DONE = None # sentinel passed down the queues once a stage has finished
+
+
+def _decode_job(decode: Callable, encode: Callable, payload: Any, decode_args: tuple, encode_args: tuple):
+    """Runs in a worker process: decode the payload, and format it for writing.
+    """
+
+    start = time.perf_counter()
+    data = decode(payload, *decode_args)
+    encoded = encode(data, *encode_args)
+    return data, encoded, time.perf_counter() - start
+
+
+async def run_pipeline(symbols: List[str], plan: Callable, fetch: Callable, decode: Callable, encode: Callable, store: Callable,
+                        n_fetchers: int, n_decoders: int, queue_size: int, metrics, decoders: ProcessPoolExecutor = None) -> Dict[str, Any]:
+    """
+    Arguments:
+        symbols {List[str]} -- Symbols to update.
+        plan {Callable} -- plan(symbol) -> state; looks up what has to be fetched. Runs on the writer thread.
+        fetch {Callable} -- async fetch(symbol, state) -> (payload, decode_args, encode_args); makes the API call(s).
+        decode {Callable} -- decode(payload, *decode_args) -> pd.DataFrame; must be picklable (a module-level function
+                                or a static method), since it runs in another process.
+        encode {Callable} -- encode(data, *encode_args) -> encoded; formats the data for writing (e.g. Storage.encode);
+                                must be picklable.
+        store {Callable} -- store(symbol, state, data, encoded) -> result; writes the data. Runs on the writer thread.
+        n_fetchers {int} -- Number of concurrent fetch coroutines.
+        n_decoders {int} -- Number of decoding processes.
+        queue_size {int} -- Capacity of each queue between stages.
+        metrics {RunMetrics} -- Where stage timings are recorded.
+        decoders {ProcessPoolExecutor} -- Pool of n_decoders processes to decode on, kept warm by a long-running
+                                            caller; if None, then a pool is started for this run.
+
+    Returns:
+        Dict[str, Any] -- Result of store for each symbol, or the exception that stopped the symbol's update.
+    """
+
+    loop = asyncio.get_running_loop()
+    symbol_queue = asyncio.Queue()
+    for symbol in symbols:
+        symbol_queue.put_nowait(symbol)
+    raw_queue = asyncio.Queue(maxsize=queue_size)
+    write_queue = asyncio.Queue(maxsize=queue_size)
+    results = {}
+
+    async def put(queue: asyncio.Queue, item, symbol: str):
+        start = time.perf_counter()
+        await queue.put(item)
+        waited = time.perf_counter() - start
+        if waited > 0.001:
+            metrics.record('backpressure_wait', waited, symbol=symbol)
+        return
+
+    with ThreadPoolExecutor(max_workers=1) as writer_thread, contextlib.ExitStack() as stack:
+        if decoders is None:
+            decoders = stack.enter_context(ProcessPoolExecutor(max_workers=n_decoders))
+
+        async def fetcher():
+            while not symbol_queue.empty():
+                symbol = symbol_queue.get_nowait()
+                try:
+                    state = await loop.run_in_executor(writer_thread, plan, symbol) # reads what the writer has written
+                    start = time.perf_counter()
+                    payload, decode_args, encode_args = await fetch(symbol, state)
+                    metrics.record('fetch', time.perf_counter() - start, symbol=symbol)
+                except Exception as ex:
+                    results[symbol] = ex
+                    continue
+                await put(raw_queue, (symbol, state, payload, decode_args, encode_args), symbol)
+
+        async def decoder():
+            while True:
+                item = await raw_queue.get()
+                if item is _DONE:
+                    return
+                symbol, state, payload, decode_args, encode_args = item
+                try:
+                    data, encoded, seconds = await loop.run_in_executor(decoders, _decode_job, decode, encode, payload, decode_args, encode_args)
+                    metrics.record('decode', seconds, symbol=symbol)
+                except Exception as ex:
+                    results[symbol] = ex
+                    continue
+                del payload, item # don't hold on to the raw payload while waiting on the writer
+                await put(write_queue, (symbol, state, data, encoded), symbol)
+
+        async def writer():
+            while True:
+                item = await write_queue.get()
+                if item is _DONE:
+                    return
+                symbol, state, data, encoded = item
+                try:
+                    results[symbol] = await loop.run_in_executor(writer_thread, store, symbol, state, data, encoded)
+                except Exception as ex:
+                    results[symbol] = ex
+
+        writer_task = asyncio.ensure_future(writer())
+        decoder_tasks = [asyncio.ensure_future(decoder()) for _ in range(n_decoders)]
+        await asyncio.gather(*[fetcher() for _ in range(max(1, min(n_fetchers, len(symbols))))])
+
+        for _ in decoder_tasks:
+            await raw_queue.put(_DONE)
+        await asyncio.gather(*decoder_tasks)
+        await write_queue.put(_DONE)
+        await writer_task
+
+    return results
@@ -0,0 +1,359 @@
+"""
+Local read server over a database's data folder, so that notebooks and services
+share one in-memory copy of the recent minute data instead of each loading their own.
+
+The last `days` days of each queried symbol are kept in a columnar cache (an int64
+index and one float64 array per column) with least-recently-used eviction. The
+manifest is polled for changes, and after each update the cached symbols are brought
+up to date by reading only their new rows, so queries for the recent window never
+touch the disk.
+
+Endpoints (localhost only):
+    GET /range?symbol=<symbol>[&start=<iso>][&end=<iso>][&columns=close,volume]  -- rows with start <= datetime <= end
+    GET /last?symbol=<symbol>                                                     -- the symbol's last bar
+    GET /stats                                                                    -- cache counters, as JSON
+
+Bars are sent in a binary columnar format (see encode_frame), which decode_frame (or
+QueryClient) turns back into a DataFrame:
+
+    <uint32 header length> <JSON header: rows, columns> <int64 epoch ns index> <float64 values of each column>
+
+    python db/query_server.py -d <data dir> [-f csv] [--days 5] [--port 8766]
+"""
+
+import argparse
+from collections import OrderedDict
+import datetime as dt
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import struct
+import sys
+import threading
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+import pandas as pd
+import requests
+db_path = Path(__file__).absolute().parent
+sys.path.insert(1, str(db_path)) # path to the entire project
+
+from storage import ColumnarStorage, Storage, STORAGE_FORMATS
+from manifest import Manifest
+
+_HEADER_LENGTH = struct.Struct('<I')
+
+
+def encode_frame(index: np.ndarray, columns: Dict[str, np.ndarray]) -> bytes:
+    """
+    Arguments:
+        index {np.ndarray} -- int64 nanoseconds since the epoch.
+        columns {Dict[str, np.ndarray]} -- float64 values of each column, as long as the index.
+
+    Returns:
+        bytes -- The frame in the server's binary columnar format.
+    """
+
+    header = json.dumps({'rows': len(index), 'columns': list(columns)}).encode()
+    parts = [_HEADER_LENGTH.pack(len(header)), header, np.ascontiguousarray(index, dtype='<i8').tobytes()]
+    parts.extend(np.ascontiguousarray(values, dtype='<f8').tobytes() for values in columns.values())
+    return b''.join(parts)
+
+
+def decode_frame(blob: bytes) -> pd.DataFrame:
+    """Inverse of encode_frame; the arrays are read straight out of the buffer.
+    """
+
+    header_length, = _HEADER_LENGTH.unpack_from(blob)
+    header = json.loads(blob[_HEADER_LENGTH.size:_HEADER_LENGTH.size + header_length])
+    n_rows, offset = header['rows'], _HEADER_LENGTH.size + header_length
+
+    index = np.frombuffer(blob, dtype='<i8', count=n_rows, offset=offset)
+    data = {}
+    for i, column in enumerate(header['columns']):
+        data[column] = np.frombuffer(blob, dtype='<f8', count=n_rows, offset=offset + 8*n_rows*(i + 1))
+    return pd.DataFrame(data, index=pd.DatetimeIndex(index.view('datetime64[ns]'), name='datetime'))
+
+
+class HotSeries(NamedTuple):
+    index: np.ndarray # int64 nanoseconds since the epoch, ascending
+    columns: Dict[str, np.ndarray] # float64 values of each column
+    complete: bool # whether every stored row is cached; otherwise the cache holds every row from index[0] on
+    stored_bytes: int # Storage.size of the symbol when it was cached
+
+    @property
+    def nbytes(self) -> int:
+        return self.index.nbytes + sum(values.nbytes for values in self.columns.values())
+
+    def covers(self, start: Optional[int]) -> bool:
+        """Whether every stored row from start (epoch ns; None for the first row) on is cached.
+        """
+        return self.complete or (start is not None and len(self.index) > 0 and start >= self.index[0])
+
+
+class HotCache:
+
+    def __init__(self, storage: Storage, days: float = 5, max_bytes: int = 1 << 30):
+        """
+        Arguments:
+            storage {Storage} -- Storage that holds the minute data.
+            days {float} -- Days before each symbol's last bar that are kept in memory.
+            max_bytes {int} -- Budget for the size of the cached arrays; least recently used symbols are evicted beyond it.
+        """
+
+        self.storage = storage
+        self.window = pd.Timedelta(days=days).value
+        self.max_bytes = int(max_bytes)
+        self.manifest = Manifest(storage.data_dir)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.__series = OrderedDict() # symbol: HotSeries, least recently used first
+        self.__bytes = 0
+        self.__lock = threading.Lock()
+        return
+
+    @staticmethod
+    def __to_arrays(data: pd.DataFrame):
+        return ColumnarStorage.to_epoch_ns(data.index), {str(column): np.ascontiguousarray(data[column], dtype=np.float64) for column in data.columns}
+
+    def __load(self, symbol: str) -> Optional[HotSeries]:
+        """Read the symbol's last `days` days from disk.
+        """
+
+        if not self.storage.exists(symbol):
+            return None
+        stored_bytes = self.storage.size(symbol)
+        last = self.storage.last_dtime(symbol)
+        start = None if last is None else last - pd.Timedelta(self.window)
+        index, columns = HotCache.__to_arrays(self.storage.read_range(symbol, start))
+        first = self.storage.first_dtime(symbol)
+        complete = first is None or (len(index) > 0 and pd.Timestamp(first).value == index[0])
+        return HotSeries(index, columns, complete, stored_bytes)
+
+    def __extend(self, symbol: str, series: HotSeries) -> Optional[HotSeries]:
+        """Append the rows stored after the cached ones, and drop the rows that fell out of the window.
+        """
+
+        if len(series.index) == 0:
+            return self.__load(symbol)
+        stored_bytes = self.storage.size(symbol)
+        after = pd.Timestamp(int(series.index[-1]) + 1000).to_pydatetime() # 1 microsecond, the resolution of datetime
+        new_index, new_columns = HotCache.__to_arrays(self.storage.read_range(symbol, after, columns=list(series.columns)))
+
+        index = np.concatenate([series.index, new_index])
+        first = int(np.searchsorted(index, index[-1] - self.window, side='left'))
+        columns = {column: np.concatenate([values, new_columns[column]])[first:] for column, values in series.columns.items()}
+        return HotSeries(index[first:], columns, series.complete and first == 0, stored_bytes)
+
+    def __put(self, symbol: str, series: Optional[HotSeries]):
+        old = self.__series.pop(symbol, None)
+        if old is not None:
+            self.__bytes -= old.nbytes
+        if series is None:
+            return
+        self.__series[symbol] = series
+        self.__bytes += series.nbytes
+        while self.__bytes > self.max_bytes and len(self.__series) > 1:
+            _, evicted = self.__series.popitem(last=False)
+            self.__bytes -= evicted.nbytes
+            self.evictions += 1
+        return
+
+    def get(self, symbol: str) -> Optional[HotSeries]:
+        """
+        Returns:
+            Optional[HotSeries] -- The symbol's cached window (loaded from disk on a miss), or None if there is no such symbol.
+        """
+
+        with self.__lock:
+            series = self.__series.get(symbol)
+            if series is not None:
+                self.__series.move_to_end(symbol)
+                self.hits += 1
+                return series
+            self.misses += 1
+            series = self.__load(symbol)
+            self.__put(symbol, series)
+            return series
+
+    def refresh(self) -> int:
+        """
+        If the manifest changed since the last call, then bring every cached symbol whose manifest
+        entry no longer matches it up to date: read only the new rows if the update appended to
+        the symbol, or reload its window if the data was rewritten (e.g. a gap was filled in).
+
+        Returns:
+            int -- Number of symbols refreshed.
+        """
+
+        if not self.manifest.refresh():
+            return 0
+
+        n_refreshed = 0
+        with self.__lock:
+            for symbol, series in list(self.__series.items()):
+                entry = self.manifest.get(symbol)
+                if symbol not in self.__series or entry is None or entry.bytes == series.stored_bytes:
+                    continue
+                appended = entry.status == 'APPENDED' and entry.bytes > series.stored_bytes
+                self.__put(symbol, self.__extend(symbol, series) if appended else self.__load(symbol))
+                if symbol in self.__series:
+                    self.__series.move_to_end(symbol, last=False) # refreshing a symbol doesn't count as using it
+                n_refreshed += 1
+        return n_refreshed
+
+    def range(self, symbol: str, start: dt.datetime = None, end: dt.datetime = None, columns: List[str] = None):
+        """
+        Rows with start <= datetime <= end; from the cache if it covers start, and from disk otherwise.
+
+        Returns:
+            Optional[Tuple[np.ndarray, Dict[str, np.ndarray]]] -- Index (epoch ns) and values of each column
+                                                                    (see encode_frame), or None if there is no such symbol.
+        """
+
+        series = self.get(symbol)
+        if series is None:
+            return None
+        columns = list(series.columns) if columns is None else list(columns)
+        start_ns = None if start is None else pd.Timestamp(start).value
+        if not series.covers(start_ns):
+            return HotCache.__to_arrays(self.storage.read_range(symbol, start, end, columns))
+
+        first = 0 if start_ns is None else int(np.searchsorted(series.index, start_ns, side='left'))
+        last = len(series.index) if end is None else int(np.searchsorted(series.index, pd.Timestamp(end).value, side='right'))
+        return series.index[first:last], {column: series.columns[column][first:last] for column in columns}
+
+    def last(self, symbol: str):
+        """See 'range'; the symbol's last bar.
+        """
+
+        series = self.get(symbol)
+        if series is None:
+            return None
+        return series.index[-1:], {column: values[-1:] for column, values in series.columns.items()}
+
+    def stats(self) -> Dict:
+        with self.__lock:
+            return {'symbols': len(self.__series), 'bytes': self.__bytes, 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+class QueryServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, cache: HotCache, port: int = 8766, poll_seconds: float = 1.):
+        """
+        Arguments:
+            cache {HotCache} -- Cache that queries are answered from.
+            port {int} -- Port to listen on, on localhost; 0 picks a free one.
+            poll_seconds {float} -- How often the manifest is checked for changes.
+        """
+
+        super().__init__(('127.0.0.1', port), _QueryHandler)
+        self.cache = cache
+        self.poll_seconds = poll_seconds
+        self.__stopped = threading.Event()
+        self.__poller = threading.Thread(target=self.__poll, daemon=True)
+        self.__poller.start()
+        return
+
+    def __poll(self):
+        while not self.__stopped.wait(self.poll_seconds):
+            try:
+                self.cache.refresh()
+            except Exception as ex: # e.g. a file that an update is rewriting; tried again on the next change
+                sys.stderr.write('Refreshing the cache failed: {!r}\n'.format(ex))
+        return
+
+    def server_close(self):
+        self.__stopped.set()
+        super().server_close()
+        return
+
+
+class _QueryHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args): # keep the console quiet
+        return
+
+    def __send(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        cache = self.server.cache
+
+        try:
+            if url.path == '/stats':
+                return self.__send(200, json.dumps(cache.stats()).encode(), 'application/json')
+            if url.path == '/range':
+                start = dt.datetime.fromisoformat(params['start']) if 'start' in params else None
+                end = dt.datetime.fromisoformat(params['end']) if 'end' in params else None
+                columns = params['columns'].split(',') if 'columns' in params else None
+                frame = cache.range(params['symbol'], start, end, columns)
+            elif url.path == '/last':
+                frame = cache.last(params['symbol'])
+            else:
+                return self.__send(404, b'Unknown endpoint.', 'text/plain')
+        except (KeyError, ValueError) as ex:
+            return self.__send(400, 'Bad query: {!r}'.format(ex).encode(), 'text/plain')
+
+        if frame is None:
+            return self.__send(404, 'Unknown symbol "{}".'.format(params['symbol']).encode(), 'text/plain')
+        return self.__send(200, encode_frame(*frame), 'application/octet-stream')
+
+
+class QueryClient:
+
+    def __init__(self, port: int = 8766, host: str = '127.0.0.1'):
+        self.base_url = 'http://{}:{}'.format(host, port)
+        self.__session = requests.Session() # keep-alive
+        return
+
+    def __get(self, path: str, params: Dict) -> pd.DataFrame:
+        response = self.__session.get(self.base_url + path, params=params)
+        if response.status_code != 200:
+            raise ValueError(response.text)
+        return decode_frame(response.content)
+
+    def range(self, symbol: str, start: dt.datetime = None, end: dt.datetime = None, columns: List[str] = None) -> pd.DataFrame:
+        params = {'symbol': symbol}
+        if start is not None:
+            params['start'] = start.isoformat()
+        if end is not None:
+            params['end'] = end.isoformat()
+        if columns is not None:
+            params['columns'] = ','.join(columns)
+        return self.__get('/range', params)
+
+    def last(self, symbol: str) -> pd.DataFrame:
+        return self.__get('/last', {'symbol': symbol})
+
+    def stats(self) -> Dict:
+        return self.__session.get(self.base_url + '/stats').json()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve range and last-bar queries over a data folder from an in-memory cache.')
+    parser.add_argument('-d', '--data-dir', required=True, help='folder that the update stores symbol data in')
+    parser.add_argument('-f', '--storage', default='csv', choices=sorted(STORAGE_FORMATS), help='storage format of the data')
+    parser.add_argument('--days', type=float, default=5, help='days before each symbol\'s last bar that are kept in memory')
+    parser.add_argument('--max-bytes', type=int, default=1 << 30, help='budget for the size of the cache')
+    parser.add_argument('--port', type=int, default=8766)
+    args = parser.parse_args()
+
+    server = QueryServer(HotCache(STORAGE_FORMATS[args.storage](args.data_dir), args.days, args.max_bytes), args.port)
+    print('Serving {} on http://127.0.0.1:{}'.format(args.data_dir, server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
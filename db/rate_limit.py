@@ -0,0 +1,57 @@
+"""
+Rate limiting shared by every coroutine that talks to the same API.
+"""
+
+import asyncio
+import time
+
+
+class RateLimiter:
+
+    def __init__(self, rate: float, burst: int = 1):
+        """
+        Token bucket that hands out at most `rate` permits per second.
+
+        Arguments:
+            rate {float} -- Number of permits added to the bucket per second.
+            burst {int} -- Maximum number of permits that can be saved up while idle.
+        """
+
+        assert rate > 0, 'Rate must be positive.'
+        assert burst >= 1, 'Burst must be at least 1.'
+
+        self.rate = float(rate)
+        self.burst = burst
+        self.__tokens = float(burst)
+        self.__last = time.monotonic()
+        self.__lock = None # created lazily, so that the limiter can be built outside of an event loop
+
+        return
+
+    def __refill(self):
+        now = time.monotonic()
+        self.__tokens = min(self.burst, self.__tokens + (now - self.__last)*self.rate)
+        self.__last = now
+        return
+
+    async def acquire(self) -> float:
+        """Wait until a permit is available.
+
+        Returns:
+            float -- Number of seconds spent waiting for the permit.
+        """
+
+        if self.__lock is None:
+            self.__lock = asyncio.Lock()
+
+        waited = 0.
+        async with self.__lock: # waiters are served in arrival order
+            self.__refill()
+            while self.__tokens < 1:
+                delay = (1 - self.__tokens)/self.rate
+                await asyncio.sleep(delay)
+                waited += delay
+                self.__refill()
+            self.__tokens -= 1
+
+        return waited
@@ -0,0 +1,200 @@
+"""
+On-disk cache of API responses, so that re-running an update (e.g. after a failed
+cron job, or while developing) doesn't download the same payloads again.
+
+Responses are keyed by a hash of the endpoint and its parameters (sorted, and
+without the API key), and stored zlib-compressed, one file per response:
+
+    <cache dir>/<first 2 hex digits of the key>/<key>.z    -- 8-byte expiry (epoch seconds; inf for never) + compressed JSON
+
+Each entry expires after the TTL that it was stored with; responses for windows
+that are closed (entirely in the past) can be stored without one. Once the cache
+grows past its byte budget, the least recently used entries are evicted; a file's
+modification time is its last use, so the order survives across runs. The threads of an
+update share the in-memory index of sizes, but only hold its lock while they change it;
+files are read, written, and (de)compressed outside of it.
+"""
+
+import hashlib
+import json
+import math
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Any, Dict, Optional
+
+_HEADER = struct.Struct('<d')
+
+
+class ResponseCache:
+    IGNORED_PARAMS = {'apikey', 'api_key'} # don't change the response, and shouldn't end up on disk
+
+    def __init__(self, cache_dir: str, max_bytes: int = 1 << 30, compress_level: int = 6):
+        """
+        Arguments:
+            cache_dir {str} -- Folder that the responses are stored in.
+            max_bytes {int} -- Budget for the (compressed) size of all entries; least recently used entries
+                                are evicted beyond it.
+            compress_level {int} -- zlib compression level.
+        """
+
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_bytes)
+        self.compress_level = compress_level
+        self.hits = 0
+        self.misses = 0
+
+        self.__lock = threading.Lock()
+        self.__sizes = None # key: size in bytes; scanned from disk on first use
+        self.__total = 0
+        self.__evicting = False # one thread evicts at a time
+        return
+
+    @staticmethod
+    def key(url: str, params: Dict = None) -> str:
+        """Hash of the normalized request: the url without its query, and the query's
+        parameters (merged with params) in sorted order.
+        """
+
+        base, _, query = url.partition('?')
+        items = dict(pair.split('=', 1) if '=' in pair else (pair, '') for pair in query.split('&') if pair)
+        items.update({k: str(v) for k, v in (params or {}).items()})
+        normalized = base.rstrip('/') + '?' + '&'.join('{}={}'.format(k, items[k]) for k in sorted(items) if k.lower() not in ResponseCache.IGNORED_PARAMS)
+        return hashlib.sha256(normalized.encode()).hexdigest()
+
+    def __path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + '.z')
+
+    def __scan(self):
+        if self.__sizes is not None:
+            return
+        sizes = {}
+        for root, _, files in os.walk(self.cache_dir): # outside the lock; threads that race here just scan twice
+            for name in files:
+                if name.endswith('.z'):
+                    sizes[name[:-2]] = os.path.getsize(os.path.join(root, name))
+        with self.__lock:
+            if self.__sizes is None:
+                self.__sizes = sizes
+                self.__total = sum(sizes.values())
+        return
+
+    def __forget(self, key: str):
+        """Drop a key from the index; the caller holds the lock.
+        """
+        self.__total -= self.__sizes.pop(key, 0)
+        return
+
+    def __unlink(self, key: str):
+        try:
+            os.remove(self.__path(key))
+        except FileNotFoundError:
+            pass
+        return
+
+    def get(self, url: str, params: Dict = None) -> Optional[Any]:
+        """
+        Returns:
+            Optional[Any] -- The cached (decoded JSON) response, or None if there is no unexpired one.
+        """
+
+        key = ResponseCache.key(url, params)
+        file_path = self.__path(key)
+        self.__scan()
+        try: # reading and decompressing don't need the lock; entries are renamed into place whole
+            with open(file_path, 'rb') as f:
+                blob = f.read()
+            expires, = _HEADER.unpack_from(blob)
+            if expires < time.time():
+                self.__unlink(key)
+                with self.__lock:
+                    self.__forget(key)
+                content = None
+            else:
+                content = json.loads(zlib.decompress(blob[_HEADER.size:]))
+                os.utime(file_path) # mark as recently used
+        except (OSError, ValueError, struct.error, zlib.error): # missing or corrupt
+            content = None
+
+        with self.__lock:
+            if content is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return content
+
+    def put(self, url: str, params: Dict, content: Any, ttl: Optional[float]):
+        """Store a response; it expires after ttl seconds, or never if ttl is None.
+        """
+
+        key = ResponseCache.key(url, params)
+        expires = math.inf if ttl is None else time.time() + ttl
+        blob = _HEADER.pack(expires) + zlib.compress(json.dumps(content).encode(), self.compress_level)
+
+        file_path = self.__path(key)
+        self.__scan()
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        tmp_path = '{}.{}.{}.tmp'.format(file_path, os.getpid(), threading.get_ident()) # threads putting the same key don't share a temporary file
+        with open(tmp_path, 'wb') as f:
+            f.write(blob)
+        os.replace(tmp_path, file_path) # readers never see a partial entry
+
+        with self.__lock:
+            self.__total += len(blob) - self.__sizes.get(key, 0)
+            self.__sizes[key] = len(blob)
+            over_budget = self.__total > self.max_bytes and not self.__evicting
+            if over_budget:
+                self.__evicting = True
+        if over_budget:
+            try:
+                self.__evict()
+            finally:
+                with self.__lock:
+                    self.__evicting = False
+        return
+
+    def __evict(self):
+        """Remove the least recently used entries until the cache is back under 90% of its budget. Only the
+        index is updated under the lock; the files are looked at and removed outside of it.
+        """
+
+        def last_used(key):
+            try:
+                return os.path.getmtime(self.__path(key))
+            except OSError:
+                return 0.
+
+        with self.__lock:
+            keys = list(self.__sizes)
+        victims = []
+        for key in sorted(keys, key=last_used):
+            with self.__lock:
+                if self.__total <= 0.9*self.max_bytes:
+                    break
+                if key in self.__sizes:
+                    self.__forget(key)
+                    victims.append(key)
+        for key in victims:
+            self.__unlink(key)
+        return
+
+    def clear(self):
+        self.__scan()
+        with self.__lock:
+            keys = list(self.__sizes)
+            for key in keys:
+                self.__forget(key)
+        for key in keys:
+            self.__unlink(key)
+        return
+
+    @property
+    def size(self) -> int:
+        """Total size of the entries, in bytes.
+        """
+
+        self.__scan()
+        with self.__lock:
+            return self.__total
@@ -0,0 +1,197 @@
+"""
+Lower-resolution bars (5m, 15m, 1h, 1d, ...) that are kept up to date alongside
+the minute data, so that readers don't have to re-aggregate the full history.
+
+Each resolution is stored with the same storage format as the minute data, in
+its own folder under <data dir>/_rollups/. The last bar of each series may be
+a partial bucket; it is merged with the next run's rows for the same bucket.
+"""
+
+import datetime as dt
+import os
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+
+
+class Rollups:
+    FOLDER_NAME = '_rollups'
+    RESOLUTIONS = { # resolution name: pandas frequency (aliases that are valid across pandas versions)
+        '5m': '5min',
+        '15m': '15min',
+        '1h': '60min',
+        '1d': '1D',
+    }
+    SUM_COLUMNS = ['volume', 'volumefrom', 'volumeto']
+
+    def __init__(self, storage, resolutions: List[str]):
+        """
+        Arguments:
+            storage {Storage} -- Storage that holds the minute data.
+            resolutions {List[str]} -- Names of the resolutions to maintain; see RESOLUTIONS.
+        """
+
+        for resolution in resolutions:
+            assert resolution in Rollups.RESOLUTIONS, 'Resolution "{}" is not valid.'.format(resolution)
+
+        self.storage = storage
+        self.resolutions = list(resolutions)
+        self.__series = {} # resolution: storage of that resolution's bars
+        for resolution in self.resolutions:
+            folder = os.path.join(storage.data_dir, Rollups.FOLDER_NAME, resolution)
+            os.makedirs(folder, exist_ok=True)
+            self.__series[resolution] = type(storage)(folder)
+        return
+
+    def series(self, resolution: str):
+        """Storage of the bars of the given resolution.
+        """
+        assert resolution in self.__series, 'Resolution "{}" is not maintained.'.format(resolution)
+        return self.__series[resolution]
+
+    @staticmethod
+    def weights(data: pd.DataFrame):
+        """
+        Returns:
+            Tuple[Optional[str], Optional[pd.Series]] -- Name of the volume column that VWAP is weighted by,
+                                                        and price*volume of each row (None if VWAP can't be computed).
+        """
+
+        if 'volumefrom' in data.columns and 'volumeto' in data.columns: # volumeto is already price*volume
+            return 'volumefrom', data['volumeto']
+        if 'volume' in data.columns and {'high', 'low', 'close'} <= set(data.columns):
+            typical = (data['high'] + data['low'] + data['close'])/3
+            return 'volume', typical*data['volume']
+        return None, None
+
+    @staticmethod
+    def aggregate(data: pd.DataFrame, freq: str) -> pd.DataFrame:
+        """Aggregate bars into buckets of the given frequency; empty buckets are left out.
+
+        Arguments:
+            data {pd.DataFrame} -- Bars with datetime index in ascending order.
+            freq {str} -- Pandas frequency of the buckets.
+
+        Returns:
+            pd.DataFrame -- One bar per bucket, indexed by the bucket's start.
+        """
+
+        buckets = data.index.floor(freq)
+        groups = data.groupby(buckets, sort=False) # the index is already sorted
+
+        rules = {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last'}
+        rules.update({column: 'sum' for column in Rollups.SUM_COLUMNS})
+        bars = groups.agg({column: rule for column, rule in rules.items() if column in data.columns})
+
+        weight_column, price_volume = Rollups.weights(data)
+        if weight_column is not None:
+            weight = groups[weight_column].sum()
+            with np.errstate(divide='ignore', invalid='ignore'):
+                bars['vwap'] = price_volume.groupby(buckets, sort=False).sum().values / weight.values
+
+        bars.index.name = 'datetime'
+        return bars
+
+    @staticmethod
+    def __merge_partial(old: pd.Series, new: pd.Series) -> pd.Series:
+        """Merge a stored partial bar with the newly aggregated bar of the same bucket.
+        """
+
+        merged = new.copy()
+        for column, combine in (('open', lambda a, b: a), ('high', max), ('low', min)):
+            if column in merged.index:
+                merged[column] = combine(old[column], new[column])
+        for column in Rollups.SUM_COLUMNS:
+            if column in merged.index:
+                merged[column] = old[column] + new[column]
+        if 'vwap' in merged.index:
+            weight_column = 'volumefrom' if 'volumefrom' in merged.index else 'volume'
+            total = old[weight_column] + new[weight_column]
+            merged['vwap'] = (old['vwap']*old[weight_column] + new['vwap']*new[weight_column])/total if total else np.nan
+        return merged
+
+    def update(self, symbol: str, new_data: pd.DataFrame) -> Dict[str, int]:
+        """
+        Bring every resolution up to date with rows that were just appended to the
+        symbol's minute data. A resolution that has no data yet is built from the
+        symbol's full history (this happens once, when a resolution is first added).
+
+        Arguments:
+            symbol {str}
+            new_data {pd.DataFrame} -- Rows that were just appended (already stored).
+
+        Returns:
+            Dict[str, int] -- Number of bars written for each resolution.
+        """
+
+        written = {}
+        for resolution in self.resolutions:
+            series = self.__series[resolution]
+            freq = Rollups.RESOLUTIONS[resolution]
+
+            if not series.exists(symbol) or series.last_dtime(symbol) is None:
+                bars = Rollups.aggregate(self.storage.read(symbol), freq)
+                series.write(symbol, bars)
+                written[resolution] = len(bars)
+                continue
+
+            if len(new_data) == 0:
+                written[resolution] = 0
+                continue
+
+            bars = Rollups.aggregate(new_data, freq)
+            first_bucket = bars.index[0].to_pydatetime()
+            partial = series.read_range(symbol, first_bucket)
+            if len(partial) > 0: # the stored last bar is an unfinished bucket that the new rows continue
+                bars.iloc[0] = Rollups.__merge_partial(partial.iloc[0][bars.columns], bars.iloc[0])
+                series.truncate_from(symbol, first_bucket)
+            series.append(symbol, bars)
+            written[resolution] = len(bars)
+
+        return written
+
+    def rebuild_from(self, symbol: str, start: dt.datetime) -> Dict[str, int]:
+        """
+        Re-aggregate every resolution from the bucket that contains start onwards, after
+        the symbol's minute data was changed from start on (e.g. when a gap was filled in).
+
+        Returns:
+            Dict[str, int] -- Number of bars rewritten for each resolution.
+        """
+
+        written = {}
+        for resolution in self.resolutions:
+            series = self.__series[resolution]
+            freq = Rollups.RESOLUTIONS[resolution]
+            first_bucket = pd.Timestamp(start).floor(freq).to_pydatetime()
+
+            if not series.exists(symbol) or series.last_dtime(symbol) is None:
+                bars = Rollups.aggregate(self.storage.read(symbol), freq)
+                series.write(symbol, bars)
+            else:
+                bars = Rollups.aggregate(self.storage.read_range(symbol, first_bucket), freq)
+                series.truncate_from(symbol, first_bucket)
+                series.append(symbol, bars)
+            written[resolution] = len(bars)
+
+        return written
+
+    def roll_back(self, symbol: str, start: Optional[dt.datetime]) -> Dict[str, int]:
+        """
+        Bring every resolution back in line with the minute data, after an interrupted write was
+        rolled back: repair partial bars, and re-aggregate from the bucket that contains start onwards.
+        If start is None, the interrupted write created the symbol, so its bars are removed.
+
+        Returns:
+            Dict[str, int] -- Number of bars rewritten for each resolution.
+        """
+
+        for resolution in self.resolutions:
+            if self.__series[resolution].exists(symbol):
+                self.__series[resolution].repair(symbol)
+
+        if start is None or not self.storage.exists(symbol):
+            for resolution in self.resolutions:
+                self.__series[resolution].remove(symbol)
+            return {}
+        return self.rebuild_from(symbol, start)
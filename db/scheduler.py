@@ -0,0 +1,105 @@
+"""
+Refresh schedule for the update daemon: a priority queue of symbols, ordered by
+when each one is next due.
+
+A symbol is due `cadence` seconds after it was last refreshed, so the symbols
+that have gone longest without a refresh come first. A refresh that brings no new
+rows (e.g. a thinly traded stock, or any stock outside of market hours) or that
+fails doubles the symbol's interval, up to max_backoff times the cadence; the
+first refresh that brings new rows resets it.
+"""
+
+import heapq
+import itertools
+import time
+from typing import Dict, Iterable, List, Optional
+
+
+class RefreshSchedule:
+
+    def __init__(self, cadence: float, max_backoff: int = 16):
+        """
+        Arguments:
+            cadence {float} -- Seconds between refreshes of a symbol that keeps getting new rows.
+            max_backoff {int} -- Most that a symbol's interval can grow to, as a multiple of cadence.
+        """
+
+        assert cadence > 0, 'Cadence must be positive.'
+        assert max_backoff >= 1, 'Maximum backoff must be at least 1.'
+
+        self.cadence = float(cadence)
+        self.max_backoff = max_backoff
+        self.__heap = [] # (due time, sequence number, symbol)
+        self.__due = {} # symbol: due time of its live heap entry; entries of removed or rescheduled symbols are skipped
+        self.__intervals = {} # symbol: current interval, in seconds
+        self.__sequence = itertools.count() # breaks ties in the order that symbols were scheduled
+        return
+
+    def __len__(self) -> int:
+        return len(self.__due)
+
+    def __push(self, symbol: str, due: float):
+        self.__due[symbol] = due
+        heapq.heappush(self.__heap, (due, next(self.__sequence), symbol))
+        return
+
+    def sync(self, symbols: Iterable[str], last_refreshed: Dict[str, float] = None):
+        """
+        Make the schedule cover exactly the given symbols. New symbols are due a cadence after
+        their last refresh (or right away, if they have never been refreshed); symbols that are
+        no longer given are dropped.
+
+        Arguments:
+            symbols {Iterable[str]} -- Current universe of symbols.
+            last_refreshed {Dict[str, float]} -- Epoch seconds of each symbol's last refresh, e.g. from the manifest.
+        """
+
+        symbols = list(symbols)
+        last_refreshed = last_refreshed or {}
+        now = time.time()
+        for symbol in set(self.__due) - set(symbols):
+            del self.__due[symbol]
+            self.__intervals.pop(symbol, None)
+        for symbol in symbols:
+            if symbol not in self.__due:
+                self.__intervals[symbol] = self.cadence
+                last = last_refreshed.get(symbol)
+                self.__push(symbol, now if last is None else min(now, last + self.cadence))
+        return
+
+    def next_due(self) -> Optional[float]:
+        """Epoch seconds at which the next symbol is due, or None if the schedule is empty.
+        """
+
+        while len(self.__heap) > 0:
+            due, _, symbol = self.__heap[0]
+            if self.__due.get(symbol) == due:
+                return due
+            heapq.heappop(self.__heap) # stale entry
+        return None
+
+    def pop_due(self, now: float = None) -> List[str]:
+        """Take every symbol that is due, most overdue first. They stay off the schedule until rescheduled.
+        """
+
+        now = time.time() if now is None else now
+        symbols = []
+        while self.next_due() is not None and self.next_due() <= now:
+            _, _, symbol = heapq.heappop(self.__heap)
+            del self.__due[symbol]
+            symbols.append(symbol)
+        return symbols
+
+    def reschedule(self, symbol: str, n_rows: int, failed: bool = False, now: float = None):
+        """Put a refreshed symbol back on the schedule, backing off if the refresh brought no new rows or failed.
+        """
+
+        if symbol not in self.__intervals: # dropped from the universe while it was being refreshed
+            return
+        now = time.time() if now is None else now
+        if failed or n_rows == 0:
+            self.__intervals[symbol] = min(2*self.__intervals[symbol], self.max_backoff*self.cadence)
+        else:
+            self.__intervals[symbol] = self.cadence
+        self.__push(symbol, now + self.__intervals[symbol])
+        return
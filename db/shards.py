@@ -0,0 +1,213 @@
+"""
+Coordination between the workers of a sharded update, which share one data folder
+(on one host, or on a shared file system):
+
+    + Each worker owns the symbols whose crc32 falls into its shard, and can take over
+        (steal) symbols of other shards that no one has updated yet once its own are done
+    + A worker only writes a symbol while it holds the symbol's lease: a file created
+        with O_EXCL, which another worker may break once it has expired, or right away
+        if its holder was a process on the same host that is no longer running
+    + Each worker writes its progress to its own file, and the progress of all workers
+        is merged into a single run summary
+
+    <data dir>/_leases/<symbol>.lease       -- owner and time at which the lease was taken
+    <data dir>/_progress/<worker>.json      -- progress of each worker
+    <data dir>/_progress/summary.json       -- merged progress of all workers
+"""
+
+import fcntl
+import json
+import os
+import socket
+import threading
+import time
+import zlib
+from typing import Dict, Tuple
+
+
+def parse_shard(shard: str) -> Tuple[int, int]:
+    """
+    Arguments:
+        shard {str} -- Shard as '<index>/<count>', e.g. '0/4'.
+
+    Returns:
+        Tuple[int, int] -- Index and count of the shard.
+    """
+
+    index, count = (int(part) for part in str(shard).split('/'))
+    assert count >= 1 and 0 <= index < count, 'Shard "{}" is not valid.'.format(shard)
+    return index, count
+
+
+def shard_of(symbol: str, count: int) -> int:
+    """Shard that a symbol belongs to; stable across processes, hosts, and runs.
+    """
+    return zlib.crc32(symbol.encode()) % count
+
+
+class Leases:
+    FOLDER_NAME = '_leases'
+
+    def __init__(self, data_dir: str, owner: str, ttl: float = 10*60):
+        """
+        Arguments:
+            data_dir {str} -- Path to the folder in which data files are stored.
+            owner {str} -- Name of this worker, recorded in its leases.
+            ttl {float} -- Seconds after which another worker may break a lease.
+        """
+
+        self.folder = os.path.join(data_dir, Leases.FOLDER_NAME)
+        os.makedirs(self.folder, exist_ok=True)
+        self.owner = '{}@{}:{}'.format(owner, socket.gethostname(), os.getpid())
+        self.ttl = ttl
+        self.__held = set()
+        self.__lock = threading.Lock()
+        return
+
+    def __path(self, symbol: str) -> str:
+        return os.path.join(self.folder, '{}.lease'.format(symbol))
+
+    @staticmethod
+    def __holder_died(file_path: str) -> bool:
+        try:
+            with open(file_path, 'r') as f:
+                host, pid = json.load(f)['owner'].rsplit('@', 1)[1].rsplit(':', 1)
+            if host != socket.gethostname():
+                return False
+            os.kill(int(pid), 0)
+            return False
+        except ProcessLookupError:
+            return True
+        except (OSError, ValueError, KeyError, IndexError): # not written yet, or the holder runs as another user
+            return False
+
+    def __break_if_expired(self, file_path: str) -> bool:
+        try:
+            if time.time() - os.path.getmtime(file_path) < self.ttl and not Leases.__holder_died(file_path):
+                return False
+            stale_path = '{}.stale.{}'.format(file_path, self.owner.replace('/', '_'))
+            os.rename(file_path, stale_path) # only one of the workers that find the lease expired gets to rename it
+            os.remove(stale_path)
+            return True
+        except OSError: # released, or broken by another worker in the meantime
+            return False
+
+    def acquire(self, symbol: str) -> bool:
+        """Take the symbol's lease without waiting.
+
+        Returns:
+            bool -- Whether the lease was taken; False if another worker holds it.
+        """
+
+        file_path = self.__path(symbol)
+        for _ in range(2):
+            try:
+                fd = os.open(file_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if self.__break_if_expired(file_path):
+                    continue
+                return False
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'owner': self.owner, 'time': time.time()}, f)
+            with self.__lock:
+                self.__held.add(symbol)
+            return True
+        return False
+
+    def wait(self, symbol: str, poll_seconds: float = 1.):
+        """Take the symbol's lease, waiting for the worker that holds it (at most until the lease expires).
+        """
+
+        while not self.acquire(symbol):
+            time.sleep(poll_seconds)
+        return
+
+    def release(self, symbol: str):
+        with self.__lock:
+            if symbol not in self.__held:
+                return
+            self.__held.discard(symbol)
+        try:
+            os.remove(self.__path(symbol))
+        except FileNotFoundError: # broken by another worker after it expired
+            pass
+        return
+
+
+class ShardProgress:
+    FOLDER_NAME = '_progress'
+    SUMMARY_FILE = 'summary.json'
+
+    def __init__(self, data_dir: str, worker: str):
+        """
+        Arguments:
+            data_dir {str} -- Path to the folder in which data files are stored.
+            worker {str} -- Name of this worker; its progress is kept in <worker>.json.
+        """
+
+        self.folder = os.path.join(data_dir, ShardProgress.FOLDER_NAME)
+        os.makedirs(self.folder, exist_ok=True)
+        self.file_path = os.path.join(self.folder, '{}.json'.format(worker))
+        return
+
+    @staticmethod
+    def __write_json(file_path: str, content: Dict):
+        tmp_path = '{}.tmp.{}'.format(file_path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(content, f)
+        os.replace(tmp_path, file_path)
+        return
+
+    def report(self, progress: Dict) -> Dict:
+        """
+        Write this worker's progress, and merge it with the latest progress of every other worker.
+
+        Arguments:
+            progress {Dict} -- 'state' ('running' or 'finished'), 'started' and 'updated' (epoch seconds),
+                                'counts' (symbols by status), and 'rows'; any other keys are kept as is.
+
+        Returns:
+            Dict -- The merged summary (see 'merge'), as written to summary.json.
+        """
+
+        with open(os.path.join(self.folder, 'summary.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX) # merges mustn't overwrite each other
+            try:
+                ShardProgress.__write_json(self.file_path, progress)
+                summary = self.merge()
+                ShardProgress.__write_json(os.path.join(self.folder, ShardProgress.SUMMARY_FILE), summary)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return summary
+
+    def merge(self) -> Dict:
+        """
+        Returns:
+            Dict -- Number of workers (and how many of them finished), symbols by status and rows
+                    summed over the workers, wall-clock seconds from the first start to the last update,
+                    and the progress of each worker.
+        """
+
+        workers = {}
+        for name in sorted(os.listdir(self.folder)):
+            if name.endswith('.json') and name != ShardProgress.SUMMARY_FILE:
+                try:
+                    with open(os.path.join(self.folder, name), 'r') as f:
+                        workers[name[:-len('.json')]] = json.load(f)
+                except (OSError, ValueError):
+                    continue
+
+        counts = {}
+        for progress in workers.values():
+            for status, n in progress.get('counts', {}).items():
+                counts[status] = counts.get(status, 0) + n
+        started = min((progress['started'] for progress in workers.values()), default=None)
+        updated = max((progress['updated'] for progress in workers.values()), default=None)
+        return {
+            'workers': len(workers),
+            'finished': sum(progress.get('state') == 'finished' for progress in workers.values()),
+            'counts': counts,
+            'rows': sum(progress.get('rows', 0) for progress in workers.values()),
+            'wall_seconds': None if started is None else round(updated - started, 3),
+            'by_worker': workers,
+        }
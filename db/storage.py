@@ -0,0 +1,868 @@
+"""
+Storage backends that DB_Base reads and writes symbol data through.
+
+Every backend stores one time series per symbol: a datetime index in
+ascending order (old-to-new) and a set of data columns.
+"""
+
+from abc import ABC, abstractmethod
+import contextlib
+import datetime as dt
+import io
+import json
+import os
+import shutil
+import sys
+import threading
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+import numpy as np
+import pandas as pd
+db_path = Path(__file__).absolute().parent
+sys.path.insert(1, str(db_path)) # path to the entire project
+
+from db_config import __DTIME_FORMAT as DTIME_FORMAT
+
+
+class Storage(ABC):
+
+    def __init__(self, data_dir: str):
+        """
+        Arguments:
+            data_dir {str} -- Path to the folder in which data files are to be stored.
+        """
+
+        self.data_dir = data_dir
+        return
+
+    @abstractmethod
+    def path(self, symbol: str) -> str:
+        """Path to the file (or folder) that holds the symbol's data.
+        """
+        pass
+
+    def exists(self, symbol: str) -> bool:
+        return os.path.exists(self.path(symbol))
+
+    def symbols(self) -> List[str]:
+        """Symbols that have data in the data folder.
+        """
+
+        suffix = os.path.basename(self.path('')) # e.g. '.csv'
+        return sorted(name[:-len(suffix)] for name in os.listdir(self.data_dir) if name.endswith(suffix) and not name.startswith('_'))
+
+    def size(self, symbol: str) -> int:
+        """Number of bytes the symbol's data takes up; changes whenever the data changes.
+        """
+        return os.path.getsize(self.path(symbol))
+
+    def n_rows(self, symbol: str) -> int:
+        return len(self.read(symbol))
+
+    @abstractmethod
+    def first_dtime(self, symbol: str) -> Optional[dt.datetime]:
+        """Datetime of the symbol's first row, or None if the symbol has no rows.
+        """
+        pass
+
+    @abstractmethod
+    def last_dtime(self, symbol: str) -> Optional[dt.datetime]:
+        """Datetime of the symbol's last row, or None if the symbol has no rows.
+        """
+        pass
+
+    @abstractmethod
+    def write(self, symbol: str, data: pd.DataFrame):
+        """Create (or overwrite) the symbol's data.
+        """
+        pass
+
+    @abstractmethod
+    def append(self, symbol: str, data: pd.DataFrame):
+        """Append rows that are newer than the symbol's last row.
+        """
+        pass
+
+    @abstractmethod
+    def truncate_from(self, symbol: str, start: dt.datetime):
+        """Drop every row with datetime >= start, leaving the earlier rows untouched.
+        """
+        pass
+
+    @abstractmethod
+    def read_range(self, symbol: str, start: dt.datetime = None, end: dt.datetime = None, columns: List[str] = None) -> pd.DataFrame:
+        """Read only the rows with start <= datetime <= end, without reading the rest of the data.
+
+        Arguments:
+            symbol {str}
+            start {dt.datetime} -- Earliest datetime to read; if None, then read from the first row.
+            end {dt.datetime} -- Latest datetime to read (inclusive); if None, then read to the last row.
+            columns {List[str]} -- Data columns to read; if None, then read all of them.
+
+        Returns:
+            pd.DataFrame -- Data for the given symbol, with datetime index
+        """
+        pass
+
+    def read(self, symbol: str) -> pd.DataFrame:
+        return self.read_range(symbol)
+
+    def iter_chunks(self, symbol: str, chunk_rows: int) -> Iterator[pd.DataFrame]:
+        """
+        Read the symbol's data in order, as DataFrames of at most chunk_rows rows (like read, but in pieces),
+        so that data of any size can be streamed through bounded memory. By default the data is read in one go
+        and then split up; every backend here streams it instead.
+        """
+
+        data = self.read(symbol)
+        for first in range(0, len(data), chunk_rows):
+            yield data.iloc[first:first + chunk_rows]
+
+    def drop_before(self, symbol: str, start: dt.datetime) -> int:
+        """Drop every row with datetime < start (e.g. to enforce a retention period), leaving the later rows untouched.
+        By default the remaining rows are rewritten; partitioned storage drops whole partitions instead.
+
+        Returns:
+            int -- Number of rows dropped.
+        """
+
+        first = self.first_dtime(symbol)
+        if first is None or first >= start:
+            return 0
+        n_rows = self.n_rows(symbol)
+        kept = self.read_range(symbol, start)
+        self.write(symbol, kept)
+        return n_rows - len(kept)
+
+    def compact(self, symbol: str) -> int:
+        """Merge small pieces of the symbol's data that appends left behind into larger ones, without changing its rows.
+        Only partitioned storage stores data in pieces; by default there is nothing to merge.
+
+        Returns:
+            int -- Number of pieces merged away.
+        """
+        return 0
+
+    def remove(self, symbol: str):
+        """Delete the symbol's data, if there is any.
+        """
+
+        file_path = self.path(symbol)
+        if os.path.isdir(file_path):
+            shutil.rmtree(file_path)
+        elif os.path.exists(file_path):
+            os.remove(file_path)
+        return
+
+    @abstractmethod
+    def sync(self, symbol: str):
+        """Flush the symbol's data to disk (fsync), so that a completed write survives a crash.
+        """
+        pass
+
+    @abstractmethod
+    def repair(self, symbol: str) -> bool:
+        """Cut off a partial row that a write which was interrupted left at the end of the symbol's data.
+
+        Returns:
+            bool -- True if anything had to be repaired.
+        """
+        pass
+
+    def encode(self, data: pd.DataFrame, header: bool):
+        """
+        Format data ahead of time for write_encoded (header=True) or append_encoded (header=False).
+        Formatting is CPU-bound, so the update pipeline runs this in a worker process; the result
+        must be picklable. By default, nothing is formatted ahead of time and the data is returned as is.
+        """
+        return data
+
+    def write_encoded(self, symbol: str, encoded):
+        """See 'write'; takes the output of encode(data, header=True).
+        """
+        self.write(symbol, encoded)
+        return
+
+    def append_encoded(self, symbol: str, encoded):
+        """See 'append'; takes the output of encode(data, header=False).
+        """
+        self.append(symbol, encoded)
+        return
+
+
+class CsvStorage(Storage):
+    """One text file per symbol, as written by pandas' to_csv.
+    """
+
+    def path(self, symbol: str) -> str:
+        return os.path.join(self.data_dir, '{}.csv'.format(symbol))
+
+    @staticmethod
+    def __read_last_line(file_path: str) -> str:
+        with open(file_path, 'rb') as f:
+            f.seek(-2, os.SEEK_END)
+
+            val = f.read(1)
+            while val == b'\n':
+                f.seek(-2, os.SEEK_CUR)
+                val = f.read(1)
+
+            while val != b'\n':
+                f.seek(-2, os.SEEK_CUR)
+                val = f.read(1)
+
+            return f.readline().decode().strip('\n')
+
+    @staticmethod
+    def parse_date_from_line(line: str) -> dt.datetime:
+        date_str = line.split(',')[0]
+        return dt.datetime.strptime(date_str, DTIME_FORMAT)
+
+    def first_dtime(self, symbol: str) -> Optional[dt.datetime]:
+        with open(self.path(symbol), 'r') as f:
+            f.readline()
+            line = f.readline()
+        return CsvStorage.parse_date_from_line(line) if line.endswith('\n') else None
+
+    def last_dtime(self, symbol: str) -> Optional[dt.datetime]:
+        file_path = self.path(symbol)
+        with open(file_path, 'rb') as f:
+            n_lines = sum(1 for _ in zip(range(2), f))
+        if n_lines < 2: # only a header
+            return None
+        last_line = CsvStorage.__read_last_line(file_path)
+        return CsvStorage.parse_date_from_line(last_line)
+
+    def n_rows(self, symbol: str) -> int:
+        n_lines = 0
+        with open(self.path(symbol), 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                n_lines += block.count(b'\n')
+        return max(0, n_lines - 1) # don't count the header
+
+    def write(self, symbol: str, data: pd.DataFrame):
+        data.to_csv(self.path(symbol), mode='w', header=True, date_format=DTIME_FORMAT)
+        return
+
+    def append(self, symbol: str, data: pd.DataFrame):
+        self.append_encoded(symbol, self.encode(data, header=False)) # a single write, rather than one per chunk of rows
+        return
+
+    def encode(self, data: pd.DataFrame, header: bool) -> bytes:
+        return data.to_csv(header=header, date_format=DTIME_FORMAT).encode()
+
+    def write_encoded(self, symbol: str, encoded: bytes):
+        with open(self.path(symbol), 'wb') as f:
+            f.write(encoded)
+        return
+
+    def append_encoded(self, symbol: str, encoded: bytes):
+        with open(self.path(symbol), 'ab') as f:
+            f.write(encoded)
+        return
+
+    def sync(self, symbol: str):
+        with open(self.path(symbol), 'rb') as f:
+            os.fsync(f.fileno())
+        return
+
+    def repair(self, symbol: str) -> bool:
+        # every complete line (the header included) ends with a newline
+        file_path = self.path(symbol)
+        size = os.path.getsize(file_path)
+        with open(file_path, 'rb+') as f:
+            pos = size
+            while pos > 0:
+                block_start = max(0, pos - (1 << 16))
+                f.seek(block_start)
+                block = f.read(pos - block_start)
+                newline = block.rfind(b'\n')
+                if newline >= 0:
+                    pos = block_start + newline + 1
+                    break
+                pos = block_start
+            if pos == size:
+                return False
+            f.truncate(pos)
+        return True
+
+    @staticmethod
+    def __next_line_start(f, pos: int, header_end: int) -> int:
+        """Byte offset of the first line that starts at or after pos.
+        """
+
+        if pos <= header_end:
+            f.seek(header_end)
+            return header_end
+        f.seek(pos - 1)
+        f.readline() # finish the line that pos - 1 is in
+        return f.tell()
+
+    @staticmethod
+    def __bisect(f, header_end: int, size: int, is_after) -> int:
+        """
+        Binary search over byte offsets of a file whose lines are sorted by datetime.
+
+        Arguments:
+            f -- File opened in binary mode.
+            header_end {int} -- Byte offset of the first data line.
+            size {int} -- Size of the file, in bytes.
+            is_after {Callable} -- Predicate on a line's datetime; must be False for the
+                                    first lines of the file and True for the rest.
+
+        Returns:
+            int -- Byte offset of the first line for which is_after is True (or size if there is none).
+        """
+
+        lo, hi = header_end, size
+        while lo < hi:
+            mid = (lo + hi)//2
+            line_start = CsvStorage.__next_line_start(f, mid, header_end)
+            line = f.readline()
+            if line_start >= size or not line.endswith(b'\n') or is_after(CsvStorage.parse_date_from_line(line.decode())):
+                hi = mid
+            else:
+                lo = line_start + 1 # every offset up to line_start leads to this same line
+        return CsvStorage.__next_line_start(f, lo, header_end)
+
+    def truncate_from(self, symbol: str, start: dt.datetime):
+        file_path = self.path(symbol)
+        size = os.path.getsize(file_path)
+        with open(file_path, 'rb+') as f:
+            f.readline()
+            header_end = f.tell()
+            f.truncate(CsvStorage.__bisect(f, header_end, size, lambda dtime: dtime >= start))
+        return
+
+    def iter_chunks(self, symbol: str, chunk_rows: int) -> Iterator[pd.DataFrame]:
+        with open(self.path(symbol), 'r') as f:
+            for data in pd.read_csv(f, index_col=0, chunksize=chunk_rows, float_precision='round_trip'): # exactly the values that were written
+                index_name = data.index.name
+                data.index = pd.to_datetime(data.index, format=DTIME_FORMAT)
+                data.index.name = index_name or 'datetime'
+                yield data
+
+    def read_range(self, symbol: str, start: dt.datetime = None, end: dt.datetime = None, columns: List[str] = None) -> pd.DataFrame:
+        file_path = self.path(symbol)
+        size = os.path.getsize(file_path)
+        with open(file_path, 'rb') as f:
+            header = f.readline()
+            header_end = f.tell()
+
+            first = header_end if start is None else CsvStorage.__bisect(f, header_end, size, lambda dtime: dtime >= start)
+            last = size if end is None else CsvStorage.__bisect(f, header_end, size, lambda dtime: dtime > end)
+
+            f.seek(first)
+            body = f.read(max(0, last - first))
+
+        index_name = header.decode().strip('\n').split(',')[0]
+        usecols = None if columns is None else [index_name] + list(columns)
+        data = pd.read_csv(io.BytesIO(header + body), index_col=0, usecols=usecols, float_precision='round_trip')
+        data.index = pd.to_datetime(data.index, format=DTIME_FORMAT)
+        data.index.name = index_name or 'datetime'
+        return data
+
+
+class ColumnarStorage(Storage):
+    """
+    One folder per symbol, with one flat binary file per column. The index is
+    stored as int64 nanoseconds since the epoch (in the same wall-clock time as
+    the CSV files) and every data column as float64, so appending is a plain
+    byte append and reading can memory-map the files.
+
+        <symbol>.col/
+            _meta.json      -- column names, in order
+            datetime.i8     -- index
+            <column>.f8     -- one file per data column
+    """
+
+    INDEX_FILE = 'datetime.i8'
+    META_FILE = '_meta.json'
+
+    def path(self, symbol: str) -> str:
+        return os.path.join(self.data_dir, '{}.col'.format(symbol))
+
+    def __column_path(self, symbol: str, column: str) -> str:
+        return os.path.join(self.path(symbol), '{}.f8'.format(column))
+
+    def columns(self, symbol: str) -> List[str]:
+        with open(os.path.join(self.path(symbol), ColumnarStorage.META_FILE), 'r') as f:
+            return json.load(f)['columns']
+
+    def n_rows(self, symbol: str) -> int:
+        return os.path.getsize(os.path.join(self.path(symbol), ColumnarStorage.INDEX_FILE)) // 8
+
+    def size(self, symbol: str) -> int:
+        folder = self.path(symbol)
+        return sum(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder))
+
+    @staticmethod
+    def to_epoch_ns(index: pd.Index) -> np.ndarray:
+        return np.asarray(index, dtype='datetime64[ns]').view(np.int64)
+
+    def first_dtime(self, symbol: str) -> Optional[dt.datetime]:
+        if self.n_rows(symbol) == 0:
+            return None
+        with open(os.path.join(self.path(symbol), ColumnarStorage.INDEX_FILE), 'rb') as f:
+            first = np.frombuffer(f.read(8), dtype=np.int64)[0]
+        return pd.Timestamp(first).to_pydatetime()
+
+    def last_dtime(self, symbol: str) -> Optional[dt.datetime]:
+        n_rows = self.n_rows(symbol)
+        if n_rows == 0:
+            return None
+        with open(os.path.join(self.path(symbol), ColumnarStorage.INDEX_FILE), 'rb') as f:
+            f.seek((n_rows - 1)*8)
+            last = np.frombuffer(f.read(8), dtype=np.int64)[0]
+        return pd.Timestamp(last).to_pydatetime()
+
+    def __append_columns(self, symbol: str, data: pd.DataFrame, mode: str):
+        with open(os.path.join(self.path(symbol), ColumnarStorage.INDEX_FILE), mode) as f:
+            f.write(ColumnarStorage.to_epoch_ns(data.index).tobytes())
+        for column in data.columns:
+            with open(self.__column_path(symbol, column), mode) as f:
+                f.write(np.ascontiguousarray(data[column], dtype=np.float64).tobytes())
+        return
+
+    def write(self, symbol: str, data: pd.DataFrame):
+        os.makedirs(self.path(symbol), exist_ok=True)
+        meta_path = os.path.join(self.path(symbol), ColumnarStorage.META_FILE)
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump({'columns': [str(c) for c in data.columns]}, f)
+        os.replace(meta_path + '.tmp', meta_path) # never leave a partial list of columns behind
+        self.__append_columns(symbol, data, 'wb')
+        return
+
+    def append(self, symbol: str, data: pd.DataFrame):
+        columns = self.columns(symbol)
+        if sorted(str(c) for c in data.columns) != sorted(columns):
+            raise ValueError('Columns {} do not match the stored columns {} of {}.'.format(list(data.columns), columns, symbol))
+        self.__append_columns(symbol, data[columns], 'ab')
+        return
+
+    def __file_names(self, symbol: str) -> List[str]:
+        return [ColumnarStorage.INDEX_FILE] + ['{}.f8'.format(column) for column in self.columns(symbol)]
+
+    def sync(self, symbol: str):
+        for name in self.__file_names(symbol):
+            with open(os.path.join(self.path(symbol), name), 'rb') as f:
+                os.fsync(f.fileno())
+        return
+
+    def repair(self, symbol: str) -> bool:
+        if not os.path.exists(os.path.join(self.path(symbol), ColumnarStorage.META_FILE)): # the symbol's first write never got going
+            self.remove(symbol)
+            return True
+
+        # an interrupted append can leave the files with different numbers of rows, or a partial value
+        sizes = {}
+        for name in self.__file_names(symbol):
+            file_path = os.path.join(self.path(symbol), name)
+            sizes[file_path] = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+        n_rows = min(sizes.values())//8
+        repaired = False
+        for file_path, size in sizes.items():
+            if size != n_rows*8:
+                with open(file_path, 'ab') as f:
+                    f.truncate(n_rows*8)
+                repaired = True
+        return repaired
+
+    def truncate_from(self, symbol: str, start: dt.datetime):
+        index = self.read_arrays(symbol, columns=[])['datetime']
+        n_rows = int(np.searchsorted(index, pd.Timestamp(start).value, side='left'))
+        del index # release the map before resizing the file
+
+        for name in self.__file_names(symbol):
+            os.truncate(os.path.join(self.path(symbol), name), n_rows*8)
+        return
+
+    def read_arrays(self, symbol: str, columns: List[str] = None) -> Dict[str, np.ndarray]:
+        """Memory-map the symbol's files, without reading them into memory.
+
+        Arguments:
+            symbol {str}
+            columns {List[str]} -- Data columns to map; if None, then map all of them.
+
+        Returns:
+            Dict[str, np.ndarray] -- Read-only arrays keyed by column name; the index is
+                                        under 'datetime', as int64 nanoseconds.
+        """
+
+        n_rows = self.n_rows(symbol)
+        columns = self.columns(symbol) if columns is None else columns
+
+        def mmap(file_path, dtype):
+            if n_rows == 0: # numpy can't map an empty file
+                return np.empty(0, dtype=dtype)
+            return np.memmap(file_path, dtype=dtype, mode='r', shape=(n_rows,))
+
+        arrays = {'datetime': mmap(os.path.join(self.path(symbol), ColumnarStorage.INDEX_FILE), np.int64)}
+        for column in columns:
+            arrays[column] = mmap(self.__column_path(symbol, column), np.float64)
+        return arrays
+
+    def read_range(self, symbol: str, start: dt.datetime = None, end: dt.datetime = None, columns: List[str] = None) -> pd.DataFrame:
+        arrays = self.read_arrays(symbol, columns)
+        index = arrays.pop('datetime')
+
+        # the index is sorted, so the range is found by binary search on the mapped file
+        first = 0 if start is None else np.searchsorted(index, pd.Timestamp(start).value, side='left')
+        last = len(index) if end is None else np.searchsorted(index, pd.Timestamp(end).value, side='right')
+
+        index = pd.DatetimeIndex(np.array(index[first:last]).view('datetime64[ns]'), name='datetime')
+        return pd.DataFrame({column: np.array(values[first:last]) for column, values in arrays.items()}, index=index)
+
+    def iter_chunks(self, symbol: str, chunk_rows: int) -> Iterator[pd.DataFrame]:
+        n_rows, columns = self.n_rows(symbol), self.columns(symbol)
+        with contextlib.ExitStack() as stack: # plain reads rather than maps, whose pages would all stay resident
+            index_file = stack.enter_context(open(os.path.join(self.path(symbol), ColumnarStorage.INDEX_FILE), 'rb'))
+            files = {column: stack.enter_context(open(self.__column_path(symbol, column), 'rb')) for column in columns}
+            for first in range(0, n_rows, chunk_rows):
+                count = min(chunk_rows, n_rows - first)
+                chunk_index = pd.DatetimeIndex(np.fromfile(index_file, dtype=np.int64, count=count).view('datetime64[ns]'), name='datetime')
+                yield pd.DataFrame({column: np.fromfile(f, dtype=np.float64, count=count) for column, f in files.items()}, index=chunk_index)
+
+
+class PartitionedStorage(Storage):
+    """
+    One folder per symbol, with one subfolder per calendar month of data (per day with
+    DailyPartitionedStorage). Each partition holds compressed chunks (.npz, with the index
+    as int64 nanoseconds and every data column as float64, as in ColumnarStorage); every
+    append adds a chunk to each partition that it reaches into, and 'compact' merges them.
+
+        <symbol>.part/
+            _meta.json                              -- column names, in order
+            _size                                   -- bytes of the meta and chunks, kept up to date by every change
+            2024-05/                                -- partition
+                <first ns>-<last ns>-<rows>.npz     -- chunk, named after its first and last datetime (zero-padded) and row count
+
+    Chunks are written to a temporary file and renamed into place, so a chunk is either
+    complete or missing. The size is updated before each chunk is renamed or removed, so
+    that after a crash it differs from the size in the manifest, and the symbol is scanned
+    (and repaired) instead of trusted. Row counts and first/last datetimes are read off the names, and
+    a read only opens the chunks that overlap the requested range. Dropping old data
+    removes whole partitions, without touching the rest.
+    """
+
+    PERIOD = 'M' # numpy datetime unit of a partition
+    META_FILE = '_meta.json'
+    SIZE_FILE = '_size'
+    COMPACT_MIN_CHUNKS = 16 # chunks in the latest partition before it is compacted; earlier partitions are compacted down to a single chunk
+
+    def __init__(self, data_dir: str):
+        super().__init__(data_dir)
+        self.__unsynced = {} # symbol: chunk files and folders written since the last sync
+        self.__lock = threading.Lock()
+        return
+
+    def __getstate__(self) -> Dict:
+        # sent to worker processes (e.g. with its bound 'encode'); the lock can't be pickled, and the files
+        # still to be synced are this process's to sync
+        state = self.__dict__.copy()
+        del state['_PartitionedStorage__lock'], state['_PartitionedStorage__unsynced']
+        return state
+
+    def __setstate__(self, state: Dict):
+        self.__dict__.update(state)
+        self.__unsynced = {}
+        self.__lock = threading.Lock()
+        return
+
+    def path(self, symbol: str) -> str:
+        return os.path.join(self.data_dir, '{}.part'.format(symbol))
+
+    def columns(self, symbol: str) -> List[str]:
+        with open(os.path.join(self.path(symbol), PartitionedStorage.META_FILE), 'r') as f:
+            return json.load(f)['columns']
+
+    def partition_of(self, epoch_ns: np.ndarray) -> np.ndarray:
+        """Name of the partition (e.g. '2024-05') of each datetime, given as int64 nanoseconds.
+        """
+        return np.datetime_as_string(epoch_ns.view('datetime64[ns]').astype('datetime64[{}]'.format(self.PERIOD)))
+
+    def __partition_of(self, dtime: dt.datetime) -> str:
+        return str(self.partition_of(np.array([pd.Timestamp(dtime).value], dtype=np.int64))[0])
+
+    def partitions(self, symbol: str) -> List[str]:
+        """Names of the symbol's partitions, in chronological order.
+        """
+        return sorted(entry.name for entry in os.scandir(self.path(symbol)) if entry.is_dir())
+
+    @staticmethod
+    def __parse_chunk(name: str):
+        first, last, n_rows = name[:-len('.npz')].split('-')
+        return int(first), int(last), int(n_rows)
+
+    def __chunks(self, symbol: str, partition: str) -> List[tuple]:
+        """(first ns, last ns, rows, path) of each chunk of the partition, ordered by first datetime.
+        """
+
+        folder = os.path.join(self.path(symbol), partition)
+        names = sorted(name for name in os.listdir(folder) if name.endswith('.npz'))
+        return [PartitionedStorage.__parse_chunk(name) + (os.path.join(folder, name),) for name in names]
+
+    def __scan_size(self, symbol: str) -> int:
+        n_bytes = os.path.getsize(os.path.join(self.path(symbol), PartitionedStorage.META_FILE))
+        for partition in self.partitions(symbol):
+            n_bytes += sum(os.path.getsize(chunk[3]) for chunk in self.__chunks(symbol, partition))
+        return n_bytes
+
+    def size(self, symbol: str) -> int:
+        try:
+            with open(os.path.join(self.path(symbol), PartitionedStorage.SIZE_FILE), 'r') as f:
+                return int(f.read())
+        except (OSError, ValueError): # written before sizes were kept; found by scanning every partition
+            return self.__scan_size(symbol)
+
+    def __save_size(self, symbol: str, n_bytes: int):
+        size_path = os.path.join(self.path(symbol), PartitionedStorage.SIZE_FILE)
+        with open(size_path + '.tmp', 'w') as f:
+            f.write(str(n_bytes))
+        os.replace(size_path + '.tmp', size_path)
+        return
+
+    def __resize(self, symbol: str, delta: int):
+        if delta != 0:
+            self.__save_size(symbol, self.size(symbol) + delta)
+        return
+
+    def __remove_chunks(self, symbol: str, file_paths: List[str]):
+        self.__resize(symbol, -sum(os.path.getsize(file_path) for file_path in file_paths))
+        for file_path in file_paths:
+            os.remove(file_path)
+        return
+
+    def __remove_partition(self, symbol: str, partition: str):
+        self.__resize(symbol, -sum(os.path.getsize(chunk[3]) for chunk in self.__chunks(symbol, partition)))
+        shutil.rmtree(os.path.join(self.path(symbol), partition))
+        return
+
+    def n_rows(self, symbol: str) -> int:
+        return sum(chunk[2] for partition in self.partitions(symbol) for chunk in self.__chunks(symbol, partition))
+
+    def first_dtime(self, symbol: str) -> Optional[dt.datetime]:
+        for partition in self.partitions(symbol):
+            chunks = self.__chunks(symbol, partition)
+            if len(chunks) > 0:
+                return pd.Timestamp(chunks[0][0]).to_pydatetime()
+        return None
+
+    def last_dtime(self, symbol: str) -> Optional[dt.datetime]:
+        for partition in reversed(self.partitions(symbol)):
+            chunks = self.__chunks(symbol, partition)
+            if len(chunks) > 0:
+                return pd.Timestamp(max(chunk[1] for chunk in chunks)).to_pydatetime()
+        return None
+
+    def __write_chunk(self, symbol: str, partition: str, index: np.ndarray, columns: Dict[str, np.ndarray]) -> str:
+        folder = os.path.join(self.path(symbol), partition)
+        os.makedirs(folder, exist_ok=True)
+        if index[0] < 0:
+            raise ValueError('Datetimes before 1970 can not be partitioned ({}).'.format(symbol))
+        file_path = os.path.join(folder, '{:020d}-{:020d}-{}.npz'.format(index[0], index[-1], len(index)))
+        with open(file_path + '.tmp', 'wb') as f:
+            np.savez_compressed(f, datetime=index, **columns)
+        self.__resize(symbol, os.path.getsize(file_path + '.tmp') - (os.path.getsize(file_path) if os.path.exists(file_path) else 0))
+        os.replace(file_path + '.tmp', file_path)
+        with self.__lock:
+            self.__unsynced.setdefault(symbol, set()).update([file_path, folder])
+        return file_path
+
+    def __append_columns(self, symbol: str, index: np.ndarray, columns: Dict[str, np.ndarray]):
+        partitions = self.partition_of(index)
+        bounds = np.flatnonzero(partitions[1:] != partitions[:-1]) + 1 # the index is sorted, so each partition's rows are contiguous
+        for first, last in zip(np.concatenate([[0], bounds]), np.concatenate([bounds, [len(index)]])):
+            if last > first:
+                self.__write_chunk(symbol, partitions[first], index[first:last], {column: values[first:last] for column, values in columns.items()})
+        return
+
+    @staticmethod
+    def __to_arrays(data: pd.DataFrame, columns: List[str]):
+        return ColumnarStorage.to_epoch_ns(data.index), {column: np.ascontiguousarray(data[column], dtype=np.float64) for column in columns}
+
+    def write(self, symbol: str, data: pd.DataFrame):
+        self.remove(symbol)
+        os.makedirs(self.path(symbol))
+        meta_path = os.path.join(self.path(symbol), PartitionedStorage.META_FILE)
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump({'columns': [str(c) for c in data.columns]}, f)
+        self.__save_size(symbol, os.path.getsize(meta_path + '.tmp'))
+        os.replace(meta_path + '.tmp', meta_path)
+        data = data.set_axis([str(c) for c in data.columns], axis=1)
+        self.__append_columns(symbol, *PartitionedStorage.__to_arrays(data, list(data.columns)))
+        with self.__lock:
+            self.__unsynced.setdefault(symbol, set()).update([self.path(symbol), self.data_dir])
+        return
+
+    def append(self, symbol: str, data: pd.DataFrame):
+        columns = self.columns(symbol)
+        if sorted(str(c) for c in data.columns) != sorted(columns):
+            raise ValueError('Columns {} do not match the stored columns {} of {}.'.format(list(data.columns), columns, symbol))
+        data = data.set_axis([str(c) for c in data.columns], axis=1)
+        self.__append_columns(symbol, *PartitionedStorage.__to_arrays(data, columns))
+        return
+
+    def sync(self, symbol: str):
+        with self.__lock:
+            paths = self.__unsynced.pop(symbol, set())
+        for file_path in sorted(paths, key=len, reverse=True): # chunks before the folders that they were renamed into
+            try:
+                fd = os.open(file_path, os.O_RDONLY)
+            except FileNotFoundError: # merged or dropped since
+                continue
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        return
+
+    def repair(self, symbol: str) -> bool:
+        if not os.path.exists(os.path.join(self.path(symbol), PartitionedStorage.META_FILE)): # the symbol's first write never got going
+            self.remove(symbol)
+            return True
+
+        # chunks are renamed into place whole, so an interrupted write can only leave temporary files behind, or (if
+        # compaction was interrupted) both a merged chunk and the chunks that it merged; the merged one covers them
+        repaired = False
+        for partition in self.partitions(symbol):
+            folder = os.path.join(self.path(symbol), partition)
+            for name in os.listdir(folder):
+                if name.endswith('.tmp'):
+                    os.remove(os.path.join(folder, name))
+                    repaired = True
+            covered_until = None
+            for first, last, _, file_path in sorted(self.__chunks(symbol, partition), key=lambda chunk: (chunk[0], -chunk[1])):
+                if covered_until is not None and last <= covered_until:
+                    os.remove(file_path)
+                    repaired = True
+                else:
+                    covered_until = last
+
+        n_bytes = self.__scan_size(symbol)
+        if n_bytes != self.size(symbol): # the write was interrupted between updating the size and renaming (or removing) a chunk
+            self.__save_size(symbol, n_bytes)
+            repaired = True
+        return repaired
+
+    @staticmethod
+    def __load_chunk(file_path: str, columns: List[str]):
+        with np.load(file_path) as chunk: # only the requested arrays are decompressed
+            return chunk['datetime'], {column: chunk[column] for column in columns}
+
+    def __rewrite_chunk(self, symbol: str, partition: str, file_path: str, keep) -> int:
+        """Replace a chunk with the rows of it for which keep(index) is True.
+
+        Returns:
+            int -- Number of rows dropped.
+        """
+
+        index, columns = PartitionedStorage.__load_chunk(file_path, self.columns(symbol))
+        mask = keep(index)
+        if mask.any():
+            new_path = self.__write_chunk(symbol, partition, index[mask], {column: values[mask] for column, values in columns.items()})
+            if new_path == file_path:
+                return 0
+        self.__remove_chunks(symbol, [file_path])
+        return int(len(index) - mask.sum())
+
+    def truncate_from(self, symbol: str, start: dt.datetime):
+        start_ns, start_partition = pd.Timestamp(start).value, self.__partition_of(start)
+        for partition in self.partitions(symbol):
+            if partition > start_partition:
+                self.__remove_partition(symbol, partition)
+            elif partition == start_partition:
+                for first, last, _, file_path in self.__chunks(symbol, partition):
+                    if first >= start_ns:
+                        self.__remove_chunks(symbol, [file_path])
+                    elif last >= start_ns:
+                        self.__rewrite_chunk(symbol, partition, file_path, lambda index: index < start_ns)
+        return
+
+    def drop_before(self, symbol: str, start: dt.datetime) -> int:
+        start_ns, start_partition = pd.Timestamp(start).value, self.__partition_of(start)
+        n_dropped = 0
+        for partition in self.partitions(symbol):
+            if partition < start_partition:
+                n_dropped += sum(chunk[2] for chunk in self.__chunks(symbol, partition))
+                self.__remove_partition(symbol, partition) # no need to read, or rewrite, anything
+            elif partition == start_partition:
+                for first, last, n_rows, file_path in self.__chunks(symbol, partition):
+                    if last < start_ns:
+                        self.__remove_chunks(symbol, [file_path])
+                        n_dropped += n_rows
+                    elif first < start_ns:
+                        n_dropped += self.__rewrite_chunk(symbol, partition, file_path, lambda index: index >= start_ns)
+        return n_dropped
+
+    def compact(self, symbol: str) -> int:
+        """
+        Merge the chunks of each partition into one; in the latest partition, which updates are still
+        appending to, only once it has COMPACT_MIN_CHUNKS chunks, so that each row is only rewritten a
+        few times. Appends may go on meanwhile: only the chunks that were there to begin with are merged.
+        """
+
+        columns = self.columns(symbol)
+        partitions = self.partitions(symbol)
+        n_merged = 0
+        for i, partition in enumerate(partitions):
+            chunks = self.__chunks(symbol, partition)
+            if len(chunks) < (PartitionedStorage.COMPACT_MIN_CHUNKS if i == len(partitions) - 1 else 2):
+                continue
+            loaded = [PartitionedStorage.__load_chunk(chunk[3], columns) for chunk in chunks]
+            index = np.concatenate([chunk_index for chunk_index, _ in loaded])
+            order = np.argsort(index, kind='stable') # chunks are ordered by first datetime already, so this is a no-op unless they overlap
+            self.__write_chunk(symbol, partition, index[order], {column: np.concatenate([values[column] for _, values in loaded])[order] for column in columns})
+            self.__remove_chunks(symbol, [chunk[3] for chunk in chunks])
+            n_merged += len(chunks) - 1
+        return n_merged
+
+    def read_range(self, symbol: str, start: dt.datetime = None, end: dt.datetime = None, columns: List[str] = None) -> pd.DataFrame:
+        columns = self.columns(symbol) if columns is None else list(columns)
+        start_ns = None if start is None else pd.Timestamp(start).value
+        end_ns = None if end is None else pd.Timestamp(end).value
+        start_partition = None if start is None else self.__partition_of(start)
+        end_partition = None if end is None else self.__partition_of(end)
+
+        indexes, values = [], {column: [] for column in columns}
+        for partition in self.partitions(symbol):
+            if (start_partition is not None and partition < start_partition) or (end_partition is not None and partition > end_partition):
+                continue
+            for first, last, _, file_path in self.__chunks(symbol, partition):
+                if (start_ns is not None and last < start_ns) or (end_ns is not None and first > end_ns):
+                    continue
+                index, chunk_values = PartitionedStorage.__load_chunk(file_path, columns)
+                lo = 0 if start_ns is None else np.searchsorted(index, start_ns, side='left')
+                hi = len(index) if end_ns is None else np.searchsorted(index, end_ns, side='right')
+                indexes.append(index[lo:hi])
+                for column in columns:
+                    values[column].append(chunk_values[column][lo:hi])
+
+        index = np.concatenate(indexes) if len(indexes) > 0 else np.empty(0, dtype=np.int64)
+        index = pd.DatetimeIndex(index.view('datetime64[ns]'), name='datetime')
+        return pd.DataFrame({column: np.concatenate(arrays) if len(arrays) > 0 else np.empty(0) for column, arrays in values.items()}, index=index)
+
+    def iter_chunks(self, symbol: str, chunk_rows: int) -> Iterator[pd.DataFrame]:
+        columns = self.columns(symbol)
+        for partition in self.partitions(symbol):
+            for chunk in self.__chunks(symbol, partition): # at most a partition's worth of rows is decompressed at a time
+                index, values = PartitionedStorage.__load_chunk(chunk[3], columns)
+                for first in range(0, len(index), chunk_rows):
+                    last = first + chunk_rows
+                    chunk_index = pd.DatetimeIndex(index[first:last].view('datetime64[ns]'), name='datetime')
+                    yield pd.DataFrame({column: values[column][first:last] for column in columns}, index=chunk_index)
+
+
+class DailyPartitionedStorage(PartitionedStorage):
+    """PartitionedStorage with one partition per calendar day.
+    """
+
+    PERIOD = 'D'
+
+
+STORAGE_FORMATS = {
+    'csv': CsvStorage,
+    'columnar': ColumnarStorage,
+    'partitioned': PartitionedStorage,
+    'partitioned_daily': DailyPartitionedStorage,
+}
@@ -0,0 +1,108 @@
+"""
+In-process subscriptions to newly stored bars, so that consumers (signal jobs,
+dashboards) can process each batch as soon as an update commits it, instead of
+polling and re-reading the symbol files.
+
+The update publishes from its worker threads; each subscriber has its own bounded
+buffer on its own event loop. When a buffer is full, the subscriber's policy decides
+what happens:
+
+    'drop'  -- the oldest buffered batch is dropped (and counted), so a slow subscriber
+               falls behind on history but never holds up the update
+    'block' -- the update's writer waits until the subscriber catches up
+"""
+
+import asyncio
+import threading
+from typing import Iterable, NamedTuple, Optional
+import pandas as pd
+
+
+class BarBatch(NamedTuple):
+    symbol: str
+    status: str # how the bars were stored: 'CREATED', 'APPENDED', 'REVISED' (stored rows replaced, from the first changed one on), 'FILLED' (rows inserted inside the stored data), or 'REPLAY'
+    data: pd.DataFrame # the bars, with datetime index in ascending order
+
+
+class Subscription:
+    POLICIES = ('drop', 'block')
+
+    def __init__(self, symbols: Optional[Iterable[str]], buffer_size: int, policy: str, loop: asyncio.AbstractEventLoop):
+        """
+        Arguments:
+            symbols {Optional[Iterable[str]]} -- Symbols to receive batches of; if None, then every symbol.
+            buffer_size {int} -- Most batches buffered for this subscriber.
+            policy {str} -- What to do when the buffer is full; see POLICIES.
+            loop {asyncio.AbstractEventLoop} -- Event loop that the subscriber consumes on.
+        """
+
+        assert policy in Subscription.POLICIES, 'Policy "{}" is not valid.'.format(policy)
+        assert buffer_size >= 1, 'The buffer must hold at least one batch.'
+
+        self.symbols = None if symbols is None else set(symbols)
+        self.policy = policy
+        self.queue = asyncio.Queue(maxsize=buffer_size)
+        self.dropped = 0 # batches dropped under the 'drop' policy
+        self.__loop = loop
+        return
+
+    def wants(self, symbol: str) -> bool:
+        return self.symbols is None or symbol in self.symbols
+
+    def __put_or_drop(self, batch: BarBatch):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(batch)
+        return
+
+    def offer(self, batch: BarBatch):
+        """Hand a batch to the subscriber; may be called from any thread.
+        """
+
+        try:
+            on_loop = asyncio.get_running_loop() is self.__loop
+        except RuntimeError: # no loop is running on this thread
+            on_loop = False
+
+        try:
+            if self.policy == 'drop':
+                if on_loop:
+                    self.__put_or_drop(batch)
+                else:
+                    self.__loop.call_soon_threadsafe(self.__put_or_drop, batch)
+            elif on_loop: # the loop can't wait on itself, so the put finishes in the background
+                self.__loop.create_task(self.queue.put(batch))
+            else:
+                asyncio.run_coroutine_threadsafe(self.queue.put(batch), self.__loop).result()
+        except RuntimeError: # the subscriber's loop was closed
+            pass
+        return
+
+
+class Publisher:
+
+    def __init__(self):
+        self.__subscriptions = set() # subscriptions that batches are handed to
+        self.__lock = threading.Lock()
+        return
+
+    def add(self, subscription: Subscription):
+        with self.__lock:
+            self.__subscriptions.add(subscription)
+        return
+
+    def remove(self, subscription: Subscription):
+        with self.__lock:
+            self.__subscriptions.discard(subscription)
+        return
+
+    def publish(self, batch: BarBatch):
+        """Hand a batch to every subscriber of its symbol.
+        """
+
+        with self.__lock:
+            subscriptions = [subscription for subscription in self.__subscriptions if subscription.wants(batch.symbol)]
+        for subscription in subscriptions:
+            subscription.offer(batch)
+        return
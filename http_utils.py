@@ -0,0 +1,307 @@
+"""
+Connection-pooled HTTP client shared by the data sources.
+
+The synchronous methods run on a keep-alive requests.Session. The asynchronous
+methods use aiohttp when it is installed, and otherwise run the same pooled
+session on a thread pool, so that many requests can be in flight at once
+without blocking the event loop.
+
+Each client can pace its requests with an AdaptiveRateLimiter, and retries
+requests that were throttled (HTTP 429), failed on the server's side (5xx), or
+timed out, after a jittered exponential backoff. The limiter slows down whenever
+the API shows signs of overload (429 or 503 responses, timeouts, or rising latency),
+so a run settles just under the API's real limit instead of failing.
+
+Instruments (e.g. RunMetrics.http) can be added to a client to time its requests;
+each one is called with the url and must return a context manager that yields a
+dict, which the client fills in with the response's 'status' and 'bytes', and
+the 'attempt' (0 for the first try).
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import contextvars
+import json
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import aiohttp
+except ImportError: # aiohttp is optional
+    aiohttp = None
+
+
+class AdaptiveRateLimiter:
+
+    def __init__(self, rate: float, max_rate: float = None, min_rate: float = .5, increase: float = 1., decrease: float = .5,
+                    latency_factor: float = 2.5, cooldown: float = 1.):
+        """
+        Paces requests at a rate that is found by additive increase, multiplicative decrease (AIMD):
+        the rate grows by `increase` requests per second for every second of successful requests,
+        and is multiplied by `decrease` whenever a request is throttled or the latency rises well
+        above its usual level. Safe to share between threads and coroutines.
+
+        Arguments:
+            rate {float} -- Initial number of requests per second.
+            max_rate {float} -- Most requests per second; if None, then no limit besides the API's. (default: {None})
+            min_rate {float} -- Fewest requests per second. (default: {.5})
+            increase {float} -- Requests per second added for each second of successful requests. (default: {1.})
+            decrease {float} -- Factor that the rate is multiplied by on throttling. (default: {.5})
+            latency_factor {float} -- Recent latency above this multiple of the long-run latency counts
+                                        as throttling. (default: {2.5})
+            cooldown {float} -- Seconds after a decrease during which the rate isn't decreased again, since
+                                    the requests that were already in flight are likely to fail too. (default: {1.})
+        """
+
+        assert rate > 0 and min_rate > 0, 'Rates must be positive.'
+        assert 0 < decrease < 1, 'Decrease must be between 0 and 1.'
+
+        self.rate = float(rate)
+        self.max_rate = float(max_rate) if max_rate else float('inf')
+        self.min_rate = float(min_rate)
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.cooldown = cooldown
+        self.n_throttled = 0
+
+        self.__lock = threading.Lock()
+        self.__next_slot = 0. # monotonic time at which the next request may be sent
+        self.__latency = None # recent latency (fast exponentially weighted moving average)
+        self.__baseline = None # long-run latency (slow exponentially weighted moving average)
+        self.__last_decrease = 0.
+        return
+
+    def reserve(self) -> float:
+        """Reserve the next free slot for a request.
+
+        Returns:
+            float -- Seconds to wait until the slot.
+        """
+
+        with self.__lock:
+            now = time.monotonic()
+            slot = max(now, self.__next_slot)
+            self.__next_slot = slot + 1./self.rate
+        return slot - now
+
+    def wait(self) -> float:
+        delay = self.reserve()
+        time.sleep(delay)
+        return delay
+
+    async def wait_async(self) -> float:
+        delay = self.reserve()
+        await asyncio.sleep(delay)
+        return delay
+
+    def __decrease(self):
+        now = time.monotonic()
+        if now - self.__last_decrease >= self.cooldown:
+            self.rate = max(self.min_rate, self.rate*self.decrease)
+            self.__last_decrease = now
+            self.__next_slot = max(self.__next_slot, now + 1./self.rate) # pause briefly, so that the API can recover
+        return
+
+    def on_success(self, latency: float):
+        with self.__lock:
+            self.__latency = latency if self.__latency is None else .8*self.__latency + .2*latency
+            self.__baseline = latency if self.__baseline is None else .98*self.__baseline + .02*latency
+
+            if self.__latency > self.latency_factor*self.__baseline:
+                self.__decrease()
+            else:
+                self.rate = min(self.max_rate, self.rate + self.increase/self.rate)
+        return
+
+    def on_throttle(self):
+        with self.__lock:
+            self.n_throttled += 1
+            self.__decrease()
+        return
+
+
+class HttpClient:
+    RETRY_STATUSES = {429, 500, 502, 503, 504} # throttled, or failed on the server's side
+    THROTTLE_STATUSES = {429, 503} # the server is overloaded, so requests should slow down
+
+    def __init__(self, pool_size: int = 100, max_concurrency: int = 100, timeout: float = 30., rate_limiter: AdaptiveRateLimiter = None,
+                    max_retries: int = 4, backoff: float = .5):
+        """
+        Arguments:
+            pool_size {int} -- Maximum number of keep-alive connections kept open per host.
+            max_concurrency {int} -- Maximum number of asynchronous requests in flight at once.
+            timeout {float} -- Per-request timeout, in seconds.
+            rate_limiter {AdaptiveRateLimiter} -- Paces the requests; if None, then they aren't paced.
+            max_retries {int} -- Number of times a throttled, failed, or timed out request is retried.
+            backoff {float} -- Seconds waited before the first retry; doubled (with jitter) for every further retry.
+        """
+
+        self.pool_size = pool_size
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        # asyncio objects are bound to the loop that created them, so they are made lazily per loop
+        self.__loop = None
+        self.__semaphore = None
+        self.__async_session = None
+        self.__executor = None
+
+        self.instruments: List[Callable] = []
+
+        return
+
+    def add_instrument(self, instrument: Callable):
+        if instrument not in self.instruments:
+            self.instruments.append(instrument)
+        return
+
+    def __retry_delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        delay = self.backoff*(2**attempt)*random.uniform(.5, 1.5) # jitter, so that retries don't arrive in bursts
+        try:
+            return max(delay, float(retry_after or 0))
+        except ValueError: # Retry-After may also be an HTTP date
+            return delay
+
+    def __throttled(self):
+        if self.rate_limiter is not None:
+            self.rate_limiter.on_throttle()
+        return
+
+    def __succeeded(self, latency: float):
+        if self.rate_limiter is not None:
+            self.rate_limiter.on_success(latency)
+        return
+
+    def __request(self, url: str, params: Dict, parse: bool, retry_on: Callable = None):
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter is not None:
+                self.rate_limiter.wait()
+
+            start = time.monotonic()
+            try:
+                with contextlib.ExitStack() as stack:
+                    records = [stack.enter_context(instrument(url)) for instrument in self.instruments]
+                    response = self.session.get(url, params=params, timeout=self.timeout)
+                    for record in records:
+                        record.update(status=response.status_code, bytes=len(response.content), attempt=attempt)
+            except (requests.Timeout, requests.ConnectionError):
+                if attempt == self.max_retries:
+                    raise
+                self.__throttled()
+                time.sleep(self.__retry_delay(attempt))
+                continue
+
+            transient = response.status_code in HttpClient.RETRY_STATUSES
+            if not transient:
+                content = response.json() if parse else response
+                transient = parse and retry_on is not None and retry_on(content)
+                if not transient:
+                    self.__succeeded(time.monotonic() - start)
+                    return content
+            if attempt == self.max_retries: # give up, and leave the response to the caller
+                return response.json() if parse else response
+            if response.status_code in HttpClient.THROTTLE_STATUSES or response.status_code not in HttpClient.RETRY_STATUSES:
+                self.__throttled()
+            time.sleep(self.__retry_delay(attempt, response.headers.get('Retry-After')))
+
+    def get(self, url: str, params: Dict = None) -> requests.Response:
+        return self.__request(url, params, parse=False)
+
+    def get_json(self, url: str, params: Dict = None, retry_on: Callable[[Any], bool] = None) -> Any:
+        """
+        Arguments:
+            url {str}
+            params {Dict} -- Query parameters.
+            retry_on {Callable[[Any], bool]} -- Whether a decoded response is transient (e.g. an API that reports
+                                                throttling in the body); such responses are retried like a 429.
+        """
+        return self.__request(url, params, parse=True, retry_on=retry_on)
+
+    def __bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if loop is not self.__loop:
+            self.__loop = loop
+            self.__semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.__async_session = None
+        return
+
+    async def get_json_async(self, url: str, params: Dict = None, retry_on: Callable[[Any], bool] = None) -> Any:
+        """Non-blocking version of get_json; at most max_concurrency of these run at once.
+        """
+
+        self.__bind_loop()
+        if aiohttp is None:
+            if self.__executor is None:
+                self.__executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+            async with self.__semaphore:
+                context = contextvars.copy_context() # the request is instrumented (e.g. attributed to a symbol) in the caller's context
+                return await self.__loop.run_in_executor(self.__executor, context.run, self.get_json, url, params, retry_on)
+
+        if self.__async_session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, limit_per_host=self.pool_size)
+            self.__async_session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        params = {k: str(v) for k, v in (params or {}).items()} # aiohttp only accepts string params
+
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter is not None:
+                await self.rate_limiter.wait_async()
+
+            start = time.monotonic()
+            try:
+                async with self.__semaphore:
+                    with contextlib.ExitStack() as stack:
+                        records = [stack.enter_context(instrument(url)) for instrument in self.instruments]
+                        async with self.__async_session.get(url, params=params) as resp:
+                            body = await resp.read()
+                            status, retry_after = resp.status, resp.headers.get('Retry-After')
+                            for record in records:
+                                record.update(status=status, bytes=len(body), attempt=attempt)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt == self.max_retries:
+                    raise
+                self.__throttled()
+                await asyncio.sleep(self.__retry_delay(attempt))
+                continue
+
+            transient = status in HttpClient.RETRY_STATUSES
+            if not transient:
+                content = json.loads(body)
+                transient = retry_on is not None and retry_on(content)
+                if not transient:
+                    self.__succeeded(time.monotonic() - start)
+                    return content
+            if attempt == self.max_retries: # give up, and leave the response to the caller
+                return json.loads(body)
+            if status in HttpClient.THROTTLE_STATUSES or status not in HttpClient.RETRY_STATUSES:
+                self.__throttled()
+            await asyncio.sleep(self.__retry_delay(attempt, retry_after))
+
+    async def aclose(self):
+        """Close the asynchronous session; call this before the event loop that used it exits.
+        """
+
+        if self.__async_session is not None:
+            await self.__async_session.close()
+            self.__async_session = None
+        return
+
+    def close(self):
+        self.session.close()
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=False)
+            self.__executor = None
+        return
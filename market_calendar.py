@@ -0,0 +1,133 @@
+"""
+NYSE trading calendar: weekends, the exchange's full-day holidays, and the
+special closings, so that requests for market data can skip days on which
+the market was closed.
+
+Holidays follow the NYSE's observance rules: a holiday that falls on a Sunday
+is observed on the Monday after it, and one that falls on a Saturday is observed
+on the Friday before it, except for New Year's Day, which is then not observed.
+Early closes are treated as regular trading days.
+
+Dates are compared as calendar dates; datetimes are taken to be in the
+exchange's time zone.
+"""
+
+import datetime
+from functools import lru_cache
+from typing import FrozenSet, List, Tuple
+
+SPECIAL_CLOSINGS = frozenset([ # unscheduled full-day closings
+    datetime.date(2001, 9, 11), datetime.date(2001, 9, 12), datetime.date(2001, 9, 13), datetime.date(2001, 9, 14), # September 11
+    datetime.date(2004, 6, 11), # President Reagan's funeral
+    datetime.date(2007, 1, 2), # President Ford's funeral
+    datetime.date(2012, 10, 29), datetime.date(2012, 10, 30), # Hurricane Sandy
+    datetime.date(2018, 12, 5), # President Bush's funeral
+    datetime.date(2025, 1, 9), # President Carter's funeral
+])
+
+
+def easter(year: int) -> datetime.date:
+    """Western (Gregorian) Easter Sunday, by the anonymous Gregorian algorithm.
+    """
+
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8)//25
+    g = (b - f + 1)//3
+    h = (19*a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2*e + 2*i - h - k) % 7
+    m = (a + 11*h + 22*l)//451
+    month, day = divmod(h + l - 7*m + 114, 31)
+    return datetime.date(year, month, day + 1)
+
+
+def __nth_weekday(year: int, month: int, weekday: int, n: int) -> datetime.date:
+    """The n-th (1-based) given weekday (0 is Monday) of the month; n = -1 for the last one.
+    """
+
+    if n > 0:
+        first = datetime.date(year, month, 1)
+        return first + datetime.timedelta(days=(weekday - first.weekday()) % 7 + 7*(n - 1))
+    last = datetime.date(year + month//12, month % 12 + 1, 1) - datetime.timedelta(days=1)
+    return last - datetime.timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def __observed(date: datetime.date) -> datetime.date:
+    if date.weekday() == 5: # Saturday
+        return date - datetime.timedelta(days=1)
+    if date.weekday() == 6: # Sunday
+        return date + datetime.timedelta(days=1)
+    return date
+
+
+@lru_cache(maxsize=None)
+def holidays(year: int) -> FrozenSet[datetime.date]:
+    """Full-day NYSE holidays (as observed) and special closings of the given year.
+    """
+
+    days = {
+        __nth_weekday(year, 2, 0, 3), # Washington's Birthday
+        easter(year) - datetime.timedelta(days=2), # Good Friday
+        __nth_weekday(year, 5, 0, -1), # Memorial Day
+        __observed(datetime.date(year, 7, 4)), # Independence Day
+        __nth_weekday(year, 9, 0, 1), # Labor Day
+        __nth_weekday(year, 11, 3, 4), # Thanksgiving Day
+        __observed(datetime.date(year, 12, 25)), # Christmas Day
+    }
+
+    new_year = datetime.date(year, 1, 1)
+    if new_year.weekday() != 5: # not observed on the Friday before, since that is in the previous year
+        days.add(__observed(new_year))
+    if year >= 1998:
+        days.add(__nth_weekday(year, 1, 0, 3)) # Martin Luther King Jr. Day
+    if year >= 2022:
+        days.add(__observed(datetime.date(year, 6, 19))) # Juneteenth
+
+    days.update(date for date in SPECIAL_CLOSINGS if date.year == year)
+    return frozenset(days)
+
+
+def is_trading_day(date: datetime.date) -> bool:
+    return date.weekday() < 5 and date not in holidays(date.year)
+
+
+def trading_days(start: datetime.date, end: datetime.date) -> List[datetime.date]:
+    """Trading days with start <= date <= end.
+    """
+
+    n_days = (end - start).days + 1
+    days = (start + datetime.timedelta(days=i) for i in range(max(0, n_days)))
+    return [date for date in days if is_trading_day(date)]
+
+
+def trading_windows(start: datetime.datetime, end: datetime.datetime, max_days: int) -> List[Tuple[datetime.datetime, datetime.datetime]]:
+    """
+    Split a range into windows that together cover every trading day in it. Each window
+    spans at most max_days calendar days, starts and ends on a trading day, and is clipped
+    to the range. Ranges without trading days get no window at all.
+
+    Arguments:
+        start {datetime.datetime} -- Start of the range.
+        end {datetime.datetime} -- End of the range (inclusive).
+        max_days {int} -- Most calendar days that a window may touch.
+
+    Returns:
+        List[Tuple[datetime.datetime, datetime.datetime]] -- (start, end) of each window, oldest first.
+    """
+
+    groups = []
+    for date in trading_days(start.date(), end.date()):
+        if len(groups) > 0 and (date - groups[-1][0]).days < max_days:
+            groups[-1][1] = date
+        else:
+            groups.append([date, date])
+
+    windows = []
+    for first, last in groups:
+        window_start = max(start, datetime.datetime.combine(first, datetime.time.min))
+        window_end = min(end, datetime.datetime.combine(last, datetime.time.max))
+        if window_start <= window_end:
+            windows.append((window_start, window_end))
+    return windows
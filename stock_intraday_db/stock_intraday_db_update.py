@@ -11,22 +11,59 @@ from config import api_key, STOCK_NAME_FILE_PATH, DATA_FILE_PATH, LOG_FILE_PATH
 
 
 class StockIntradayDB(DB_Base):
+    REQ_PER_SEC_CAP = PriceHistory.req_per_sec_cap()
+    REFRESH_SECONDS = 5*60 # a pass over the whole universe takes a few minutes at the API's rate limit
+
+    def http_clients(self) -> list:
+        return [PriceHistory.shared_client()]
+
     # Implement method for getting data
     def get_data(self, symbol: str, start: dt.datetime, end: dt.datetime, new_data: bool) -> pd.DataFrame:
-        ph = PriceHistory(api_key)
+        ph = PriceHistory(api_key, cache=self.response_cache)
         if new_data: # do a max-data-pull
             return ph.max_minute_data(symbol)
         else: # only get necessary data
             return ph.minute_data(symbol, start, end)
         return
 
+    async def fetch_raw(self, symbol: str, start: dt.datetime, end: dt.datetime, new_data: bool):
+        ph = PriceHistory(api_key, cache=self.response_cache)
+        if new_data: # do a max-data-pull
+            start = PriceHistory.max_minute_start()
+            return await ph._minute_data_all_async(symbol, start, need_extended_hours=True), (start,)
+        else: # only get necessary data
+            return await ph._minute_data_all_async(symbol, start, end), (start,)
+
+    @staticmethod
+    def decode_raw(json_dict: dict, start: dt.datetime) -> pd.DataFrame:
+        price_data = PriceHistory.json_dict_to_df(json_dict)
+        return price_data[price_data.index >= start]
+
 if __name__ == '__main__':
     '''
     Arguments (in order):
         -s [symbol_file_path]
         -d [data_file_path]
         -l [log_file_path]
+        -w [max_workers] (keyword only)
+        -f [storage] (keyword only; 'csv', 'columnar', 'partitioned' or 'partitioned_daily')
+        -r [rollups] (keyword only; comma-separated, e.g. 5m,15m,1h,1d)
+        -p [panel_fields] (keyword only; comma-separated, e.g. close,volume)
+        -m [metrics_file_path] (keyword only)
+        -j [decode_workers] (keyword only; number of decoding processes, for pipelined updates)
+        -g [fill_gaps] (keyword only; 1 to fill in gaps inside the stored data)
+        -c [cache_dir] (keyword only; folder to cache API responses in)
+        -e [refresh_seconds] (keyword only; run as a daemon that refreshes each symbol this often)
+        -x [features] (keyword only; comma-separated, e.g. log_return,vwap_30,volatility_30)
+        -k [shard] (keyword only; e.g. 0/4 to run as the first of 4 workers that share the data folder)
+        -t [steal_work] (keyword only; 0 to keep a sharded worker to its own shard)
+        -n [retention_days] (keyword only; drop rows older than this many days after each update, panels included)
+        -o [overlap_minutes] (keyword only; fetch this many minutes before the last stored row again, and replace revised bars)
     '''
     args_dict = parse_args(STOCK_NAME_FILE_PATH, DATA_FILE_PATH, LOG_FILE_PATH)
-    StockIntradayDB(**args_dict).update()
+    db = StockIntradayDB(**args_dict)
+    if 'refresh_seconds' in args_dict: # stay resident, and keep refreshing the symbols
+        db.run_daemon()
+    else:
+        db.update()
 
@@ -0,0 +1,13 @@
+"""
+Shared setup for the tests: the project, db, and benchmarks folders on the path,
+as the update scripts and benchmarks set them up for themselves.
+
+    python -m pytest tests
+"""
+
+import sys
+from pathlib import Path
+
+proj_path = Path(__file__).absolute().parent.parent
+for folder in (proj_path / 'benchmarks', proj_path / 'db', proj_path):
+    sys.path.insert(1, str(folder))
@@ -0,0 +1,102 @@
+"""
+Manifest: replaying the log on top of the snapshot, and folding it into a new snapshot.
+"""
+
+import datetime as dt
+import json
+import os
+from manifest import Manifest
+
+LAST = dt.datetime(2024, 1, 2, 16, 0)
+
+
+def record(manifest, symbol, rows):
+    manifest.record(symbol, LAST + dt.timedelta(minutes=rows), rows, 10*rows, 'APPENDED')
+    return
+
+
+def read_snapshot(manifest):
+    with open(manifest.file_path, 'r') as f:
+        return json.load(f)
+
+
+def test_log_is_replayed(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    record(manifest, 'AAA', 1)
+    record(manifest, 'BBB', 2)
+    record(manifest, 'AAA', 3)
+    manifest.record_status('BBB', 'ERROR')
+    assert not os.path.exists(manifest.file_path) # nothing folded yet
+
+    reread = Manifest(str(tmp_path))
+    reread.load()
+    assert reread.entries() == manifest.entries()
+    assert reread.get('AAA').rows == 3
+    assert reread.get('BBB').status == 'ERROR'
+    assert reread.get('BBB').last_dtime == LAST + dt.timedelta(minutes=2)
+
+
+def test_compaction(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    for rows in range(Manifest.COMPACT_MIN_RECORDS + 1):
+        record(manifest, 'AAA', rows)
+
+    snapshot = read_snapshot(manifest)
+    assert snapshot['generation'] == 1
+    assert snapshot['symbols']['AAA']['rows'] == Manifest.COMPACT_MIN_RECORDS
+    with open(manifest.log_path, 'r') as f:
+        assert f.read().splitlines() == [json.dumps({'generation': 1})] # started over
+
+    record(manifest, 'BBB', 1)
+    reread = Manifest(str(tmp_path))
+    reread.load()
+    assert reread.entries() == manifest.entries()
+
+
+def test_stale_log_is_ignored(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    for rows in range(Manifest.COMPACT_MIN_RECORDS + 1):
+        record(manifest, 'AAA', rows)
+    with open(manifest.log_path, 'w') as f: # as if a crash came between writing the snapshot and starting the new log
+        f.write(json.dumps({'generation': 0}) + '\n')
+        f.write(json.dumps({'symbol': 'AAA', 'entry': {'last_dtime': None, 'rows': 0, 'bytes': 0, 'status': 'CREATED', 'updated': LAST.isoformat()}}) + '\n')
+
+    reread = Manifest(str(tmp_path))
+    reread.load()
+    assert reread.get('AAA').rows == Manifest.COMPACT_MIN_RECORDS
+
+    record(reread, 'BBB', 1) # starts a log of the snapshot's generation
+    again = Manifest(str(tmp_path))
+    again.load()
+    assert again.entries() == reread.entries()
+
+
+def test_torn_line(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    record(manifest, 'AAA', 1)
+    with open(manifest.log_path, 'ab') as f:
+        f.write(b'{"symbol": "BBB", "ent') # a crash in the middle of a record
+
+    reread = Manifest(str(tmp_path))
+    reread.load()
+    assert set(reread.entries()) == {'AAA'}
+
+    record(reread, 'CCC', 1) # goes on a line of its own
+    again = Manifest(str(tmp_path))
+    again.load()
+    assert set(again.entries()) == {'AAA', 'CCC'}
+
+
+def test_refresh_reads_what_others_recorded(tmp_path):
+    reader, writer = Manifest(str(tmp_path), shared=True), Manifest(str(tmp_path), shared=True)
+    reader.load()
+    assert not reader.refresh()
+
+    record(writer, 'AAA', 1)
+    assert reader.refresh()
+    assert reader.get('AAA').rows == 1
+
+    for rows in range(Manifest.COMPACT_MIN_RECORDS + 1): # folded into a new snapshot meanwhile
+        record(writer, 'BBB', rows)
+    assert reader.refresh()
+    assert reader.entries() == writer.entries()
@@ -0,0 +1,47 @@
+"""
+market_calendar: NYSE holidays, and splitting request ranges into windows of trading days.
+"""
+
+import datetime as dt
+from market_calendar import holidays, is_trading_day, trading_days, trading_windows
+
+
+def test_holidays():
+    assert holidays(2024) == {
+        dt.date(2024, 1, 1), dt.date(2024, 1, 15), dt.date(2024, 2, 19), dt.date(2024, 3, 29), dt.date(2024, 5, 27),
+        dt.date(2024, 6, 19), dt.date(2024, 7, 4), dt.date(2024, 9, 2), dt.date(2024, 11, 28), dt.date(2024, 12, 25),
+    }
+    assert dt.date(2021, 12, 31) not in holidays(2021) # New Year's Day on a Saturday isn't observed
+    assert dt.date(2022, 12, 26) in holidays(2022) # Christmas on a Sunday is observed on the Monday
+    assert dt.date(2026, 7, 3) in holidays(2026) # Independence Day on a Saturday is observed on the Friday
+    assert not is_trading_day(dt.date(2025, 1, 9)) # special closing
+
+
+def test_trading_days():
+    assert trading_days(dt.date(2024, 12, 23), dt.date(2025, 1, 3)) == [
+        dt.date(2024, 12, 23), dt.date(2024, 12, 24), dt.date(2024, 12, 26), dt.date(2024, 12, 27),
+        dt.date(2024, 12, 30), dt.date(2024, 12, 31), dt.date(2025, 1, 2), dt.date(2025, 1, 3),
+    ]
+    assert trading_days(dt.date(2024, 1, 3), dt.date(2024, 1, 2)) == []
+
+
+def test_windows_across_holidays():
+    start, end = dt.datetime(2024, 12, 20, 12, 0), dt.datetime(2025, 1, 6, 12, 0)
+    windows = trading_windows(start, end, 5)
+    assert windows == [
+        (start, dt.datetime.combine(dt.date(2024, 12, 24), dt.time.max)),
+        (dt.datetime(2024, 12, 26), dt.datetime.combine(dt.date(2024, 12, 30), dt.time.max)),
+        (dt.datetime(2024, 12, 31), dt.datetime.combine(dt.date(2025, 1, 3), dt.time.max)),
+        (dt.datetime(2025, 1, 6), end),
+    ]
+    for window_start, window_end in windows:
+        assert is_trading_day(window_start.date()) and is_trading_day(window_end.date())
+        assert (window_end.date() - window_start.date()).days < 5
+
+    covered = {day for window_start, window_end in windows for day in trading_days(window_start.date(), window_end.date())}
+    assert covered == set(trading_days(start.date(), end.date()))
+
+
+def test_no_windows_without_trading_days():
+    assert trading_windows(dt.datetime(2024, 12, 25), dt.datetime(2024, 12, 25, 23, 59), 5) == [] # Christmas
+    assert trading_windows(dt.datetime(2024, 3, 29), dt.datetime(2024, 3, 31, 23, 59), 5) == [] # Good Friday, then the weekend
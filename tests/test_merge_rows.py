@@ -0,0 +1,60 @@
+"""
+DB_Base.merge_rows: merging refetched rows into the stored ones.
+"""
+
+import numpy as np
+import pandas as pd
+from base import DB_Base
+
+
+def bars(minutes, closes):
+    index = pd.DatetimeIndex([pd.Timestamp('2024-01-02 09:30') + pd.Timedelta(minutes=minute) for minute in minutes], name='datetime')
+    return pd.DataFrame({'close': np.asarray(closes, dtype=np.float64), 'volume': np.arange(len(index), dtype=np.float64)}, index=index)
+
+
+STORED = bars(range(5), [10., 11., 12., 13., 14.])
+
+
+def test_identical_rows_change_nothing():
+    data = STORED.iloc[2:].copy()
+    data['close'] *= 1 + DB_Base.REVISION_RTOL/10 # as a text format round-trips them
+    merged, n_added = DB_Base.merge_rows(STORED, data)
+    assert len(merged) == 0
+    assert n_added == 0
+
+
+def test_revised_row():
+    data = STORED.iloc[2:].copy()
+    data.loc[data.index[1], 'close'] = 99.
+    merged, n_added = DB_Base.merge_rows(STORED, data)
+    pd.testing.assert_frame_equal(merged, data.iloc[1:]) # from the first changed row onwards
+    assert n_added == 0
+
+
+def test_new_rows():
+    data = bars([3, 4, 5, 6], [13., 14., 15., 16.])
+    data['volume'] = STORED['volume'].iloc[3:].tolist() + [5., 6.]
+    merged, n_added = DB_Base.merge_rows(STORED, data)
+    pd.testing.assert_frame_equal(merged, data.iloc[2:])
+    assert n_added == 2
+
+
+def test_rows_added_between_stored_ones():
+    stored = STORED.drop(STORED.index[2])
+    merged, n_added = DB_Base.merge_rows(stored, STORED.iloc[2:3])
+    pd.testing.assert_frame_equal(merged, STORED.iloc[2:])
+    assert n_added == 1
+
+
+def test_nothing_stored():
+    merged, n_added = DB_Base.merge_rows(STORED.iloc[:0], STORED)
+    pd.testing.assert_frame_equal(merged, STORED)
+    assert n_added == len(STORED)
+
+
+def test_duplicate_timestamps_keep_the_last_row():
+    data = pd.concat([STORED.iloc[3:4], bars([3], [42.]), STORED.iloc[4:]])
+    merged, n_added = DB_Base.merge_rows(STORED, data)
+    assert merged.index.is_unique
+    assert merged['close'].tolist() == [42., 14.]
+    assert n_added == 0
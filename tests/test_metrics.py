@@ -0,0 +1,52 @@
+"""
+The per-symbol stage breakdown of an update run (see db/metrics.py), against the
+local stand-in APIs of benchmarks/fake_api.py.
+"""
+
+import json
+import os
+import sys
+import pytest
+from bench_update import import_db_class
+from fake_api import serve_in_subprocess
+
+
+def run_update(source: str, work_dir: str):
+    """Create two symbols from scratch with a metrics file, and return the events that were logged.
+    """
+
+    server, base_url = serve_in_subprocess({'latency': 0.02, 'jitter': 0., 'history_days': 3})
+    try:
+        db_class = import_db_class(source, work_dir)
+        if source == 'stock':
+            sys.modules['ameritrade_utils'].PriceHistory.BASE_URL = base_url
+        else:
+            db_class.BASE_URL = base_url
+
+        with open(os.path.join(work_dir, 'symbols.txt'), 'w') as f:
+            f.write('AAA\nBBB\n')
+        os.makedirs(os.path.join(work_dir, 'data'))
+        metrics_file_path = os.path.join(work_dir, 'metrics.jsonl')
+        db = db_class(os.path.join(work_dir, 'symbols.txt'), os.path.join(work_dir, 'data'), os.path.join(work_dir, 'update.log'),
+                        max_workers=2, metrics_file_path=metrics_file_path)
+        results = db.update()
+        assert all(result.status == 'CREATED' for result in results.values()), results
+    finally:
+        server.terminate()
+
+    with open(metrics_file_path, 'r') as f:
+        return [json.loads(line) for line in f]
+
+
+@pytest.mark.parametrize('source', ['stock', 'crypto'])
+def test_http_is_attributed_to_the_symbol(source, tmp_path):
+    events = run_update(source, str(tmp_path))
+
+    http = [event for event in events if event.get('stage') == 'http']
+    assert len(http) > 2 # several windows (or pages) per symbol
+    assert {event['symbol'] for event in http} == {'AAA', 'BBB'}
+
+    for symbol in ('AAA', 'BBB'):
+        seconds = {stage: sum(event['seconds'] for event in events if event.get('stage') == stage and event['symbol'] == symbol)
+                    for stage in ('get_data', 'decode')}
+        assert seconds['decode'] < seconds['get_data'] # the time spent waiting on requests isn't counted as decoding
@@ -0,0 +1,43 @@
+"""
+Filling a gap with DB_Base.stitch outside of an update, against the local stand-in
+APIs of benchmarks/fake_api.py.
+"""
+
+import os
+import sys
+import pandas as pd
+import pytest
+from bench_update import import_db_class
+from fake_api import serve_in_subprocess
+
+
+@pytest.mark.parametrize('source', ['stock', 'crypto'])
+def test_stitch_on_its_own(source, tmp_path):
+    work_dir = str(tmp_path)
+    server, base_url = serve_in_subprocess({'latency': 0., 'jitter': 0., 'history_days': 3})
+    try:
+        db_class = import_db_class(source, work_dir)
+        if source == 'stock':
+            sys.modules['ameritrade_utils'].PriceHistory.BASE_URL = base_url
+        else:
+            db_class.BASE_URL = base_url
+
+        with open(os.path.join(work_dir, 'symbols.txt'), 'w') as f:
+            f.write('AAA\n')
+        os.makedirs(os.path.join(work_dir, 'data'))
+        create = lambda: db_class(os.path.join(work_dir, 'symbols.txt'), os.path.join(work_dir, 'data'), os.path.join(work_dir, 'update.log'))
+        create().update()
+    finally:
+        server.terminate()
+
+    db = create()
+    stored = db.read('AAA')
+    gap = stored.iloc[100:200]
+    db.storage.truncate_from('AAA', gap.index[0])
+    db.storage.append('AAA', stored.iloc[200:])
+
+    db = create() # as when backfilling by hand, without an update in progress
+    assert db.stitch('AAA', gap) == len(gap)
+    pd.testing.assert_frame_equal(db.read('AAA'), stored)
+    assert not db.journal.active
+    assert not os.path.exists(db.journal.file_path)
@@ -0,0 +1,72 @@
+"""
+CsvStorage: reading and truncating by datetime, and repairing a file that a crash cut short.
+"""
+
+import datetime as dt
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from storage import CsvStorage
+
+START = dt.datetime(2024, 1, 2, 9, 30)
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = CsvStorage(str(tmp_path))
+    storage.write('AAA', bars(50))
+    return storage
+
+
+def bars(n_rows):
+    index = pd.DatetimeIndex([START + dt.timedelta(minutes=minute) for minute in range(n_rows)], name='datetime')
+    return pd.DataFrame({'close': 100. + np.arange(n_rows)/3, 'volume': np.arange(n_rows)}, index=index)
+
+
+def minute(n):
+    return START + dt.timedelta(minutes=n)
+
+
+def test_read_range(storage):
+    expected = bars(50)
+    pd.testing.assert_frame_equal(storage.read_range('AAA'), expected, check_freq=False)
+    pd.testing.assert_frame_equal(storage.read_range('AAA', minute(10), minute(20)), expected.iloc[10:21], check_freq=False)
+    pd.testing.assert_frame_equal(storage.read_range('AAA', minute(9.5), minute(20.5)), expected.iloc[10:21], check_freq=False)
+    pd.testing.assert_frame_equal(storage.read_range('AAA', minute(45)), expected.iloc[45:], check_freq=False)
+    pd.testing.assert_frame_equal(storage.read_range('AAA', end=minute(0)), expected.iloc[:1], check_freq=False)
+    assert len(storage.read_range('AAA', minute(60))) == 0
+    assert storage.read_range('AAA', columns=['close']).columns.tolist() == ['close']
+
+
+def test_read_range_round_trips_floats(storage):
+    assert (storage.read_range('AAA')['close'].values == bars(50)['close'].values).all()
+
+
+def test_truncate_from(storage):
+    storage.truncate_from('AAA', minute(30))
+    assert storage.n_rows('AAA') == 30
+    assert storage.last_dtime('AAA') == minute(29)
+
+    storage.truncate_from('AAA', minute(60)) # after the last row
+    assert storage.n_rows('AAA') == 30
+
+    storage.truncate_from('AAA', minute(-1)) # before the first row
+    assert storage.n_rows('AAA') == 0
+    assert storage.last_dtime('AAA') is None
+
+
+def test_repair_torn_tail(storage):
+    with open(storage.path('AAA'), 'ab') as f:
+        f.write(b'2024-01-02 10:20:00,116.6') # a crash in the middle of an append
+    assert storage.repair('AAA')
+    pd.testing.assert_frame_equal(storage.read_range('AAA'), bars(50), check_freq=False)
+    assert not storage.repair('AAA') # nothing left to repair
+
+
+def test_repair_torn_header(tmp_path):
+    storage = CsvStorage(str(tmp_path))
+    with open(storage.path('AAA'), 'wb') as f:
+        f.write(b'datetime,clo')
+    assert storage.repair('AAA')
+    assert os.path.getsize(storage.path('AAA')) == 0